@@ -5,12 +5,27 @@ import argparse
 import shutil
 import sys
 import re
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+
+import media_probe
+from ffmpeg_encoders import pick_encoder, encoder_args
 
 # ================= 設定エリア =================
 BASE_WORK_DIR = "fix_work"
+FIX_WORKERS = 2   # 同時に修復する動画の本数（NVENC はセッション数に上限があるので控えめに）
 # ============================================
 
 sys.stdout.reconfigure(encoding='utf-8')
+_print_lock = threading.Lock()
+
+def log(msg):
+    """並列で修復していても1行ずつ出す"""
+    with _print_lock:
+        print(msg, flush=True)
 
 def get_safe_base_name(filename):
     base_name = os.path.splitext(os.path.basename(filename))[0]
@@ -18,49 +33,29 @@ def get_safe_base_name(filename):
     return safe_name
 
 def get_exact_duration(file_path):
-    cmd = [
-        "ffprobe", "-v", "error", 
-        "-select_streams", "v:0",
-        "-show_entries", "stream=duration", 
-        "-of", "default=noprint_wrappers=1:nokey=1", 
-        file_path
-    ]
-    try:
-        res = subprocess.run(cmd, stdout=subprocess.PIPE, text=True)
-        dur = float(res.stdout.strip())
-        if dur > 0: return dur
-    except: pass
-    
-    cmd2 = [
-        "ffprobe", "-v", "error", 
-        "-show_entries", "format=duration", 
-        "-of", "default=noprint_wrappers=1:nokey=1", 
-        file_path
-    ]
-    try:
-        res = subprocess.run(cmd2, stdout=subprocess.PIPE, text=True)
-        return float(res.stdout.strip())
-    except: return 0.0
-
-# ★フレーム数を正確に数える関数
+    # 映像ストリームの尺 → コンテナの尺 の順で取る（結果はキャッシュされる）
+    duration = media_probe.get_duration(file_path)
+    if duration <= 0:
+        cap = cv2.VideoCapture(file_path)
+        if cap.isOpened() and cap.get(cv2.CAP_PROP_FPS) > 0:
+            duration = cap.get(cv2.CAP_PROP_FRAME_COUNT) / cap.get(cv2.CAP_PROP_FPS)
+        cap.release()
+    return duration
+
+# ★フレーム数を正確に数える関数（デコードせず、コンテナのフレーム数かパケット数を使う）
 def count_frames_exact(file_path):
-    cmd = [
-        "ffprobe", "-v", "error",
-        "-select_streams", "v:0",
-        "-count_frames",
-        "-show_entries", "stream=nb_read_frames",
-        "-of", "default=noprint_wrappers=1:nokey=1",
-        file_path
-    ]
-    try:
-        res = subprocess.run(cmd, stdout=subprocess.PIPE, text=True)
-        frames = int(res.stdout.strip())
-        if frames > 0: return frames
-    except: pass
-    return 0
-
-def fix_single_video(origin_path, chunk_files, output_path):
-    print(f"   ... Checking {len(chunk_files)} candidate files...")
+    frames = media_probe.get_frame_count(file_path)
+    if frames <= 0:
+        # ffprobe が無い環境ではコンテナのメタデータを OpenCV で読む（こちらもデコードしない）
+        cap = cv2.VideoCapture(file_path)
+        frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT)) if cap.isOpened() else 0
+        cap.release()
+    return frames
+
+def fix_single_video(origin_path, chunk_files, output_path, label=""):
+    """パーツを連結し、元動画の尺に合わせて均等にリタイミングして音声と合成する。
+    作業ファイルは動画ごとの一時フォルダに置くので、複数本を同時に実行できる"""
+    log(f"   {label}... Checking {len(chunk_files)} candidate files...")
 
     # 1. 重複排除ロジック
     chunk_map = {}
@@ -83,85 +78,78 @@ def fix_single_video(origin_path, chunk_files, output_path):
         if len(candidates) > 1:
             candidates.sort()
             selected = candidates[0]
-            print(f"   ⚠️ Warning: Part {idx:03d} has duplicates! Using: {os.path.basename(selected)}")
+            log(f"   {label}⚠️ Warning: Part {idx:03d} has duplicates! Using: {os.path.basename(selected)}")
             final_list.append(selected)
         else:
             final_list.append(candidates[0])
 
     if not final_list:
-        print("   ❌ Valid chunks not found.")
-        return
+        log(f"   {label}❌ Valid chunks not found.")
+        return False
+
+    log(f"   {label}✅ Merging {len(final_list)} unique chunks...")
 
-    print(f"   ✅ Merging {len(final_list)} unique chunks...")
+    work_dir = tempfile.mkdtemp(prefix="tmp_", dir=BASE_WORK_DIR)
+    try:
+        return _retime_and_mux(origin_path, final_list, output_path, work_dir, label)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
 
-    # 2. 結合リスト作成
-    list_txt = "temp_batch_list.txt"
+def _retime_and_mux(origin_path, final_list, output_path, work_dir, label):
+    # 1. 結合リスト作成（連結結果はファイルに書き出さず、そのまま最終エンコードの入力にする）
+    list_txt = os.path.join(work_dir, "concat_list.txt")
     with open(list_txt, "w", encoding="utf-8") as f:
         for vid in final_list:
             abs_path = os.path.abspath(vid).replace("'", "'\\''")
             f.write(f"file '{abs_path}'\n")
 
-    # 3. 一時結合（映像のみ）
-    temp_concat = "temp_batch_concat.mp4"
-    if os.path.exists(temp_concat): os.remove(temp_concat)
-    
-    subprocess.run([
-        "ffmpeg", "-y", "-f", "concat", "-safe", "0", "-i", list_txt, 
-        "-c", "copy", temp_concat
-    ], stderr=subprocess.DEVNULL)
-
-    # 4. 強制リタイミング計算 (Total Frames / Original Duration)
+    # 2. 強制リタイミング計算 (Total Frames / Original Duration)
+    # フレーム数はパーツごとのメタデータを足し合わせる（連結結果をデコードして数えない・結果はキャッシュされる）
     duration_orig = get_exact_duration(origin_path)
-    total_frames = count_frames_exact(temp_concat)
-    
-    print(f"   📏 Original Duration: {duration_orig:.4f}s")
-    print(f"   🎞️ Total AI Frames: {total_frames}")
+    frame_counts = [count_frames_exact(vid) for vid in final_list]
+    total_frames = sum(frame_counts) if all(frame_counts) else 0
+
+    log(f"   {label}📏 Original Duration: {duration_orig:.4f}s")
+    log(f"   {label}🎞️ Total AI Frames: {total_frames} ({len(final_list)} parts)")
 
     if duration_orig > 0 and total_frames > 0:
         # setpts = N * (DURATION / FRAMES) / TB
         # フレーム番号(N)に基づいて時間を再構築。PTSのズレを無視して均等配置する。
         retime_expr = f"N*({duration_orig}/{total_frames})/TB"
-        print(f"   ⚡ Re-Timing: Force-distributing {total_frames} frames over {duration_orig}s")
+        log(f"   {label}⚡ Re-Timing: Force-distributing {total_frames} frames over {duration_orig}s")
     else:
-        print("   ⚠️ Stat check failed. Using standard sync.")
+        log(f"   {label}⚠️ Stat check failed. Using standard sync.")
         retime_expr = "PTS-STARTPTS"
 
-    # 5. 強制同期合成
+    # 3. 強制同期合成（使えるエンコーダーを実際に試して選ぶ: nvenc → qsv → vaapi → libx264）
+    encoder = pick_encoder()
+    pre, vf, enc_out = encoder_args(encoder)
+    video_filter = f"[0:v]setpts={retime_expr}" + (f",{vf}" if vf else "") + "[v]"
+    log(f"   {label}🎞️ エンコーダー: {encoder}")
     cmd_final = [
-        "ffmpeg", "-y",
-        "-i", temp_concat,       # [0] AI映像
+        "ffmpeg", "-y", *pre,
+        "-f", "concat", "-safe", "0", "-i", list_txt,   # [0] AI映像（連結）
         "-i", origin_path,       # [1] 元動画(音声)
-        "-filter_complex", f"[0:v]setpts={retime_expr}[v]", 
+        "-filter_complex", video_filter, 
         "-map", "[v]",           
         "-map", "1:a?",          # 元の音声(絶対)
-        "-c:v", "libx264",       # 再エンコード
-        "-preset", "p5",            
-        "-crf", "18",               
+        *enc_out,                # 再エンコード
         "-fps_mode", "passthrough", # 勝手なフレーム削除を防ぐ
         "-c:a", "aac",           
         output_path
     ]
 
-    # GPUエンコードチェック
-    try:
-        subprocess.run(["ffmpeg", "-hide_banner", "-encoders"], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
-        cmd_final[cmd_final.index("-c:v") + 1] = "h264_nvenc"
-    except:
-        pass 
-
     try:
         subprocess.run(cmd_final, check=True, stderr=subprocess.DEVNULL)
-        print(f"   ✅ 完了: {os.path.basename(output_path)}")
+        log(f"   {label}✅ 完了: {os.path.basename(output_path)}")
+        return True
     except subprocess.CalledProcessError:
-        print("   ❌ 合成失敗。単純コピーでリトライします。")
-        subprocess.run([
-            "ffmpeg", "-y", "-i", temp_concat, "-i", origin_path,
+        log(f"   {label}❌ 合成失敗。単純コピーでリトライします。")
+        res = subprocess.run([
+            "ffmpeg", "-y", "-f", "concat", "-safe", "0", "-i", list_txt, "-i", origin_path,
             "-map", "0:v", "-map", "1:a?", "-c", "copy", output_path
         ], stderr=subprocess.DEVNULL)
-    
-    # 掃除
-    if os.path.exists(list_txt): os.remove(list_txt)
-    if os.path.exists(temp_concat): os.remove(temp_concat)
+        return res.returncode == 0
 
 def main():
     origin_dir = os.path.join(BASE_WORK_DIR, "Origin")
@@ -182,8 +170,10 @@ def main():
         print("2. 'fix_work/AInized' に生成された断片動画(_part_xxx.mp4)を入れてください。")
         return
 
-    print(f"\n=== 全自動修復バッチ処理 (強制リタイミングモード) ===\n")
+    print(f"\n=== 全自動修復バッチ処理 (強制リタイミングモード / 並列 {FIX_WORKERS}) ===\n")
 
+    # パーツの割り当ては先にまとめて決め、重いエンコードだけを並列に回す
+    tasks = []
     for i, origin_path in enumerate(origin_files):
         filename = os.path.basename(origin_path)
         print(f"[{i+1}/{len(origin_files)}] ターゲット: {filename}")
@@ -222,9 +212,16 @@ def main():
         fixed_filename = f"Fixed_{filename}"
         fixed_output_path = os.path.join(output_dir, fixed_filename)
         
-        fix_single_video(origin_path, target_chunks, fixed_output_path)
+        tasks.append((origin_path, target_chunks, fixed_output_path, f"[{safe_name}] "))
+
+    if not tasks:
+        return
+    pick_encoder()   # エンコーダーの判定は並列実行の前に1回だけ
+    with ThreadPoolExecutor(max_workers=FIX_WORKERS) as pool:
+        results = list(pool.map(lambda t: fix_single_video(*t), tasks))
 
-    print("\n=== 全ての処理が完了しました ===")
+    failed = sum(1 for ok in results if not ok)
+    print(f"\n=== 全ての処理が完了しました ({len(results) - failed}/{len(results)} 成功) ===")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
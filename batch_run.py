@@ -1,9 +1,22 @@
 import os
+import argparse
 import glob
 import subprocess
 import time
 import shutil
 import sys
+import threading
+import queue
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import disk_budget
+import media_probe
+import pipeline_metrics as metrics
+import process_video
+import renditions
+import throughput_estimate
+from folder_watch import FolderWatcher
+from job_queue import JobQueue
 
 # 文字化け対策
 sys.stdout.reconfigure(encoding='utf-8')
@@ -19,17 +32,34 @@ USER_HOME = os.path.expanduser("~")
 COMFYUI_OUTPUT_DIR = os.path.join(USER_HOME, "ComfyUI", "output")
 
 EXTENSIONS = ["*.mp4", "*.avi", "*.mov", "*.mkv"]
+
+CPU_BUDGET = os.cpu_count() or 4   # CFR変換に使ってよいCPUスレッド数の合計
+CONVERT_THREADS = 4                # 変換1本あたりの ffmpeg スレッド数
+CONVERT_WORKERS = max(1, CPU_BUDGET // CONVERT_THREADS)   # 同時に走らせる変換の本数
+
+# VFR/他fpsの入力の扱い: "reencode" = 従来どおりCFRへ再エンコード,
+#                       "force_rate" = 変換せず VHS_LoadVideo の force_rate で読み込み時にfpsを揃える
+VFR_STRATEGY = "reencode"
+FPS_TOLERANCE = 0.001     # fps がこの差（fps）以内なら TARGET_FPS と同じとみなす。29.97 を 30 扱いすると1時間で約3.6秒ずれる
+REMUX_CODECS = ("h264", "hevc")
+MAX_CFR_COPIES = 2        # 一時CFRファイルを同時に置いておく本数の上限（生成中の分を含む）。変換は前の動画が片付くのを待って行う
+GLOBAL_SCHEDULER = True   # True: 全動画のチャンクを1つのキューで GPU に流し、結合は裏で行う（方針は process_video.SCHEDULE_POLICY）
+                          # False: 従来どおり1本ずつ処理する（process_video.VideoJob）
+
+# --watch（常駐）モード
+WATCH_PRIORITY = 0        # フォルダに置かれた動画の優先度（大きいほど先。job_queue.py priority で変更可）
 # ============================================
 
-def get_latest_merged_file(directory):
-    search_pattern = os.path.join(directory, "*_merged.mp4")
-    files = glob.glob(search_pattern)
-    if not files: return None
-    return max(files, key=os.path.getctime)
+_print_lock = threading.Lock()
+
+def log(msg):
+    """変換スレッドと生成側の出力が混ざらないように1行ずつ出す"""
+    with _print_lock:
+        print(msg, flush=True)
 
-def convert_to_cfr(input_path, output_path):
+def convert_to_cfr(input_path, output_path, threads=CONVERT_THREADS):
     """動画を強制的に固定フレームレート(CFR)に変換する"""
-    print(f"   ...Converting: {os.path.basename(input_path)}")
+    log(f"   ...Converting: {os.path.basename(input_path)}")
     
     # 絶対パスに変換（FFmpegのパス解決ミスを防ぐ）
     abs_input = os.path.abspath(input_path)
@@ -39,6 +69,7 @@ def convert_to_cfr(input_path, output_path):
         "ffmpeg", "-y", "-i", abs_input,
         "-r", str(TARGET_FPS), 
         "-c:v", "libx264", "-preset", "fast", "-crf", "20",
+        "-threads", str(threads),
         "-c:a", "aac", 
         abs_output
     ]
@@ -47,72 +78,217 @@ def convert_to_cfr(input_path, output_path):
         subprocess.run(cmd, check=True, capture_output=True, text=True)
         return True
     except subprocess.CalledProcessError as e:
-        print(f"   ❌ Conversion failed.")
+        log(f"   ❌ Conversion failed: {os.path.basename(input_path)}")
         # エラー内容の一部を表示（最後の2行など）
-        print(f"   [Error Log]: {e.stderr[-300:]}") 
+        log(f"   [Error Log]: {e.stderr[-300:]}") 
+        return False
+
+def choose_cfr_strategy(info):
+    """probe 結果から変換方法を決める: passthrough / remux / force_rate / reencode"""
+    if info is None or not info["duration"]:
+        return "reencode"
+    if info["is_cfr"] and abs(info["fps"] - TARGET_FPS) <= FPS_TOLERANCE:
+        return "passthrough"
+    # VFR でタイムスタンプが揺れているだけで、実際のフレーム数が TARGET_FPS ちょうど → 付け替えで足りる。
+    # 付け替えは TARGET_FPS で打ち直すので、フレーム数が 尺 x TARGET_FPS と合わなければ音声とずれる。
+    # 別の fps の CFR（29.97 など）は付け替えない
+    if not info["is_cfr"] and info["codec"] in REMUX_CODECS and info["frame_count"]:
+        actual_fps = info["frame_count"] / info["duration"]
+        expected_frames = info["duration"] * TARGET_FPS
+        if abs(actual_fps - TARGET_FPS) <= FPS_TOLERANCE or abs(info["frame_count"] - expected_frames) <= 0.5:
+            return "remux"
+    if VFR_STRATEGY == "force_rate":
+        return "force_rate"
+    return "reencode"
+
+def remux_to_cfr(input_path, output_path, codec):
+    """映像は再エンコードせず、生ストリームに取り出して TARGET_FPS で等間隔に付け直す"""
+    log(f"   ...Remuxing: {os.path.basename(input_path)}")
+    abs_input = os.path.abspath(input_path)
+    fmt = "hevc" if codec == "hevc" else "h264"
+    extract = subprocess.Popen([
+        "ffmpeg", "-v", "error", "-i", abs_input,
+        "-map", "0:v:0", "-c:v", "copy", "-bsf:v", f"{fmt}_mp4toannexb", "-f", fmt, "-"
+    ], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    try:
+        subprocess.run([
+            "ffmpeg", "-y", "-v", "error",
+            "-r", str(TARGET_FPS), "-f", fmt, "-i", "-",
+            "-i", abs_input,
+            "-map", "0:v", "-map", "1:a?", "-c", "copy",
+            os.path.abspath(output_path)
+        ], stdin=extract.stdout, check=True, stderr=subprocess.PIPE, text=True)
+        extract.stdout.close()
+        return extract.wait() == 0
+    except subprocess.CalledProcessError as e:
+        log(f"   ⚠️ Remux failed: {os.path.basename(input_path)} {e.stderr[-200:] if e.stderr else ''}")
         return False
+    finally:
+        if extract.poll() is None:
+            extract.kill()
+
+def prepare_cfr(video_path, reserve=None):
+    """1本ぶんのCFR準備。成功したら {"original", "input", "temporary", "force_rate"} を返す。
+    すでに TARGET_FPS の CFR ならそのまま渡し、変換は必要な時だけ行う。
+    reserve(video_path) は一時ファイルを書く直前（リマックス・再エンコードの時だけ）に呼ばれる"""
+    filename = os.path.basename(video_path)
+    with metrics.timed("probe", video=filename):
+        info = media_probe.probe(video_path)
+    strategy = choose_cfr_strategy(info)
+    frames = info["frame_count"] if info else None
+    with metrics.timed("cfr_prepare", frames, video=filename, strategy=strategy) as m:
+        prepared = _prepare_cfr(video_path, info, strategy, reserve)
+        m["status"] = "ok" if prepared else "error"
+    return prepared
+
+def _prepare_cfr(video_path, info, strategy, reserve=None):
+    filename = os.path.basename(video_path)
+    if strategy == "passthrough":
+        log(f"   ✅ Already {TARGET_FPS}fps CFR: {filename} (no conversion)")
+        return {"original": video_path, "input": video_path, "temporary": False, "force_rate": None}
+    if strategy == "force_rate":
+        log(f"   ✅ VFR source, resampling in the loader (force_rate={TARGET_FPS}): {filename}")
+        return {"original": video_path, "input": video_path, "temporary": False, "force_rate": TARGET_FPS}
+
+    # 拡張子を除いたファイル名を取得
+    basename_no_ext = os.path.splitext(filename)[0]
+    
+    # 一時ファイル名に特殊文字が含まれないようにハッシュ化などを検討すべきだが、
+    # まずは絶対パスで解決を図る
+    temp_cfr_path = os.path.join(TEMP_CFR_DIR, f"{basename_no_ext}_cfr.mp4")
+
+    if os.path.exists(temp_cfr_path):
+        # 読めない（途中で止まった等）ファイルは再作成。probe 結果はキャッシュされるので再実行時は一瞬
+        info = media_probe.probe(temp_cfr_path)
+        if os.path.getsize(temp_cfr_path) > 1024 and (info is None or info["frame_count"] > 0):
+            log(f"   ✅ Already converted: {filename}")
+            return {"original": video_path, "input": temp_cfr_path, "temporary": True, "force_rate": None}
+        else:
+            os.remove(temp_cfr_path)
+
+    if reserve is not None:
+        reserve(video_path)
+    if strategy == "remux" and remux_to_cfr(video_path, temp_cfr_path, info["codec"]):
+        log(f"   ✅ Remuxed (no re-encode): {filename}")
+        return {"original": video_path, "input": temp_cfr_path, "temporary": True, "force_rate": None}
+
+    if convert_to_cfr(video_path, temp_cfr_path):
+        log(f"   ✅ Converted: {filename}")
+        return {"original": video_path, "input": temp_cfr_path, "temporary": True, "force_rate": None}
+    log(f"   ⚠️ Skipping {filename} due to conversion error.")
+    return None
+
+class CfrFeeder:
+    """CFR 準備を生成の進みに合わせて行う（全部を先に変換してディスクを埋めない）。
+    一時CFRファイルは MAX_CFR_COPIES 本までで、release された分だけ次の変換を始める。
+    空きが disk_budget.MIN_FREE_GB を切りそうなら、変換を始める前に空くのを待つ"""
+
+    def __init__(self, raw_files, max_copies=MAX_CFR_COPIES):
+        self.raw_files = raw_files
+        self.slots = threading.Semaphore(max(1, max_copies))
+        self.ready = queue.Queue()   # 準備できた順に prepared。最後に None
+        self.live = 0                # 渡したまま release されていない一時CFRファイルの本数
+        self._lock = threading.Lock()
+
+    def start(self):
+        threading.Thread(target=self._run, daemon=True).start()
+        return self
+
+    def _run(self):
+        with ThreadPoolExecutor(max_workers=CONVERT_WORKERS) as pool:
+            futures = []
+            for video_path in self.raw_files:
+                self.slots.acquire()
+                futures.append(pool.submit(self._prepare, video_path))
+            wait(futures)
+        self.ready.put(None)
+
+    def _prepare(self, video_path):
+        prepared = None
+        try:
+            prepared = prepare_cfr(video_path, self._reserve)
+        except Exception as e:
+            log(f"   ⚠️ Skipping {os.path.basename(video_path)}: {e}")
+        finally:
+            # 一時ファイルを作らなかった（元のまま使える・失敗した）分は、すぐ次の変換に枠を回す
+            if prepared is not None and prepared["temporary"]:
+                prepared["cfr_slot"] = True
+                with self._lock:
+                    self.live += 1
+            else:
+                self.slots.release()
+        if prepared is not None:
+            self.ready.put(prepared)
+
+    def release(self, prepared):
+        """その動画の生成が終わり（または諦め）、一時CFRファイルが要らなくなった"""
+        if prepared.pop("cfr_slot", False):
+            with self._lock:
+                self.live -= 1
+            self.slots.release()
+
+    def _reserve(self, video_path):
+        """変換を始める前に空きを確認する。生成中の一時ファイルがあれば、それが片付いて空くのを待つ"""
+        disk_budget.wait_for_room(TEMP_CFR_DIR, os.path.getsize(video_path),
+                                  f"converting {os.path.basename(video_path)}", can_free=lambda: self.live > 0)
+
+def process_with_ai(prepared, is_cancelled=None):
+    """process_video.VideoJob で生成して出力を整理する。"done" / "failed" / "cancelled" を返す。
+    is_cancelled() が True を返したら生成を止める（--watch モードのキャンセル用）"""
+    filename = os.path.basename(prepared["original"])
+    video = process_video.VideoJob(prepared["input"], WORKFLOW_FILE, force_rate=prepared["force_rate"])
+    with metrics.timed("generate", video=filename) as m:
+        result = video.run(is_cancelled)
+        m["status"] = {"done": "ok", "failed": "error"}.get(result["status"], result["status"])
+    return save_result(result, prepared)
+
+def save_result(result, prepared):
+    """process_video.job_result() の結果を受けて、出力を元動画の名前にし、元動画を片付ける。
+    "done" / "failed" / "cancelled" を返す"""
+    filename = os.path.basename(prepared["original"])
+    if result["status"] == "cancelled":
+        log(f"   🛑 Cancelled: {filename}")
+        return "cancelled"
+    if result["status"] != "done":
+        log(f"   ❌ Error occurred during AI processing: {filename}")
+        return "failed"
+    chunks, timings = result["chunks"], result["timings"]
+    log(f"   ✅ Generation Completed: {chunks['rendered']} chunks rendered, {chunks['skipped']} skipped, "
+        f"{chunks['restored']} from cache (render {timings.get('render', 0):.0f}s, merge {timings.get('merge', 0):.0f}s)")
+    output = rename_output(result["output"], prepared["original"])
+    log(f"   ✨ Output saved to: ComfyUI/output/{os.path.basename(output)}")
+    for name, path in result["renditions"].items():
+        if name == "master":
+            continue
+        # 縮小版・サムネイルも master と同じ名前にそろえる
+        target = renditions.output_path(output, name)
+        try:
+            if target != path: os.replace(path, target)
+            log(f"      + {os.path.basename(target)}")
+        except OSError:
+            log(f"      + {os.path.basename(path)}")
+    finish_original(prepared)
+    return "done"
 
 def main():
     for d in [INPUT_DIR, TEMP_CFR_DIR, DONE_DIR]:
         if not os.path.exists(d):
             os.makedirs(d)
 
-    raw_files = []
-    for ext in EXTENSIONS:
-        candidates = glob.glob(os.path.join(INPUT_DIR, ext))
-        for f in candidates:
-            if "temp_cfr_ready" not in f:
-                raw_files.append(f)
-    
-    raw_files.sort()
-
+    raw_files = find_input_videos()
     if not raw_files:
         print(f"⚠️ No video files found in '{INPUT_DIR}'.")
         return
 
     # ==========================================
-    # Phase 1: CFR変換
+    # Phase 1: 確認
     # ==========================================
-    print(f"\n🎬 === Phase 1: Converting {len(raw_files)} videos to {TARGET_FPS}fps CFR ===")
-    
-    converted_list = [] 
-
-    for i, video_path in enumerate(raw_files):
-        filename = os.path.basename(video_path)
-        # 拡張子を除いたファイル名を取得
-        basename_no_ext = os.path.splitext(filename)[0]
-        
-        # 一時ファイル名に特殊文字が含まれないようにハッシュ化などを検討すべきだが、
-        # まずは絶対パスで解決を図る
-        temp_cfr_path = os.path.join(TEMP_CFR_DIR, f"{basename_no_ext}_cfr.mp4")
-
-        print(f"[{i+1}/{len(raw_files)}] {filename}")
-        
-        if os.path.exists(temp_cfr_path):
-            # サイズが0バイトなら破損しているので再作成
-            if os.path.getsize(temp_cfr_path) > 1024:
-                print("   ✅ Already converted. Skipping.")
-                converted_list.append((video_path, temp_cfr_path))
-                continue
-            else:
-                os.remove(temp_cfr_path)
+    print(f"\n🎬 === {len(raw_files)} videos found ===")
+    for video_path in raw_files:
+        print(f"   - {os.path.basename(video_path)}")
 
-        if convert_to_cfr(video_path, temp_cfr_path):
-            converted_list.append((video_path, temp_cfr_path))
-        else:
-            print(f"   ⚠️ Skipping {filename} due to conversion error.")
-
-    if not converted_list:
-        print("\n❌ No videos were successfully converted. Check filenames or FFmpeg.")
-        return
-
-    print(f"\n✨ {len(converted_list)} videos are ready for AI processing.")
-    
-    # ==========================================
-    # Phase 2: 確認
-    # ==========================================
     while True:
-        choice = input("\n🚀 Proceed with AI Upscaling for listed files? (y/n): ").lower()
+        choice = input("\n🚀 Proceed with CFR conversion + AI Upscaling for listed files? (y/n): ").lower()
         if choice in ['y', 'yes']:
             break
         elif choice in ['n', 'no']:
@@ -120,56 +296,219 @@ def main():
             sys.exit(0)
 
     # ==========================================
-    # Phase 3: AI生成
+    # Phase 2+3: CFR変換（CPU・並列）と AI生成（GPU）をパイプラインで実行
+    # 変換が終わった動画から順に生成に回し、残りの変換は裏で続ける
     # ==========================================
-    print(f"\n🤖 === Phase 3: Starting AI Processing for {len(converted_list)} videos ===")
-
-    for i, (original_path, cfr_path) in enumerate(converted_list):
-        filename = os.path.basename(original_path)
-        basename_no_ext = os.path.splitext(filename)[0]
-        
-        print(f"\n🔥 Processing [{i+1}/{len(converted_list)}]: {filename}")
-
-        before_latest = get_latest_merged_file(COMFYUI_OUTPUT_DIR)
-        before_time = os.path.getctime(before_latest) if before_latest else 0
+    print(f"\n🤖 === Preparing {TARGET_FPS}fps CFR inputs with {CONVERT_WORKERS} workers "
+          f"x {CONVERT_THREADS} threads, upscaling as soon as each is ready ===")
 
-        cmd = [sys.executable, "process_video.py", cfr_path, WORKFLOW_FILE]
-        
-        try:
-            subprocess.run(cmd, check=True)
-            print(f"   ✅ Generation Completed.")
-
-            after_latest = get_latest_merged_file(COMFYUI_OUTPUT_DIR)
-            
-            if after_latest and os.path.getctime(after_latest) > before_time:
-                new_name = f"{basename_no_ext}_upscaled.mp4"
-                new_path = os.path.join(COMFYUI_OUTPUT_DIR, new_name)
-                try:
-                    if os.path.exists(new_path):
-                        base, ext = os.path.splitext(new_name)
-                        new_name = f"{base}_{int(time.time())}{ext}"
-                        new_path = os.path.join(COMFYUI_OUTPUT_DIR, new_name)
-                    os.rename(after_latest, new_path)
-                    print(f"   ✨ Output saved to: ComfyUI/output/{new_name}")
-                except OSError: pass
-            else:
-                print("   ⚠️ Warning: Output file not found.")
+    metrics.set_context(batch=time.strftime("%Y%m%d-%H%M%S"))
+    processed = 0
+    if GLOBAL_SCHEDULER:
+        processed = run_global_scheduler(raw_files)
+    else:
+        feeder = CfrFeeder(raw_files).start()
+        while True:
+            prepared = feeder.ready.get()
+            if prepared is None:
+                break
+            processed += 1
+            log(f"\n🔥 Processing [{processed}/{len(raw_files)}]: {os.path.basename(prepared['original'])}")
+            process_with_ai(prepared)
+            feeder.release(prepared)
 
-            # 移動と掃除
-            shutil.move(original_path, os.path.join(DONE_DIR, filename))
-            if os.path.exists(cfr_path):
-                os.remove(cfr_path)
-            
-            print(f"   🚚 Finished & Moved to done.")
-
-        except subprocess.CalledProcessError:
-            print(f"   ❌ Error occurred during AI processing.")
+    if processed == 0:
+        print("\n❌ No videos were successfully converted. Check filenames or FFmpeg.")
+        return
 
     if not os.listdir(TEMP_CFR_DIR):
         try: os.rmdir(TEMP_CFR_DIR)
         except: pass
 
+    for line in metrics.summary_lines():
+        print(line)
+    metrics.write_prometheus("batch_run")
     print("\n🎉 === All Jobs Finished Successfully! ===")
 
+def find_input_videos():
+    raw_files = []
+    for ext in EXTENSIONS:
+        candidates = glob.glob(os.path.join(INPUT_DIR, ext))
+        for f in candidates:
+            if "temp_cfr_ready" not in f:
+                raw_files.append(f)
+    return sorted(raw_files)
+
+def dry_run():
+    """INPUT_DIR の動画を変換せずに数か所だけ試し描きし、1本ごとと全体の所要時間・推奨チャンク長を表示する"""
+    raw_files = find_input_videos()
+    if not raw_files:
+        print(f"⚠️ No video files found in '{INPUT_DIR}'.")
+        return
+    estimates = []
+    for video_path in raw_files:
+        # CFR 変換はせず、TARGET_FPS でなければローダーの force_rate で本番と同じフレーム数にして測る
+        strategy = choose_cfr_strategy(media_probe.probe(video_path))
+        force_rate = None if strategy == "passthrough" else TARGET_FPS
+        estimate = process_video.dry_run(video_path, WORKFLOW_FILE, force_rate=force_rate)
+        if estimate is None:
+            log(f"   ⚠️ Could not estimate {os.path.basename(video_path)}.")
+            continue
+        estimates.append(estimate)
+    throughput_estimate.print_batch(estimates)
+
+def finish_original(prepared):
+    """元動画を DONE_DIR へ移し、一時CFRファイルを消す"""
+    shutil.move(prepared["original"], os.path.join(DONE_DIR, os.path.basename(prepared["original"])))
+    if prepared["temporary"] and os.path.exists(prepared["input"]):
+        os.remove(prepared["input"])
+    log(f"   🚚 Finished & Moved to done.")
+
+def rename_output(output_path, original_path):
+    """出力名を元動画の名前 ({元の名前}_upscaled.mp4) に揃える（CFR 変換した一時ファイル名が付いているため）"""
+    new_name = f"{os.path.splitext(os.path.basename(original_path))[0]}_upscaled.mp4"
+    new_path = os.path.join(os.path.dirname(output_path), new_name)
+    if new_path == output_path:
+        return output_path
+    if os.path.exists(new_path):
+        base, ext = os.path.splitext(new_name)
+        new_path = os.path.join(os.path.dirname(output_path), f"{base}_{int(time.time())}{ext}")
+    try:
+        os.rename(output_path, new_path)
+        return new_path
+    except OSError:
+        return output_path
+
+def on_video_finished(state, feeder=None):
+    """グローバルスケジューラで1本ぶんの結合が終わった時（CPU 側のスレッドから呼ばれる）"""
+    prepared = state["source"]["prepared"]
+    try:
+        save_result(process_video.job_result(state), prepared)
+    finally:
+        if feeder is not None:
+            feeder.release(prepared)
+
+def run_global_scheduler(raw_files):
+    """CFR 準備が済んだ動画から順に、1つのチャンクキューへ入れていく。戻り値は処理を始めた本数"""
+    feeder = CfrFeeder(raw_files).start()
+    sources = queue.Queue()
+    admitted = []
+
+    def feed():
+        while True:
+            prepared = feeder.ready.get()
+            if prepared is None:
+                break
+            admitted.append(prepared)
+            log(f"\n🔥 Queued chunks of [{len(admitted)}/{len(raw_files)}]: {os.path.basename(prepared['original'])}")
+            sources.put({"video": prepared["input"], "original": prepared["original"],
+                         "force_rate": prepared["force_rate"], "prepared": prepared})
+        sources.put(None)
+
+    threading.Thread(target=feed, daemon=True).start()
+    with metrics.timed("generate", videos=len(raw_files)):
+        process_video.batch_process(sources, WORKFLOW_FILE, on_finished=lambda state: on_video_finished(state, feeder))
+    return len(admitted)
+
+def discard_prepared(prepared):
+    if prepared and prepared["temporary"] and os.path.exists(prepared["input"]):
+        os.remove(prepared["input"])
+
+def watch_input_dir(watcher, job_queue_db, stop_event):
+    """書き込みが終わった新しい動画をキューに登録し続ける（別スレッド）。
+    inotify ならイベントが来るまで走査しない（止める時は watcher.wake() で起こす）。ポーリング時は1秒ごとに止めるか確認する"""
+    max_wait = None if watcher.mode == "inotify" else 1.0
+    while not stop_event.is_set():
+        for path in watcher.poll(job_queue_db.known, max_wait=max_wait):
+            job_id = job_queue_db.add(path, WATCH_PRIORITY)
+            if job_id:
+                log(f"📥 Queued #{job_id}: {os.path.basename(path)}")
+
+def serve():
+    """常駐モード: INPUT_DIR を見張り、置かれた動画を優先度順に処理し続ける（確認プロンプトなし）。
+    ジョブは job_queue.sqlite に残るので、落ちても再起動すれば続きから。操作は job_queue.py で行う"""
+    for d in [INPUT_DIR, TEMP_CFR_DIR, DONE_DIR]:
+        os.makedirs(d, exist_ok=True)
+    job_queue_db = JobQueue()
+    requeued = job_queue_db.requeue_running()
+    if requeued:
+        print(f"🔄 {requeued} interrupted jobs put back in the queue.")
+    watcher = FolderWatcher(INPUT_DIR, EXTENSIONS)
+    stop_event = threading.Event()
+    watch_thread = threading.Thread(target=watch_input_dir, args=(watcher, job_queue_db, stop_event), daemon=True)
+    watch_thread.start()
+    print(f"👀 Watching '{INPUT_DIR}' ({watcher.mode}). Control with: python job_queue.py list|priority|cancel")
+
+    metrics.set_context(batch=f"watch-{time.strftime('%Y%m%d-%H%M%S')}")
+    pool = ThreadPoolExecutor(max_workers=CONVERT_WORKERS)
+    preparing = {}   # future -> job
+    ready = []       # [(job, prepared)]  CFR 準備が済んで GPU 待ちのもの
+    low_disk = False
+    try:
+        while True:
+            # GPU が1本生成している間に、次の動画の CFR 準備を進めておく（一時ファイルは MAX_CFR_COPIES 本まで）
+            room = MAX_CFR_COPIES - len(preparing) - len(ready)
+            # 空きが足りなくても、処理待ちの一時ファイルが無ければ待っても空かないので止めない
+            if room > 0 and ready and not disk_budget.has_room(TEMP_CFR_DIR):
+                if not low_disk:
+                    log(f"⏸️ Low disk space ({disk_budget.format_gb(disk_budget.free_bytes(TEMP_CFR_DIR))} free). "
+                        f"Holding CFR preparation until space frees up.")
+                low_disk = True
+                room = 0
+            elif room > 0:
+                low_disk = False
+            if room > 0:
+                for job in job_queue_db.claim(room):
+                    log(f"⚙️ Preparing #{job['id']}: {os.path.basename(job['path'])}")
+                    preparing[pool.submit(prepare_cfr, job["path"])] = job
+
+            if preparing:
+                done, _ = wait(preparing, timeout=0 if ready else 1.0, return_when=FIRST_COMPLETED)
+                for future in done:
+                    job = preparing.pop(future)
+                    prepared = future.result()
+                    if prepared is None:
+                        job_queue_db.finish(job["id"], "failed", "CFR conversion failed")
+                    elif job_queue_db.is_cancelled(job["id"]):
+                        discard_prepared(prepared)
+                    else:
+                        ready.append((job, prepared))
+            elif not ready:
+                time.sleep(1.0)
+
+            for job, prepared in list(ready):
+                if job_queue_db.is_cancelled(job["id"]):
+                    ready.remove((job, prepared))
+                    discard_prepared(prepared)
+            if not ready:
+                continue
+            job, prepared = max(ready, key=lambda r: (r[0]["priority"], -r[0]["id"]))
+            ready.remove((job, prepared))
+            log(f"\n🔥 Processing #{job['id']}: {os.path.basename(prepared['original'])}")
+            status = process_with_ai(prepared, lambda: job_queue_db.is_cancelled(job["id"]))
+            if status == "cancelled":
+                discard_prepared(prepared)
+            job_queue_db.finish(job["id"], status, None if status == "done" else "generation failed")
+            metrics.write_prometheus("batch_run")
+    except KeyboardInterrupt:
+        print("\n⏹️ Stopping. Unfinished jobs resume on the next start.")
+    finally:
+        stop_event.set()
+        watcher.wake()
+        pool.shutdown(wait=False, cancel_futures=True)
+        watch_thread.join(timeout=5)
+        watcher.close()
+
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--watch", action="store_true",
+                        help="Keep running: watch INPUT_DIR and process new videos from a persistent queue")
+    parser.add_argument("--dry_run", action="store_true",
+                        help="Render a few short samples per video to estimate the batch run time, then exit")
+    args = parser.parse_args()
+    if args.dry_run:
+        dry_run()
+    elif args.watch:
+        serve()
+    else:
+        main()
\ No newline at end of file
@@ -0,0 +1,337 @@
+"""オーケストレーターのベンチマーク（GPU 不要）。
+
+fake_comfyui_server.py の擬似 ComfyUI を立てて、実際の manager_process / merge_videos_in_folder_smart /
+batch_run の CFR 準備 / 複数動画のチャンクスケジューラ / batch_fix_sync を動かし、
+  - overhead: 実時間のうち GPU（擬似）が働いていなかった分
+  - idle%:    描画期間中に GPU が空いていた割合（チャンク間の隙間）
+を表にする。擬似 GPU の処理時間は --latency（秒/フレーム）で決まる。
+
+    python benchmark.py --quick
+    python benchmark.py --scenarios manager,merge --json bench.json
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import batch_fix_sync
+import batch_run
+import pipeline_metrics as metrics
+import process_video
+import renditions
+from fake_comfyui_server import FakeComfyUI
+
+# ================= 設定エリア =================
+BASE_PORT = 18300
+DEFAULT_LATENCY = 0.004        # 擬似 GPU の 1フレームあたりの時間（秒）
+SOURCE_SIZE = "320x240"
+WORKFLOW_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "workflow_api.json")
+SCENARIO_NAMES = ("manager", "merge", "batch_run", "scheduler", "fix")
+# ============================================
+
+_next_port = [BASE_PORT]
+
+def _port():
+    _next_port[0] += 1
+    return _next_port[0]
+
+def make_video(path, seconds, fps=30, vfr=False):
+    """testsrc + サイン波の音声付きテスト動画。vfr=True なら10フレームに1枚落として可変フレームレートにする"""
+    if os.path.exists(path):
+        return path
+    vf = ["-vf", "select='not(eq(mod(n\\,10)\\,3))'", "-fps_mode", "vfr"] if vfr else []
+    subprocess.run([
+        "ffmpeg", "-y", "-v", "error",
+        "-f", "lavfi", "-i", f"testsrc=size={SOURCE_SIZE}:rate={fps}:duration={seconds}",
+        "-f", "lavfi", "-i", f"sine=frequency=440:duration={seconds}",
+        *vf, "-c:v", "libx264", "-preset", "ultrafast", "-pix_fmt", "yuv420p", "-c:a", "aac", "-shortest", path
+    ], check=True)
+    return path
+
+@contextlib.contextmanager
+def patched(module, **values):
+    """モジュールの設定エリアの値を一時的に差し替える"""
+    old = {k: getattr(module, k) for k in values}
+    for k, v in values.items():
+        setattr(module, k, v)
+    try:
+        yield
+    finally:
+        for k, v in old.items():
+            setattr(module, k, v)
+
+@contextlib.contextmanager
+def quiet(verbose):
+    if verbose:
+        yield
+        return
+    with contextlib.redirect_stdout(io.StringIO()):
+        yield
+
+def gpu_stats(fakes, wall):
+    busy = sum(f.stats["busy_seconds"] for f in fakes)
+    starts = [f.stats["first_start"] for f in fakes if f.stats["first_start"]]
+    ends = [f.stats["last_end"] for f in fakes if f.stats["last_end"]]
+    window = (max(ends) - min(starts)) if starts and ends else 0.0
+    n = len(fakes)
+    return {
+        "gpu_busy": round(busy, 3),
+        "overhead": round(wall - busy / n, 3),
+        "idle_pct": round(100.0 * (1 - busy / (window * n)), 1) if window > 0 else None,
+        "prompts": sum(f.stats["prompts"] for f in fakes),
+        "failed_prompts": sum(f.stats["failed"] for f in fakes),
+    }
+
+# ---------------- シナリオ ----------------
+def bench_manager(work, name, video, chunk_size, servers=1, workers=1, queue_ahead=0, latency=DEFAULT_LATENCY,
+                  fail_over_frames=None, die_after=None, drop_rate=0.0, upload=False, verbose=False):
+    """manager_process を丸ごと（プラン → 描画 → 結合）実行する。
+    upload なら擬似サーバーは別フォルダに書き出し、チャンクは /upload・/view でやり取りする（共有ストレージなし）"""
+    out = os.path.join(work, "out", name)
+    shutil.rmtree(out, ignore_errors=True)
+    os.makedirs(out)
+    fakes = []
+    for i in range(servers):
+        remote = os.path.join(work, "remote", name, str(i)) if upload else out
+        # die_after は最後のサーバーだけに効かせる（途中で1台落ちる想定）
+        fakes.append(FakeComfyUI(_port(), remote, latency, fail_over_frames=fail_over_frames,
+                                 die_after=die_after if i == servers - 1 else None, drop_rate=drop_rate,
+                                 seed=i).start())
+    try:
+        with patched(process_video, COMFYUI_OUTPUT_DIR=out, CHUNK_CACHE_DIR=os.path.join(out, "_chunk_cache"),
+                     CHUNK_SIZE=chunk_size, MAX_PARALLEL_WORKERS=workers, USE_CHUNK_CACHE=False), \
+             patched(metrics, EVENT_LOG_FILE=os.path.join(work, "events.jsonl")), quiet(verbose):
+            start = time.time()
+            process_video.manager_process(video, WORKFLOW_FILE, [f.url for f in fakes], queue_ahead,
+                                          None, "auto", upload=upload)
+            wall = time.time() - start
+        stages = metrics.totals()
+    finally:
+        for f in fakes:
+            f.stop()
+    base = os.path.splitext(os.path.basename(video))[0]
+    result = {"scenario": "manager", "name": name, "wall": round(wall, 3),
+              "ok": os.path.exists(os.path.join(out, f"{base}_upscaled.mp4")),
+              "merge": round(sum(stages.get(s, {}).get("seconds", 0.0) for s in ("merge", "finalize")), 3)}
+    result.update(gpu_stats(fakes, wall))
+    if drop_rate:
+        result["short_outputs"] = sum(f.stats.get("short_outputs", 0) for f in fakes)
+    if upload:
+        result["uploaded_mb"] = round(sum(f.stats["upload_bytes"] for f in fakes) / 1e6, 2)
+    return result
+
+def bench_merge(work, name, parts, frames_per_part, merge_mode, profiles=None, verbose=False):
+    """merge_videos_in_folder_smart だけを、用意したパーツに対して実行する。
+    profiles を渡すと縮小版・サムネイルも同じデコードから書き出す"""
+    folder = os.path.join(work, "merge", f"parts_{parts}x{frames_per_part}")
+    if not os.path.isdir(folder):
+        os.makedirs(folder)
+        for i in range(parts):
+            subprocess.run([
+                "ffmpeg", "-y", "-v", "error", "-f", "lavfi", "-i", f"testsrc=size={SOURCE_SIZE}:rate=30",
+                "-frames:v", str(frames_per_part), "-c:v", "libx264", "-preset", "ultrafast", "-pix_fmt", "yuv420p",
+                os.path.join(folder, f"part_{i:03d}_00001.mp4")
+            ], check=True)
+    original = make_video(os.path.join(work, "src", f"merge_{parts * frames_per_part}.mp4"),
+                          parts * frames_per_part / 30)
+    output = os.path.join(work, "merge", f"{name.replace('/', '_')}.mp4")
+    with quiet(verbose):
+        start = time.time()
+        process_video.merge_videos_in_folder_smart(folder, output, original, merge_mode, profiles=profiles)
+        wall = time.time() - start
+    paths = renditions.output_paths(profiles, output)
+    result = {"scenario": "merge", "name": name, "wall": round(wall, 3),
+              "ok": all(os.path.exists(p) for p in paths.values()),
+              "fps": round(parts * frames_per_part / wall, 1) if wall > 0 else None}
+    if profiles:
+        result["outputs"] = len(paths)
+    return result
+
+def bench_batch_run(work, name, videos, convert_workers, verbose=False):
+    """batch_run の CFR 準備（素通し・リマックス・再エンコードの判定と変換）を並列数を変えて測る。
+    生成部分は manager シナリオで測る"""
+    temp_dir = os.path.join(work, "cfr", name)
+    shutil.rmtree(temp_dir, ignore_errors=True)
+    os.makedirs(temp_dir)
+    with patched(batch_run, TEMP_CFR_DIR=temp_dir, CONVERT_WORKERS=convert_workers), \
+         patched(metrics, EVENT_LOG_FILE=os.path.join(work, "events.jsonl")), quiet(verbose):
+        start = time.time()
+        with ThreadPoolExecutor(max_workers=convert_workers) as pool:
+            prepared = list(pool.map(batch_run.prepare_cfr, videos))
+        wall = time.time() - start
+    return {"scenario": "batch_run", "name": name, "wall": round(wall, 3),
+            "ok": all(p is not None for p in prepared),
+            "converted": sum(1 for p in prepared if p and p["temporary"])}
+
+def bench_scheduler(work, name, videos, chunk_size, policy=None, latency=DEFAULT_LATENCY, verbose=False):
+    """複数動画を batch_process（1つのチャンクキュー）で流す。policy=None なら manager_process を1本ずつ（従来の batch_run）"""
+    out = os.path.join(work, "out", name.replace("/", "_"))
+    shutil.rmtree(out, ignore_errors=True)
+    os.makedirs(out)
+    fake = FakeComfyUI(_port(), out, latency).start()
+    done_at = []
+    outputs = []
+    try:
+        with patched(process_video, COMFYUI_OUTPUT_DIR=out, CHUNK_CACHE_DIR=os.path.join(out, "_chunk_cache"),
+                     CHUNK_SIZE=chunk_size, USE_CHUNK_CACHE=False), \
+             patched(metrics, EVENT_LOG_FILE=os.path.join(work, "events.jsonl")), quiet(verbose):
+            start = time.time()
+            if policy is None:
+                for video in videos:
+                    outputs.append(process_video.manager_process(video, WORKFLOW_FILE, [fake.url]))
+                    done_at.append(time.time() - start)
+            else:
+                def finished(state):
+                    outputs.append(state["output"])
+                    done_at.append(time.time() - start)
+                sources = [{"video": v, "original": v} for v in videos]
+                process_video.batch_process(sources, WORKFLOW_FILE, [fake.url], policy=policy, on_finished=finished)
+            wall = time.time() - start
+    finally:
+        fake.stop()
+    result = {"scenario": "scheduler", "name": name, "wall": round(wall, 3),
+              "ok": len(outputs) == len(videos) and all(o and os.path.exists(o) for o in outputs)}
+    result.update(gpu_stats([fake], wall))
+    # 平均完了時間: 短い動画を先に終わらせる方針ほど小さくなる
+    result["mean_done"] = round(sum(done_at) / len(done_at), 2) if done_at else None
+    return result
+
+def bench_fix(work, name, videos, parts_per_video, fix_workers, verbose=False):
+    """batch_fix_sync.main を、元動画とパーツを並べた作業フォルダに対して実行する"""
+    base = os.path.join(work, "fix", name)
+    shutil.rmtree(base, ignore_errors=True)
+    for sub in ("Origin", "AInized", "Fixed_Output"):
+        os.makedirs(os.path.join(base, sub))
+    for i, video in enumerate(videos):
+        stem = f"clip{i}"
+        shutil.copy(video, os.path.join(base, "Origin", f"{stem}.mp4"))
+        for p in range(parts_per_video):
+            subprocess.run([
+                "ffmpeg", "-y", "-v", "error", "-f", "lavfi", "-i", f"testsrc=size={SOURCE_SIZE}:rate=30",
+                "-frames:v", "90", "-c:v", "libx264", "-preset", "ultrafast", "-pix_fmt", "yuv420p",
+                os.path.join(base, "AInized", f"{stem}_run_part_{p:03d}.mp4")
+            ], check=True)
+    with patched(batch_fix_sync, BASE_WORK_DIR=base, FIX_WORKERS=fix_workers), quiet(verbose):
+        start = time.time()
+        batch_fix_sync.main()
+        wall = time.time() - start
+    fixed = os.listdir(os.path.join(base, "Fixed_Output"))
+    return {"scenario": "fix", "name": name, "wall": round(wall, 3), "ok": len(fixed) == len(videos)}
+
+# ---------------- 実行 ----------------
+def run(scenarios, work, latency, quick, verbose):
+    src = os.path.join(work, "src")
+    os.makedirs(src, exist_ok=True)
+    lengths = [20] if quick else [20, 60]
+    chunk_sizes = [150] if quick else [150, 500]
+    results = []
+
+    def add(result):
+        results.append(result)
+        print(format_row(result), flush=True)
+
+    print(format_header())
+    if "manager" in scenarios:
+        for seconds in lengths:
+            video = make_video(os.path.join(src, f"cfr_{seconds}s.mp4"), seconds)
+            for size in chunk_sizes:
+                tag = f"{seconds}s/c{size}"
+                add(bench_manager(work, f"{tag}/1srv", video, size, latency=latency, verbose=verbose))
+                add(bench_manager(work, f"{tag}/1srv+qa2", video, size, queue_ahead=2, latency=latency, verbose=verbose))
+                add(bench_manager(work, f"{tag}/2srv", video, size, servers=2, latency=latency, verbose=verbose))
+                add(bench_manager(work, f"{tag}/2srv+upload", video, size, servers=2, upload=True,
+                                  latency=latency, verbose=verbose))
+                if not quick:
+                    add(bench_manager(work, f"{tag}/2srv+w2", video, size, servers=2, workers=2,
+                                      latency=latency, verbose=verbose))
+            # 失敗注入: OOM でチャンク分割 / 2台中1台が途中で停止
+            size = chunk_sizes[-1]
+            add(bench_manager(work, f"{seconds}s/c{size}/oom-split", video, size,
+                              fail_over_frames=size // 2, latency=latency, verbose=verbose))
+            add(bench_manager(work, f"{seconds}s/c{size}/srv-down", video, size, servers=2, die_after=1,
+                              latency=latency, verbose=verbose))
+            # 失敗注入: 成功扱いのままフレームが欠けた出力を返す → そのチャンクだけ描き直す
+            add(bench_manager(work, f"{seconds}s/c{size}/drop-frames", video, size, servers=2, drop_rate=0.3,
+                              latency=latency, verbose=verbose))
+
+    if "merge" in scenarios:
+        for parts in ([10] if quick else [10, 40]):
+            for mode in ("copy", "encode"):
+                add(bench_merge(work, f"{parts}parts/{mode}", parts, 90, mode, verbose=verbose))
+            add(bench_merge(work, f"{parts}parts/copy+renditions", parts, 90, "copy",
+                            ["master", "1080p", "720p", "thumbs"], verbose=verbose))
+
+    if "batch_run" in scenarios:
+        count = 2 if quick else 4
+        videos = [make_video(os.path.join(src, f"cfr_{i}.mp4"), 10) for i in range(count)]
+        videos += [make_video(os.path.join(src, f"vfr_{i}.mp4"), 10, vfr=True) for i in range(count)]
+        for workers in (1, 2 if quick else 4):
+            add(bench_batch_run(work, f"{len(videos)}videos/w{workers}", videos, workers, verbose=verbose))
+
+    if "scheduler" in scenarios:
+        # 長い動画1本の後ろに短い動画が並ぶ場合
+        videos = [make_video(os.path.join(src, f"sched_{i}_{seconds}s.mp4"), seconds)
+                  for i, seconds in enumerate((20, 5, 5))]
+        for policy in (None, "fifo", "fair", "sjf"):
+            add(bench_scheduler(work, f"{len(videos)}videos/{policy or 'sequential'}", videos, chunk_sizes[0],
+                                policy, latency=latency, verbose=verbose))
+
+    if "fix" in scenarios:
+        count = 2 if quick else 4
+        videos = [make_video(os.path.join(src, f"cfr_{i}.mp4"), 10) for i in range(count)]
+        for workers in (1, 2):
+            add(bench_fix(work, f"{count}videos/w{workers}", videos, 4, workers, verbose=verbose))
+    return results
+
+def format_header():
+    return f"{'scenario':<10} {'name':<26} {'ok':<3} {'wall':>8} {'overhead':>9} {'idle%':>6} {'merge':>7}  extra"
+
+def format_row(r):
+    def num(key, fmt):
+        return format(r[key], fmt) if r.get(key) is not None else "-"
+    extra = {k: v for k, v in r.items()
+             if k not in ("scenario", "name", "ok", "wall", "overhead", "idle_pct", "merge", "gpu_busy")}
+    return (f"{r['scenario']:<10} {r['name']:<26} {'✓' if r['ok'] else '✗':<3} {num('wall', '8.2f')} "
+            f"{num('overhead', '9.2f')} {num('idle_pct', '6.1f')} {num('merge', '7.2f')}  "
+            + " ".join(f"{k}={v}" for k, v in extra.items()))
+
+def main():
+    parser = argparse.ArgumentParser(description="Orchestrator benchmarks against a fake ComfyUI (no GPU needed)")
+    parser.add_argument("--scenarios", default=",".join(SCENARIO_NAMES),
+                        help=f"Comma-separated subset of {','.join(SCENARIO_NAMES)}")
+    parser.add_argument("--latency", type=float, default=DEFAULT_LATENCY, help="Simulated seconds per frame")
+    parser.add_argument("--quick", action="store_true", help="Smaller grid for a fast check")
+    parser.add_argument("--workdir", help="Keep inputs/outputs here (default: a temp dir that is removed)")
+    parser.add_argument("--json", help="Write results to this file")
+    parser.add_argument("--verbose", action="store_true", help="Show the scripts' own output")
+    args = parser.parse_args()
+
+    if shutil.which("ffmpeg") is None:
+        print("❌ ffmpeg not found in PATH.")
+        sys.exit(1)
+    scenarios = {s.strip() for s in args.scenarios.split(",") if s.strip()}
+    work = args.workdir or tempfile.mkdtemp(prefix="chunker_bench_")
+    os.makedirs(work, exist_ok=True)
+    print(f"🏁 Benchmarks in {work} ({args.latency * 1000:.1f} ms/frame simulated GPU)\n")
+    try:
+        results = run(scenarios, work, args.latency, args.quick, args.verbose)
+    finally:
+        if not args.workdir:
+            shutil.rmtree(work, ignore_errors=True)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"latency": args.latency, "results": results}, f, indent=1)
+        print(f"\n📝 Results written to {args.json}")
+    if not all(r["ok"] for r in results):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
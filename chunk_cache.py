@@ -0,0 +1,170 @@
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import threading
+import time
+
+# ================= 設定エリア =================
+CHUNK_CACHE_MAX_GB = 200      # キャッシュの上限。超えたら最後に使ってから長いものから消す
+# ============================================
+
+INDEX_FILE_NAME = "index.sqlite"
+
+# ワーカーが毎回書き換える入力。キャッシュのキーには含めない
+PATCHED_INPUTS = {
+    "loader": ("video", "frame_load_cap", "skip_first_frames", "start_time"),
+    "saver": ("filename_prefix",),
+}
+
+def workflow_hash(workflow, loader_id, saver_id):
+    """ローダー/セーバーの差し替え項目と表示用の _meta を除いたワークフローのハッシュ"""
+    normalized = {}
+    for node_id, node in workflow.items():
+        inputs = dict(node.get("inputs", {}))
+        if node_id == loader_id:
+            for name in PATCHED_INPUTS["loader"]: inputs.pop(name, None)
+        elif node_id == saver_id:
+            for name in PATCHED_INPUTS["saver"]: inputs.pop(name, None)
+        normalized[node_id] = {"class_type": node.get("class_type"), "inputs": inputs}
+    text = json.dumps(normalized, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+def chunk_cache_key(source_fingerprint, wf_hash, chunk, frame_rate):
+    text = f"{source_fingerprint}|{wf_hash}|{chunk['start_frame']}|{chunk['frame_cap']}|{frame_rate}"
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+class ChunkCache:
+    """生成済みチャンクを (元動画の中身, ワークフロー, フレーム範囲) のキーで保存する。
+    実体はハードリンクなので、同じディスク上ならコピーは発生しない。
+    最終利用時刻とサイズは index.sqlite に持つ（ファイルの mtime は作業フォルダのパーツと共有なので触らない）"""
+
+    def __init__(self, cache_dir, max_gb=CHUNK_CACHE_MAX_GB, ext=".mp4"):
+        self.cache_dir = cache_dir
+        self.max_bytes = int(max_gb * 1024 ** 3)
+        self.ext = ext
+        self.index_path = os.path.join(cache_dir, INDEX_FILE_NAME)
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, size INTEGER, used REAL)")
+        self.total = self._sync_index()
+
+    def _connect(self):
+        return sqlite3.connect(self.index_path, timeout=30)
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key + self.ext)
+
+    def _sync_index(self):
+        """起動時に1回だけディスクと索引を突き合わせ、合計サイズを返す（以降は増減を足し引きする）"""
+        on_disk = {}
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                if not name.endswith(self.ext) or root == self.cache_dir:
+                    continue
+                try:
+                    st = os.stat(os.path.join(root, name))
+                except OSError:
+                    continue
+                on_disk[name[:-len(self.ext)]] = st
+        with self._lock, self._connect() as conn:
+            known = {key for (key,) in conn.execute("SELECT key FROM entries")}
+            conn.executemany("DELETE FROM entries WHERE key=?", [(key,) for key in known - on_disk.keys()])
+            # 索引の無い古いキャッシュは mtime を最終利用時刻の代わりにする
+            conn.executemany("INSERT OR IGNORE INTO entries VALUES (?, ?, ?)",
+                             [(key, st.st_size, st.st_mtime) for key, st in on_disk.items()])
+            conn.executemany("UPDATE entries SET size=? WHERE key=?",
+                             [(st.st_size, key) for key, st in on_disk.items()])
+        return sum(st.st_size for st in on_disk.values())
+
+    def lookup(self, key):
+        path = self._path(key)
+        if os.path.exists(path) and os.path.getsize(path) > 1024:
+            with self._lock, self._connect() as conn:
+                # LRU 用の最終利用時刻は索引にだけ書く
+                conn.execute("INSERT OR REPLACE INTO entries VALUES (?, ?, ?)", (key, os.path.getsize(path), time.time()))
+            return path
+        return None
+
+    def restore(self, key, dest_path):
+        """キャッシュにあれば dest_path に置いて True を返す"""
+        path = self.lookup(key)
+        if path is None:
+            return False
+        _link_or_copy(path, dest_path)
+        return True
+
+    def store(self, key, src_path):
+        path = self._path(key)
+        if os.path.exists(path):
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        _link_or_copy(src_path, path + ".tmp")
+        os.replace(path + ".tmp", path)
+        size = os.path.getsize(path)
+        with self._lock, self._connect() as conn:
+            conn.execute("INSERT OR REPLACE INTO entries VALUES (?, ?, ?)", (key, size, time.time()))
+            self.total += size
+        if self.total > self.max_bytes:
+            self.evict()
+
+    def discard(self, keys):
+        """要らなくなったエントリを消して、空いたバイト数を返す（まだリンクされているものは空かないので数えない）"""
+        freed = 0
+        with self._lock, self._connect() as conn:
+            for key in keys:
+                row = conn.execute("SELECT size FROM entries WHERE key=?", (key,)).fetchone()
+                path = self._path(key)
+                try:
+                    st = os.stat(path)
+                    os.remove(path)
+                    if st.st_nlink == 1:
+                        freed += st.st_size
+                except OSError:
+                    pass
+                if row:
+                    conn.execute("DELETE FROM entries WHERE key=?", (key,))
+                    self.total -= row[0]
+        return freed
+
+    def evict(self):
+        """合計が上限を超えていれば、最後に使ってから長いものから上限まで消す"""
+        with self._lock:
+            self._remove_lru(lambda freed: self.total <= self.max_bytes)
+
+    def make_room(self, nbytes):
+        """空きが足りない時に、最後に使ってから長いものから nbytes ぶん消す。消したバイト数を返す"""
+        with self._lock:
+            return self._remove_lru(lambda freed: freed >= nbytes)
+
+    def _remove_lru(self, done):
+        """古い順に消して、消したバイト数を返す。
+        作業フォルダのパーツとハードリンクでつながっているものは消しても空かないので残す"""
+        freed = 0
+        with self._connect() as conn:
+            for key, size in conn.execute("SELECT key, size FROM entries ORDER BY used").fetchall():
+                if done(freed):
+                    break
+                path = self._path(key)
+                try:
+                    if os.stat(path).st_nlink > 1:
+                        continue
+                    os.remove(path)
+                    freed += size
+                except FileNotFoundError:
+                    pass
+                except OSError:
+                    continue
+                conn.execute("DELETE FROM entries WHERE key=?", (key,))
+                self.total -= size
+        return freed
+
+def _link_or_copy(src, dst):
+    if os.path.exists(dst):
+        os.remove(dst)
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
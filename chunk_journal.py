@@ -0,0 +1,108 @@
+import json
+import os
+import threading
+import time
+
+import media_probe
+from chunk_planner import part_name
+
+# ================= 設定エリア =================
+JOURNAL_FILE_NAME = "chunk_journal.jsonl"   # 作業フォルダごとのチャンク状態の記録（追記のみ）
+COMPACT_MIN_LINES = 200                     # これを超えて、かつ中身の4倍以上の行数になったら詰め直す
+# ============================================
+
+class ChunkJournal:
+    """チャンクごとの状態を JSON Lines で追記していく。同じチャンクは最後の行が有効。
+    state: "submitted"（投入済み） / "done" / "failed" / "cancelled" / "split"（半分に割られた）"""
+
+    def __init__(self, target_dir_path):
+        self.path = os.path.join(target_dir_path, JOURNAL_FILE_NAME)
+        self.entries = {}   # part_name -> 最新のエントリ
+        self._lock = threading.Lock()
+        self._load()
+
+    def _load(self):
+        lines = 0
+        torn = False
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                for line in f:
+                    lines += 1
+                    torn = not line.endswith("\n")
+                    try:
+                        entry = json.loads(line)
+                        self.entries[entry["part"]] = entry
+                    except (ValueError, KeyError):
+                        continue  # 書き込み途中で落ちた最終行など
+        except OSError:
+            return
+        # 途中で切れた最終行が残っていると、次の追記がその行に繋がって読めなくなる。詰め直して取り除く
+        if torn or (lines > COMPACT_MIN_LINES and lines > 4 * len(self.entries)):
+            self._compact()
+
+    def _compact(self):
+        with open(self.path + ".tmp", "w", encoding="utf-8") as f:
+            for entry in self.entries.values():
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        os.replace(self.path + ".tmp", self.path)
+
+    def get(self, chunk):
+        """このチャンク（同じフレーム範囲）のエントリ。プランが変わって範囲が違えば None"""
+        entry = self.entries.get(part_name(chunk))
+        if entry and entry.get("start_frame") == chunk["start_frame"] and entry.get("frame_cap") == chunk["frame_cap"]:
+            return entry
+        return None
+
+    def is_stale(self, chunk):
+        """同じ名前で別のフレーム範囲の記録がある = 残っている出力は古いプランのもの"""
+        return part_name(chunk) in self.entries and self.get(chunk) is None
+
+    def record(self, chunk, state, **fields):
+        """状態を1行追記して fsync する（落ちても直前までの状態が残る）"""
+        with self._lock:
+            entry = {**(self.get(chunk) or {}), **fields}
+            entry.update({
+                "part": part_name(chunk),
+                "start_frame": chunk["start_frame"],
+                "frame_cap": chunk["frame_cap"],
+                "state": state,
+                "updated_at": time.time(),
+            })
+            if state != "done":
+                for key in ("size", "mtime_ns", "checksum"):
+                    entry.pop(key, None)
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            self.entries[entry["part"]] = entry
+            return entry
+
+    def record_done(self, chunk, output_path, actual_frames, **fields):
+        st = os.stat(output_path)
+        return self.record(chunk, "done", output=output_path, actual_frames=actual_frames,
+                           expected_frames=chunk["frame_cap"], size=st.st_size, mtime_ns=st.st_mtime_ns,
+                           checksum=media_probe.fingerprint(output_path), **fields)
+
+    def done_output(self, chunk):
+        """完了記録があり、出力ファイルのサイズと更新時刻が記録どおりならそのパス（中身は読まない）"""
+        entry = self.get(chunk)
+        if not entry or entry["state"] != "done":
+            return None
+        if entry.get("actual_frames") != entry.get("expected_frames", entry.get("actual_frames")) and not entry.get("short_ok"):
+            return None   # フレーム数の合わないまま記録されたもの（照合前の版など）は中身を見直す
+        try:
+            st = os.stat(entry["output"])
+        except (OSError, KeyError):
+            return None
+        if st.st_size == entry.get("size") and st.st_mtime_ns == entry.get("mtime_ns"):
+            return entry["output"]
+        return None
+
+    def in_flight(self, chunk):
+        """投入したまま結果が記録されていないエントリ（前回の実行が途中で落ちた）"""
+        entry = self.get(chunk)
+        if entry and entry["state"] == "submitted" and entry.get("prompt_id") and entry.get("server"):
+            return entry
+        return None
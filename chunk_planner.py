@@ -0,0 +1,204 @@
+import json
+import os
+import re
+import subprocess
+
+import media_probe
+
+# ================= 設定エリア =================
+SNAP_TOLERANCE = 0.2          # 境界を寄せてよい範囲（CHUNK_SIZE に対する割合）。メモリ対策のため手前側にだけ寄せる
+SCENE_CUT_THRESHOLD = None    # 例: 0.4。None ならシーン検出しない（全デコードが走るため既定はOFF）
+SCENE_DETECT_WIDTH = 160      # シーン検出用に縮小する幅
+PLAN_FILE_NAME = "chunk_plan.json"
+BYTES_PER_PIXEL = 12          # ComfyUI の IMAGE テンソル (float32 x RGB, AnimateDiff形式の [N,H,W,3])
+MEMORY_SAFETY = 0.8           # 予算のうち実際にテンソルへ割り当てる割合
+MIN_CHUNK_SIZE = 16
+MAX_CHUNK_SIZE = 3000
+# ============================================
+
+def part_name(chunk):
+    """チャンクの出力ファイル名の接頭辞。分割されたチャンクは part_005_a, part_005_ab のようになる"""
+    name = f"part_{chunk['index']:03d}"
+    if chunk.get("split"):
+        name += f"_{chunk['split']}"
+    return name
+
+PART_KEY_PATTERN = re.compile(r"part_(\d+)(?:_([ab]+))?(?![a-z])")
+
+def part_key(filename):
+    """ファイル名から (チャンク番号, 分割記号) を取り出す。並べ替えるとそのまま再生順になる"""
+    match = PART_KEY_PATTERN.search(filename)
+    if not match:
+        return None
+    return (int(match.group(1)), match.group(2) or "")
+
+def chunk_key(chunk):
+    return (chunk["index"], chunk.get("split") or "")
+
+def _upscale_model_factor(workflow, node):
+    # モデル名の "4x-UltraSharp" / "RealESRGAN_x2plus" などから倍率を読む
+    for value in node["inputs"].values():
+        if isinstance(value, list) and str(value[0]) in workflow:
+            for name in workflow[str(value[0])]["inputs"].values():
+                if isinstance(name, str):
+                    match = re.search(r"(?:^|[^0-9])(\d)x|x(\d)(?:[^0-9]|$)", name)
+                    if match:
+                        return float(match.group(1) or match.group(2))
+    return 4.0
+
+def workflow_stage_scales(workflow, saver_id):
+    """セーバーの画像入力をローダーまで逆にたどり、各段の出力解像度（元動画比）をローダー側から返す"""
+    factors = []
+    link = workflow.get(saver_id, {}).get("inputs", {}).get("images")
+    seen = set()
+    while isinstance(link, list) and str(link[0]) in workflow and str(link[0]) not in seen:
+        node_id = str(link[0])
+        seen.add(node_id)
+        node = workflow[node_id]
+        class_type = node.get("class_type", "")
+        inputs = node.get("inputs", {})
+        if class_type == "ImageScaleBy":
+            factors.append(float(inputs.get("scale_by", 1.0)))
+        elif "Upscale" in class_type and not class_type.startswith("ImageScale"):
+            factors.append(_upscale_model_factor(workflow, node))
+        else:
+            factors.append(1.0)
+        link = inputs.get("images", inputs.get("image"))
+    factors.reverse()
+
+    scales = []
+    current = 1.0
+    for f in factors:
+        current *= f
+        scales.append(current)
+    return scales or [1.0]
+
+def estimate_chunk_size(workflow, loader_id, saver_id, width, height, budget_gb):
+    """メモリ予算からチャンクのフレーム数を決める。
+    ComfyUI は各ノードの出力をキャッシュするので、チェーン上の全段のテンソルが同時に載る前提で見積もる"""
+    inputs = workflow.get(loader_id, {}).get("inputs", {})
+    if inputs.get("custom_width") and inputs.get("custom_height"):
+        width, height = inputs["custom_width"], inputs["custom_height"]
+    scales = workflow_stage_scales(workflow, saver_id)
+    bytes_per_frame = BYTES_PER_PIXEL * width * height * sum(s * s for s in scales)
+    if bytes_per_frame <= 0:
+        return None
+    frames = int(budget_gb * (1024 ** 3) * MEMORY_SAFETY / bytes_per_frame)
+    frames = max(MIN_CHUNK_SIZE, min(MAX_CHUNK_SIZE, frames))
+    print(f"🧮 Memory budget {budget_gb:g} GB @ {width}x{height}, stage scales "
+          f"{'/'.join(f'{s:g}x' for s in scales)} -> {bytes_per_frame / 1024**2:.1f} MB/frame, {frames} frames/chunk")
+    return frames
+
+def split_chunk(chunk):
+    """失敗したチャンクを半分に割る。分割記号に a/b を足していくので再生順は保たれる"""
+    half = chunk["frame_cap"] // 2
+    if half < MIN_CHUNK_SIZE:
+        return None
+    span = chunk["end_time"] - chunk["start_time"]
+    mid_time = chunk["start_time"] + span * half / chunk["frame_cap"]
+    split = chunk.get("split") or ""
+    first = {**chunk, "frame_cap": half, "end_time": round(mid_time, 6), "split": split + "a", "boundary": None}
+    second = {**chunk, "start_frame": chunk["start_frame"] + half, "frame_cap": chunk["frame_cap"] - half,
+              "start_time": round(mid_time, 6), "split": split + "b"}
+    return first, second
+
+def detect_scene_cuts(video_path, fps, threshold=SCENE_CUT_THRESHOLD):
+    """縮小デコードでシーンチェンジを検出し、フレーム番号のリストを返す"""
+    if not threshold or not fps:
+        return []
+    cmd = [
+        "ffmpeg", "-hide_banner", "-nostats", "-i", video_path,
+        "-an", "-vf", f"scale={SCENE_DETECT_WIDTH}:-2,select='gt(scene,{threshold})',showinfo",
+        "-f", "null", "-"
+    ]
+    try:
+        res = subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    except OSError:
+        return []
+    cuts = []
+    for match in re.finditer(r"pts_time:([0-9.]+)", res.stderr):
+        cuts.append(int(round(float(match.group(1)) * fps)))
+    return cuts
+
+def _pick_boundary(target, lower, scene_cuts, keyframes):
+    """[lower, target] の中で target に一番近い境界を選ぶ。シーンチェンジ優先、無ければキーフレーム"""
+    for candidates, kind in ((scene_cuts, "scene"), (keyframes, "keyframe")):
+        inside = [f for f in candidates if lower <= f <= target]
+        if inside:
+            return max(inside), kind
+    return target, None
+
+def plan_chunks(total_frames, fps, chunk_size, keyframes=(), scene_cuts=(), tolerance=SNAP_TOLERANCE):
+    """チャンク割りを作る。各チャンクは start_frame / frame_cap / start_time / end_time を持つ"""
+    key_times = {f: t for f, t in keyframes}
+    key_frames = sorted(key_times)
+    cuts = sorted(set(scene_cuts))
+    snap = int(chunk_size * tolerance)
+
+    def frame_time(frame):
+        # キーフレームは実際の pts、それ以外は fps から計算
+        if frame in key_times:
+            return key_times[frame]
+        return frame / fps if fps else 0.0
+
+    chunks = []
+    start = 0
+    while start < total_frames:
+        target = start + chunk_size
+        kind = None
+        if target < total_frames:
+            # 上限 (chunk_size) は超えないように、手前側にだけ寄せる
+            end, kind = _pick_boundary(target, max(start + 1, target - snap), cuts, key_frames)
+        else:
+            end = total_frames
+        chunks.append({
+            "index": len(chunks),
+            "start_frame": start,
+            "frame_cap": end - start,
+            "start_time": round(frame_time(start), 6),
+            "end_time": round(frame_time(end), 6),
+            "boundary": kind,
+            "split": "",
+        })
+        start = end
+    return chunks
+
+def build_plan(video_path, total_frames, fps, chunk_size, use_keyframes=True):
+    keyframes = media_probe.probe_keyframes(video_path) if use_keyframes else []
+    scene_cuts = detect_scene_cuts(video_path, fps)
+    chunks = plan_chunks(total_frames, fps, chunk_size, keyframes, scene_cuts)
+    aligned = sum(1 for c in chunks if c["boundary"])
+    print(f"🧩 Chunk plan: {len(chunks)} chunks ({aligned} boundaries snapped to "
+          f"keyframes/scene cuts, {len(keyframes)} keyframes indexed)")
+    return chunks
+
+def load_or_build_plan(target_dir_path, video_path, total_frames, fps, chunk_size, use_keyframes=True):
+    """作業フォルダに保存済みのプランがあれば再利用（再開時にチャンク番号がずれないように）"""
+    plan_path = os.path.join(target_dir_path, PLAN_FILE_NAME)
+    if os.path.exists(plan_path):
+        try:
+            with open(plan_path, "r", encoding="utf-8") as f:
+                saved = json.load(f)
+            if saved.get("total_frames") == total_frames and saved.get("chunk_size") == chunk_size:
+                return saved["chunks"]
+        except (OSError, ValueError, KeyError):
+            pass
+
+    chunks = build_plan(video_path, total_frames, fps, chunk_size, use_keyframes)
+    save_plan(target_dir_path, total_frames, fps, chunk_size, chunks)
+    return chunks
+
+def save_plan(target_dir_path, total_frames, fps, chunk_size, chunks):
+    os.makedirs(target_dir_path, exist_ok=True)
+    plan_path = os.path.join(target_dir_path, PLAN_FILE_NAME)
+    with open(plan_path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump({"total_frames": total_frames, "chunk_size": chunk_size, "fps": fps, "chunks": chunks}, f, indent=1)
+    os.replace(plan_path + ".tmp", plan_path)
+
+def load_saved_chunks(target_dir_path):
+    """保存済みプランのチャンク一覧（無ければ None）。結合時に対象パーツを絞り込むのに使う"""
+    try:
+        with open(os.path.join(target_dir_path, PLAN_FILE_NAME), "r", encoding="utf-8") as f:
+            return json.load(f)["chunks"]
+    except (OSError, ValueError, KeyError):
+        return None
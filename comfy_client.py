@@ -0,0 +1,345 @@
+import json
+import os
+import time
+import uuid
+import requests
+from requests.adapters import HTTPAdapter
+
+try:
+    import websocket  # websocket-client（無ければポーリングで代用）
+except ImportError:
+    websocket = None
+
+# ================= 設定エリア =================
+HEALTH_CHECK_TIMEOUT = 3.0   # /queue の応答待ち（秒）
+DOWN_RETRY_INTERVAL = 30.0   # ダウン判定したサーバーを再チェックするまでの秒数
+HTTP_TIMEOUT = 30.0          # /prompt, /history などの応答待ち（秒）
+TRANSFER_TIMEOUT = 600.0     # /upload, /view でのファイル転送の応答待ち（秒）
+WS_CONNECT_TIMEOUT = 5.0     # /ws 接続待ち（秒）
+WS_RECV_TIMEOUT = 5.0        # /ws 受信待ち。これを超えるたびに締め切りを確認
+WS_IDLE_CHECK = 60.0         # イベントが来ないままこの秒数経ったら /queue で生存確認
+POLL_INTERVAL = 1.0          # ポーリング時の間隔（秒）
+MAX_POLL_FAILURES = 10       # 連続してこの回数つながらなければサーバー停止とみなす
+# ============================================
+
+_session = None
+
+def get_session():
+    """keep-alive でコネクションを使い回す共有セッション"""
+    global _session
+    if _session is None:
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=8, pool_maxsize=16)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        _session = session
+    return _session
+
+def normalize_url(url):
+    url = url.strip().rstrip("/")
+    if not url.startswith(("http://", "https://")):
+        url = "http://" + url
+    return url
+
+def get_queue_depth(server_url, timeout=HEALTH_CHECK_TIMEOUT):
+    """ComfyUI の /queue から 実行中+待機中 のプロンプト数を返す"""
+    data = get_queue(server_url, timeout)
+    return len(data.get("queue_running", [])) + len(data.get("queue_pending", []))
+
+def get_queue(server_url, timeout=HEALTH_CHECK_TIMEOUT):
+    resp = get_session().get(f"{server_url}/queue", timeout=timeout)
+    resp.raise_for_status()
+    return resp.json()
+
+def get_system_stats(server_url, timeout=HEALTH_CHECK_TIMEOUT):
+    """/system_stats から使用中のメモリを返す: {"ram_used", "ram_total", "vram_used", "vram_total"}（バイト）。
+    GPU が複数あれば合計する。取れなければ None"""
+    try:
+        resp = get_session().get(f"{server_url}/system_stats", timeout=timeout)
+        resp.raise_for_status()
+        data = resp.json()
+    except (requests.RequestException, ValueError):
+        return None
+    system = data.get("system", {})
+    devices = [d for d in data.get("devices", []) if d.get("vram_total")]
+    return {
+        "ram_used": system.get("ram_total", 0) - system.get("ram_free", 0),
+        "ram_total": system.get("ram_total", 0),
+        "vram_used": sum(d["vram_total"] - d.get("vram_free", 0) for d in devices),
+        "vram_total": sum(d["vram_total"] for d in devices),
+    }
+
+def queue_prompt(server_url, workflow, client_id=None, timeout=HTTP_TIMEOUT):
+    payload = {"prompt": workflow}
+    if client_id:
+        payload["client_id"] = client_id
+    resp = get_session().post(f"{server_url}/prompt", json=payload, timeout=timeout)
+    resp.raise_for_status()
+    return resp.json()
+
+def get_history(server_url, prompt_id, timeout=HTTP_TIMEOUT):
+    """/history/{prompt_id} の該当エントリを返す（無ければ None）。
+    ビルドによっては履歴全体が返ってくるので必ず prompt_id で引き直す"""
+    resp = get_session().get(f"{server_url}/history/{prompt_id}", timeout=timeout)
+    resp.raise_for_status()
+    return resp.json().get(prompt_id)
+
+def cancel_prompt(server_url, prompt_id, timeout=HTTP_TIMEOUT):
+    """待機中のプロンプトをキューから取り除く（実行中のものには触らない）"""
+    try:
+        get_session().post(f"{server_url}/queue", json={"delete": [prompt_id]}, timeout=timeout)
+    except requests.RequestException:
+        pass
+
+def upload_input(server_url, path, subfolder="", timeout=TRANSFER_TIMEOUT):
+    """ComfyUI の input フォルダへファイルを送る（/upload/image は動画も受け付ける）。
+    ローダーの video に渡すサーバー側の名前 ("subfolder/name") を返す"""
+    with open(path, "rb") as f:
+        resp = get_session().post(f"{server_url}/upload/image",
+                                  files={"image": (os.path.basename(path), f, "application/octet-stream")},
+                                  data={"subfolder": subfolder, "type": "input", "overwrite": "true"},
+                                  timeout=timeout)
+    resp.raise_for_status()
+    data = resp.json()
+    return f"{data['subfolder']}/{data['name']}" if data.get("subfolder") else data["name"]
+
+def output_files(history_entry, node_id):
+    """/history のエントリから、指定ノードが書き出したファイルの情報 {filename, subfolder, type} を返す"""
+    outputs = ((history_entry or {}).get("outputs") or {}).get(str(node_id)) or {}
+    return [f for key in ("gifs", "videos", "images") for f in outputs.get(key, []) if f.get("filename")]
+
+def download_output(server_url, file_info, dest_path, timeout=TRANSFER_TIMEOUT):
+    """/view で出力ファイルを取ってくる。途中で切れたファイルを残さないよう一時ファイルから置き換える"""
+    params = {"filename": file_info["filename"], "subfolder": file_info.get("subfolder", ""),
+              "type": file_info.get("type", "output")}
+    tmp_path = dest_path + ".part"
+    with get_session().get(f"{server_url}/view", params=params, stream=True, timeout=timeout) as resp:
+        resp.raise_for_status()
+        with open(tmp_path, "wb") as f:
+            for block in resp.iter_content(1024 * 1024):
+                f.write(block)
+    os.replace(tmp_path, dest_path)
+    return dest_path
+
+def prompt_ids_in_queue(data):
+    """/queue の応答に載っている（実行中・待機中の）prompt_id の集合"""
+    # queue_running / queue_pending の各要素は [番号, prompt_id, prompt, extra, outputs]
+    ids = set()
+    for item in data.get("queue_running", []) + data.get("queue_pending", []):
+        if len(item) > 1:
+            ids.add(item[1])
+    return ids
+
+def queued_prompt_ids(server_url, timeout=HEALTH_CHECK_TIMEOUT):
+    """サーバーのキューにある（実行中・待機中の）prompt_id の集合"""
+    return prompt_ids_in_queue(get_queue(server_url, timeout))
+
+class PromptWatcher:
+    """/ws の実行イベントを購読してプロンプトの完了を待つ。
+    websocket が使えない時は /queue を軽くポーリングし、消えた時点で /history を1回だけ引く"""
+
+    def __init__(self, server_url, client_id=None):
+        self.server_url = server_url
+        self.client_id = client_id or uuid.uuid4().hex
+        self.ws = None
+        self.progress = {}   # node_id -> (value, max)
+        self.started_at = None  # サーバーで実行が始まった時刻（execution_start / queue_running で検知）
+        self.node_started = {}  # node_id -> そのノードの実行が始まった時刻（/ws の executing で検知）
+
+    def connect(self):
+        """プロンプト投入前に呼ぶ（イベントの取りこぼし防止）。成功すれば True"""
+        if websocket is None:
+            return False
+        ws_url = "ws" + self.server_url[len("http"):] + f"/ws?clientId={self.client_id}"
+        try:
+            self.ws = websocket.create_connection(ws_url, timeout=WS_CONNECT_TIMEOUT)
+            self.ws.settimeout(WS_RECV_TIMEOUT)
+            return True
+        except Exception:
+            self.ws = None
+            return False
+
+    def close(self):
+        if self.ws is not None:
+            try: self.ws.close()
+            except Exception: pass
+            self.ws = None
+
+    def wait(self, prompt_id, timeout=None, done_node=None, on_progress=None, cancel_event=None):
+        """完了を待って {"status": "success"|"error"|"timeout"|"cancelled", "via": "ws"|"poll", ...} を返す。
+        done_node を渡すと、そのノードの executed イベントで即完了とみなす。
+        cancel_event (threading.Event) がセットされたら待つのをやめる"""
+        start = time.time()
+        deadline = start + timeout if timeout else None
+        result = None
+        if self.ws is not None:
+            result = self._wait_ws(prompt_id, deadline, done_node, on_progress, cancel_event)
+        if result is None:
+            result = self._wait_poll(prompt_id, deadline, cancel_event)
+        result["elapsed"] = time.time() - start
+        if result["status"] == "timeout":
+            cancel_prompt(self.server_url, prompt_id)
+        return result
+
+    def _wait_ws(self, prompt_id, deadline, done_node, on_progress, cancel_event):
+        last_event = time.time()
+        while deadline is None or time.time() < deadline:
+            if cancel_event is not None and cancel_event.is_set():
+                return {"status": "cancelled", "via": "ws"}
+            try:
+                msg = self.ws.recv()
+            except websocket.WebSocketTimeoutException:
+                # イベントが途絶えていたら、取りこぼしやサーバー停止を /queue で確認
+                if time.time() - last_event > WS_IDLE_CHECK:
+                    last_event = time.time()
+                    try:
+                        if prompt_id not in prompt_ids_in_queue(get_queue(self.server_url)):
+                            return self._history_result(prompt_id, "ws")
+                    except requests.RequestException:
+                        return None
+                continue
+            except Exception:
+                # 接続断 → ポーリングに切り替え
+                self.close()
+                return None
+
+            if not isinstance(msg, str):
+                continue  # プレビュー画像などのバイナリ
+            last_event = time.time()
+            try:
+                event = json.loads(msg)
+            except ValueError:
+                continue
+            etype = event.get("type")
+            data = event.get("data") or {}
+            if data.get("prompt_id") != prompt_id:
+                continue
+
+            if etype == "progress":
+                self.progress[data.get("node")] = (data.get("value", 0), data.get("max", 0))
+                if on_progress:
+                    on_progress(data.get("node"), data.get("value", 0), data.get("max", 0))
+            elif etype == "execution_start":
+                self.started_at = time.time()
+            elif etype == "executed":
+                if done_node is not None and str(data.get("node")) == str(done_node):
+                    return {"status": "success", "via": "ws", "output": data.get("output")}
+            elif etype == "execution_success":
+                return {"status": "success", "via": "ws"}
+            elif etype == "executing" and data.get("node") is not None:
+                self.node_started.setdefault(str(data["node"]), time.time())
+            elif etype == "executing" and data.get("node") is None:
+                # 古いビルドは execution_success を送らず、node=None の executing で終了を知らせる
+                return {"status": "success", "via": "ws"}
+            elif etype in ("execution_error", "execution_interrupted"):
+                return {"status": "error", "via": "ws",
+                        "error": data.get("exception_message") or etype}
+        return {"status": "timeout", "via": "ws"}
+
+    def _wait_poll(self, prompt_id, deadline, cancel_event):
+        failures = 0
+        while deadline is None or time.time() < deadline:
+            if cancel_event is not None and cancel_event.is_set():
+                return {"status": "cancelled", "via": "poll"}
+            try:
+                data = get_queue(self.server_url, HTTP_TIMEOUT)
+                failures = 0
+                if self.started_at is None and prompt_id in prompt_ids_in_queue({"queue_running": data.get("queue_running", [])}):
+                    self.started_at = time.time()
+                if prompt_id not in prompt_ids_in_queue(data):
+                    return self._history_result(prompt_id, "poll")
+            except requests.RequestException as e:
+                failures += 1
+                if failures >= MAX_POLL_FAILURES:
+                    return {"status": "error", "via": "poll", "error": f"server unreachable ({e.__class__.__name__})"}
+            time.sleep(POLL_INTERVAL)
+        return {"status": "timeout", "via": "poll"}
+
+    def _history_result(self, prompt_id, via):
+        try:
+            entry = get_history(self.server_url, prompt_id)
+        except requests.RequestException as e:
+            return {"status": "error", "via": via, "error": f"history unavailable ({e.__class__.__name__})"}
+        if entry is None:
+            return {"status": "error", "via": via, "error": "prompt disappeared from queue without history"}
+        status = entry.get("status") or {}
+        if status.get("status_str") == "error":
+            return {"status": "error", "via": via, "error": "execution error"}
+        return {"status": "success", "via": via, "output": entry.get("outputs")}
+
+class ServerPool:
+    """複数の ComfyUI サーバーを束ね、/queue の深さで一番空いている所にチャンクを割り振る"""
+
+    def __init__(self, urls, max_inflight_per_server=1):
+        self.max_inflight = max_inflight_per_server
+        self.servers = {}
+        for url in urls:
+            self.servers[normalize_url(url)] = {
+                "alive": True,
+                "depth": 0,        # 最後に /queue で見えた深さ
+                "inflight": 0,     # このマネージャーが投げて未完了のチャンク数
+                "last_check": 0.0,
+            }
+
+    def check(self, url):
+        info = self.servers[url]
+        info["last_check"] = time.time()
+        try:
+            info["depth"] = get_queue_depth(url)
+            if not info["alive"]:
+                print(f"🟢 Server back online: {url}")
+            info["alive"] = True
+        except Exception as e:
+            if info["alive"]:
+                print(f"🔴 Server down: {url} ({e.__class__.__name__})")
+            info["alive"] = False
+        return info["alive"]
+
+    def refresh(self):
+        """全サーバーの /queue を確認し、今回ダウンに転じたサーバーのリストを返す"""
+        now = time.time()
+        newly_down = []
+        for url, info in self.servers.items():
+            if not info["alive"] and now - info["last_check"] < DOWN_RETRY_INTERVAL:
+                continue
+            was_alive = info["alive"]
+            if not self.check(url) and was_alive:
+                newly_down.append(url)
+        return newly_down
+
+    def acquire(self):
+        """空きのある生存サーバーの中から一番負荷の低いものを選ぶ（無ければ None）"""
+        candidates = [
+            (info["depth"], info["inflight"], url)
+            for url, info in self.servers.items()
+            if info["alive"] and info["inflight"] < self.max_inflight
+        ]
+        if not candidates:
+            return None
+        _, _, url = min(candidates)
+        self.servers[url]["inflight"] += 1
+        # 次の /queue 確認までの間に同じサーバーへ偏らないよう、見かけの深さも増やしておく
+        self.servers[url]["depth"] += 1
+        return url
+
+    def adopt(self, url):
+        """前回の実行が投げたまま残っているプロンプトを引き継ぐ。上限に関係なく実行中として数える"""
+        if url not in self.servers or not self.servers[url]["alive"]:
+            return False
+        self.servers[url]["inflight"] += 1
+        return True
+
+    def release(self, url):
+        info = self.servers.get(url)
+        if info and info["inflight"] > 0:
+            info["inflight"] -= 1
+
+    def has_alive(self):
+        return any(info["alive"] for info in self.servers.values())
+
+    def status_line(self):
+        parts = []
+        for url, info in self.servers.items():
+            state = f"q={info['depth']} run={info['inflight']}" if info["alive"] else "DOWN"
+            parts.append(f"{url} [{state}]")
+        return " | ".join(parts)
@@ -0,0 +1,57 @@
+import os
+import shutil
+import time
+
+# ================= 設定エリア =================
+MIN_FREE_GB = 20.0        # 空きがこれを下回りそうなら新しいチャンクの生成・CFR 変換を始めない（0 で無効）
+WAIT_INTERVAL = 10.0      # 空き待ちの間に確認し直す間隔（秒）
+# ============================================
+
+def free_bytes(path):
+    """path のあるディスクの空き容量。path がまだ無ければ、あるところまで親をたどる"""
+    path = os.path.abspath(path)
+    while not os.path.exists(path):
+        parent = os.path.dirname(path)
+        if parent == path:
+            break
+        path = parent
+    try:
+        return shutil.disk_usage(path).free
+    except OSError:
+        return None
+
+def shortfall(path, upcoming_bytes=0, min_free_gb=None):
+    """upcoming_bytes を書いた後も MIN_FREE_GB 残るか。足りなければ不足バイト数、足りていれば 0。
+    min_free_gb を省略すると、その時点の MIN_FREE_GB を使う（実行中に設定を変えても効く）"""
+    if min_free_gb is None:
+        min_free_gb = MIN_FREE_GB
+    if not min_free_gb:
+        return 0
+    free = free_bytes(path)
+    if free is None:
+        return 0
+    return max(0, int(min_free_gb * 1024 ** 3) + upcoming_bytes - free)
+
+def has_room(path, upcoming_bytes=0, min_free_gb=None):
+    return shortfall(path, upcoming_bytes, min_free_gb) == 0
+
+def wait_for_room(path, upcoming_bytes=0, label="", min_free_gb=None, can_free=None):
+    """空きができるまで待つ（他の処理が終わってファイルが消えるのを待つ）。待った秒数を返す。
+    can_free() が False を返したら、待っても空かないので警告して待たずに戻る"""
+    start = time.time()
+    if has_room(path, upcoming_bytes, min_free_gb):
+        return 0.0
+    keep = MIN_FREE_GB if min_free_gb is None else min_free_gb
+    print(f"⏸️ Low disk space ({format_gb(free_bytes(path))} free, keeping {keep:g} GB). "
+          f"Waiting before {label or 'writing more'}...")
+    while not has_room(path, upcoming_bytes, min_free_gb):
+        if can_free is not None and not can_free() and not has_room(path, upcoming_bytes, min_free_gb):
+            print(f"⚠️ Nothing in progress can free disk space. Continuing with {label or 'writing'} anyway.")
+            return time.time() - start
+        time.sleep(WAIT_INTERVAL)
+    waited = time.time() - start
+    print(f"▶️ Disk space available again after {waited:.0f}s.")
+    return waited
+
+def format_gb(nbytes):
+    return "?" if nbytes is None else f"{nbytes / 1024 ** 3:.1f} GB"
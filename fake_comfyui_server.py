@@ -0,0 +1,433 @@
+"""ベンチマーク用の ComfyUI の代役。GPU なしでオーケストレーター側の性能を測るためのもの。
+
+/prompt, /queue, /history, /ws（実行イベント）, /interrupt, /upload/image, /view, /system_stats に ComfyUI と同じ形で応答し、
+VHS_VideoCombine の出力の代わりに ffmpeg の testsrc で part_XXX_00001.mp4 を書き出す。
+ローダーの video が相対パスなら input フォルダ（アップロード先）に無いと失敗させる。
+1フレームあたりの処理時間・失敗・サーバー停止を指定できる。
+
+    python fake_comfyui_server.py --port 18188 --output ~/ComfyUI/output --latency 0.005
+"""
+import argparse
+import base64
+import email.parser
+import email.policy
+import hashlib
+import json
+import os
+import random
+import socket
+import struct
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+# ================= 設定エリア =================
+DEFAULT_PORT = 18188
+DEFAULT_LATENCY = 0.005      # 1フレームあたりの擬似処理時間（秒）
+DEFAULT_SIZE = "64x48"       # 書き出す testsrc の解像度（小さいほど書き出しが速い）
+PROGRESS_STEPS = 4           # 1プロンプトあたりの progress イベント数
+RAM_TOTAL = 64 * 1024 ** 3   # /system_stats で返すメモリ量
+VRAM_TOTAL = 24 * 1024 ** 3
+IDLE_RAM = 6 * 1024 ** 3     # 何も実行していない時の使用量
+IDLE_VRAM = 1 * 1024 ** 3
+MODEL_VRAM = 3 * 1024 ** 3   # 最初のプロンプトで読み込み、以降は載ったままのモデル
+DEFAULT_MEM_PER_FRAME = 40 * 1024 ** 2   # 実行中に1フレームあたり増える RAM（VRAM は固定量）
+WS_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+# ============================================
+
+def _find_node(workflow, prefix, fallback):
+    for node_id, node in workflow.items():
+        if str(node.get("class_type", "")).startswith(prefix):
+            return node_id
+    return fallback
+
+class FakeComfyUI:
+    """1台ぶんの擬似 ComfyUI。本物と同じくプロンプトは1本ずつ順番に実行する"""
+
+    def __init__(self, port=DEFAULT_PORT, output_dir=".", latency=DEFAULT_LATENCY, prompt_overhead=0.0,
+                 size=DEFAULT_SIZE, fail_over_frames=None, fail_rate=0.0, die_after=None, seed=0, input_dir=None,
+                 drop_rate=0.0, mem_per_frame=DEFAULT_MEM_PER_FRAME):
+        self.port = port
+        self.output_dir = output_dir
+        self.input_dir = input_dir or os.path.join(output_dir, "_input")
+        self.latency = latency
+        self.prompt_overhead = prompt_overhead   # モデル読み込みなど、フレーム数に関係ない1プロンプトごとの時間
+        self.size = size
+        self.fail_over_frames = fail_over_frames   # これより多いフレーム数のプロンプトは OOM 扱いで失敗
+        self.fail_rate = fail_rate                 # ランダムに失敗させる割合
+        self.die_after = die_after                 # この数のプロンプトを終えたらサーバーごと停止
+        self.drop_rate = drop_rate                 # この割合の出力はフレームが数枚欠ける（成功扱いのまま）
+        self.mem_per_frame = mem_per_frame         # 実行中のフレーム数に比例して RAM 使用量を増やす（/system_stats）
+        self.random = random.Random(seed)
+        self.loaded_frames = 0
+        self.model_loaded = False
+
+        self.lock = threading.Condition()
+        self.pending = []        # [(number, prompt_id, workflow, client_id)]
+        self.running = None
+        self.history = {}
+        self.sockets = {}        # client_id -> (socket, send_lock)
+        self.connections = set() # keep-alive 中の HTTP 接続（停止時にまとめて切る）
+        self.number = 0
+        self.stats = {"prompts": 0, "failed": 0, "frames": 0, "busy_seconds": 0.0,
+                      "first_start": None, "last_end": None, "uploads": 0, "upload_bytes": 0,
+                      "downloads": 0, "download_bytes": 0}
+        self.alive = False
+        self.httpd = None
+
+    # ---------- 起動・停止 ----------
+    def start(self):
+        server = self
+
+        class Handler(_Handler):
+            fake = server
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", self.port), Handler)
+        self.httpd.daemon_threads = True
+        self.alive = True
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        threading.Thread(target=self._worker, daemon=True).start()
+        return self
+
+    def stop(self):
+        """サーバー停止（クラッシュ相当）。/ws も切る"""
+        with self.lock:
+            if not self.alive:
+                return
+            self.alive = False
+            self.lock.notify_all()
+            sockets = [sock for sock, _ in self.sockets.values()] + list(self.connections)
+            self.sockets.clear()
+            self.connections.clear()
+        for sock in sockets:
+            try: sock.shutdown(socket.SHUT_RDWR)
+            except OSError: pass
+
+        def _shutdown():
+            self.httpd.shutdown()
+            self.httpd.server_close()
+        threading.Thread(target=_shutdown, daemon=True).start()
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.port}"
+
+    # ---------- /ws ----------
+    def send(self, client_id, event_type, data):
+        with self.lock:
+            target = self.sockets.get(client_id)
+        if target is None:
+            return
+        sock, send_lock = target
+        payload = json.dumps({"type": event_type, "data": data}).encode("utf-8")
+        if len(payload) < 126:
+            header = struct.pack("!BB", 0x81, len(payload))
+        elif len(payload) < 65536:
+            header = struct.pack("!BBH", 0x81, 126, len(payload))
+        else:
+            header = struct.pack("!BBQ", 0x81, 127, len(payload))
+        try:
+            with send_lock:
+                sock.sendall(header + payload)
+        except OSError:
+            with self.lock:
+                self.sockets.pop(client_id, None)
+
+    # ---------- 実行 ----------
+    def queue(self, workflow, client_id):
+        with self.lock:
+            self.number += 1
+            prompt_id = uuid.uuid4().hex
+            self.pending.append((self.number, prompt_id, workflow, client_id))
+            self.lock.notify_all()
+            return prompt_id, self.number
+
+    def _worker(self):
+        while True:
+            with self.lock:
+                while self.alive and not self.pending:
+                    self.lock.wait()
+                if not self.alive:
+                    return
+                self.running = self.pending.pop(0)
+            number, prompt_id, workflow, client_id = self.running
+            entry = self._execute(prompt_id, workflow, client_id)
+            with self.lock:
+                self.history[prompt_id] = entry
+                self.running = None
+                done = self.stats["prompts"] + self.stats["failed"]
+            if self.die_after is not None and done >= self.die_after:
+                self.stop()
+                return
+
+    def _execute(self, prompt_id, workflow, client_id):
+        loader_id = _find_node(workflow, "VHS_LoadVideo", "1")
+        saver_id = _find_node(workflow, "VHS_VideoCombine", "4")
+        middle_id = next((n for n in workflow if n not in (loader_id, saver_id)), loader_id)
+        loader = workflow.get(loader_id, {}).get("inputs", {})
+        saver = workflow.get(saver_id, {}).get("inputs", {})
+        frames = int(loader.get("frame_load_cap") or 1)
+        rate = float(saver.get("frame_rate") or 30)
+        prefix = saver.get("filename_prefix", "ComfyUI")
+
+        started = time.time()
+        self.send(client_id, "execution_start", {"prompt_id": prompt_id})
+        self.send(client_id, "executing", {"node": loader_id, "prompt_id": prompt_id})
+        time.sleep(self.prompt_overhead)
+        with self.lock:
+            self.loaded_frames = frames
+            self.model_loaded = True
+        self.send(client_id, "executing", {"node": middle_id, "prompt_id": prompt_id})
+
+        video = str(loader.get("video") or "")
+        missing = bool(video) and not os.path.isabs(video) and not os.path.exists(os.path.join(self.input_dir, video))
+        failed = ((self.fail_over_frames is not None and frames > self.fail_over_frames)
+                  or (self.fail_rate and self.random.random() < self.fail_rate) or missing)
+        steps = PROGRESS_STEPS if not failed else 1
+        for step in range(1, steps + 1):
+            time.sleep(frames * self.latency / PROGRESS_STEPS)
+            self.send(client_id, "progress", {"value": step, "max": PROGRESS_STEPS,
+                                              "node": middle_id, "prompt_id": prompt_id})
+
+        written = frames
+        if not failed and self.drop_rate and self.random.random() < self.drop_rate:
+            written = max(1, frames - self.random.randint(1, 3))
+        outputs = {}
+        if not failed:
+            self.send(client_id, "executing", {"node": saver_id, "prompt_id": prompt_id})
+            path = os.path.join(self.output_dir, f"{prefix}_00001.mp4")
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            res = subprocess.run([
+                "ffmpeg", "-y", "-v", "error", "-f", "lavfi", "-i", f"testsrc=size={self.size}:rate={rate}",
+                "-frames:v", str(written), "-pix_fmt", "yuv420p", "-c:v", "libx264", "-preset", "ultrafast", path
+            ], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            failed = res.returncode != 0
+            outputs = {saver_id: {"gifs": [{"filename": os.path.basename(path), "subfolder": os.path.dirname(prefix),
+                                            "type": "output", "format": "video/h264-mp4"}]}}
+
+        finished = time.time()
+        with self.lock:
+            self.loaded_frames = 0
+            self.stats["busy_seconds"] += finished - started
+            self.stats["first_start"] = self.stats["first_start"] or started
+            self.stats["last_end"] = finished
+            if failed:
+                self.stats["failed"] += 1
+            else:
+                self.stats["prompts"] += 1
+                self.stats["frames"] += frames
+                self.stats["short_outputs"] = self.stats.get("short_outputs", 0) + (written != frames)
+
+        if failed:
+            self.send(client_id, "execution_error", {
+                "prompt_id": prompt_id, "node_id": middle_id,
+                "exception_message": "Allocation on device failed (simulated OOM)"})
+            return {"prompt": [0, prompt_id, workflow, {}, []], "outputs": {},
+                    "status": {"status_str": "error", "completed": False, "messages": []}}
+
+        self.send(client_id, "executed", {"node": saver_id, "output": outputs[saver_id], "prompt_id": prompt_id})
+        self.send(client_id, "executing", {"node": None, "prompt_id": prompt_id})
+        self.send(client_id, "execution_success", {"prompt_id": prompt_id})
+        return {"prompt": [0, prompt_id, workflow, {}, []], "outputs": outputs,
+                "status": {"status_str": "success", "completed": True, "messages": []}}
+
+    def system_stats(self):
+        with self.lock:
+            ram_used = IDLE_RAM + self.loaded_frames * self.mem_per_frame
+            vram_used = IDLE_VRAM + (MODEL_VRAM if self.model_loaded else 0) + (1024 ** 3 if self.loaded_frames else 0)
+        return {"system": {"os": "posix", "ram_total": RAM_TOTAL, "ram_free": max(0, RAM_TOTAL - ram_used)},
+                "devices": [{"name": "fake", "type": "cuda", "index": 0,
+                             "vram_total": VRAM_TOTAL, "vram_free": max(0, VRAM_TOTAL - vram_used)}]}
+
+    def queue_state(self):
+        with self.lock:
+            running = [[self.running[0], self.running[1], {}, {}, []]] if self.running else []
+            pending = [[n, pid, {}, {}, []] for n, pid, _, _ in self.pending]
+        return {"queue_running": running, "queue_pending": pending}
+
+class _Handler(BaseHTTPRequestHandler):
+    fake = None
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def setup(self):
+        super().setup()
+        with self.fake.lock:
+            self.fake.connections.add(self.connection)
+
+    def finish(self):
+        with self.fake.lock:
+            self.fake.connections.discard(self.connection)
+        try:
+            super().finish()
+        except OSError:
+            pass
+
+    def _json(self, obj, code=200):
+        body = json.dumps(obj).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == "/ws":
+            return self._websocket(parse_qs(url.query).get("clientId", [uuid.uuid4().hex])[0])
+        if url.path == "/queue":
+            return self._json(self.fake.queue_state())
+        if url.path == "/system_stats":
+            return self._json(self.fake.system_stats())
+        if url.path.startswith("/history"):
+            prompt_id = url.path[len("/history/"):]
+            with self.fake.lock:
+                if prompt_id:
+                    return self._json({prompt_id: self.fake.history[prompt_id]} if prompt_id in self.fake.history else {})
+                return self._json(dict(self.fake.history))
+        if url.path == "/view":
+            return self._view(parse_qs(url.query))
+        if url.path == "/bench/stats":
+            with self.fake.lock:
+                return self._json(dict(self.fake.stats))
+        self._json({}, 404)
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        if url.path == "/upload/image":
+            return self._upload()
+        body = self._body()
+        if url.path == "/prompt":
+            prompt_id, number = self.fake.queue(body["prompt"], body.get("client_id"))
+            return self._json({"prompt_id": prompt_id, "number": number, "node_errors": {}})
+        if url.path == "/queue":
+            with self.fake.lock:
+                delete = set(body.get("delete", []))
+                if body.get("clear"):
+                    self.fake.pending.clear()
+                self.fake.pending = [p for p in self.fake.pending if p[1] not in delete]
+            return self._json({})
+        if url.path == "/interrupt":
+            return self._json({})
+        self._json({}, 404)
+
+    def _upload(self):
+        """multipart/form-data の image と subfolder を受け取って input フォルダに保存する"""
+        length = int(self.headers.get("Content-Length") or 0)
+        raw = b"Content-Type: " + self.headers.get("Content-Type", "").encode() + b"\r\n\r\n" + self.rfile.read(length)
+        message = email.parser.BytesParser(policy=email.policy.HTTP).parsebytes(raw)
+        fields = {}
+        upload = None
+        for part in message.iter_parts():
+            name = part.get_param("name", header="content-disposition")
+            if name == "image":
+                upload = (os.path.basename(part.get_filename() or "upload.bin"), part.get_payload(decode=True))
+            elif name:
+                fields[name] = part.get_payload(decode=True).decode()
+        if upload is None:
+            return self._json({"error": "no image"}, 400)
+        subfolder = fields.get("subfolder", "").strip("/")
+        folder = os.path.join(self.fake.input_dir, subfolder)
+        os.makedirs(folder, exist_ok=True)
+        with open(os.path.join(folder, upload[0]), "wb") as f:
+            f.write(upload[1])
+        with self.fake.lock:
+            self.fake.stats["uploads"] += 1
+            self.fake.stats["upload_bytes"] += len(upload[1])
+        return self._json({"name": upload[0], "subfolder": subfolder, "type": "input"})
+
+    def _view(self, query):
+        base = self.fake.input_dir if query.get("type", ["output"])[0] == "input" else self.fake.output_dir
+        path = os.path.join(base, query.get("subfolder", [""])[0], os.path.basename(query.get("filename", [""])[0]))
+        if not os.path.isfile(path):
+            return self._json({}, 404)
+        with open(path, "rb") as f:
+            body = f.read()
+        with self.fake.lock:
+            self.fake.stats["downloads"] += 1
+            self.fake.stats["download_bytes"] += len(body)
+        self.send_response(200)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _websocket(self, client_id):
+        key = self.headers.get("Sec-WebSocket-Key", "")
+        accept = base64.b64encode(hashlib.sha1((key + WS_GUID).encode()).digest()).decode()
+        self.send_response(101)
+        self.send_header("Upgrade", "websocket")
+        self.send_header("Connection", "Upgrade")
+        self.send_header("Sec-WebSocket-Accept", accept)
+        self.end_headers()
+        self.wfile.flush()
+        sock = self.connection
+        with self.fake.lock:
+            self.fake.sockets[client_id] = (sock, threading.Lock())
+            remaining = len(self.fake.pending) + (1 if self.fake.running else 0)
+        self.fake.send(client_id, "status", {"status": {"exec_info": {"queue_remaining": remaining}}, "sid": client_id})
+        # クライアントからのフレームは close と ping だけ扱う
+        try:
+            while True:
+                head = self.rfile.read(2)
+                if len(head) < 2:
+                    break
+                opcode, length = head[0] & 0x0F, head[1] & 0x7F
+                if length == 126:
+                    length = struct.unpack("!H", self.rfile.read(2))[0]
+                elif length == 127:
+                    length = struct.unpack("!Q", self.rfile.read(8))[0]
+                mask = self.rfile.read(4) if head[1] & 0x80 else b"\0\0\0\0"
+                payload = bytes(b ^ mask[i % 4] for i, b in enumerate(self.rfile.read(length)))
+                if opcode == 0x8:
+                    break
+                if opcode == 0x9:
+                    with self.fake.lock:
+                        _, send_lock = self.fake.sockets.get(client_id, (None, threading.Lock()))
+                    with send_lock:
+                        sock.sendall(struct.pack("!BB", 0x8A, len(payload)) + payload)
+        except OSError:
+            pass
+        finally:
+            with self.fake.lock:
+                if self.fake.sockets.get(client_id, (None,))[0] is sock:
+                    self.fake.sockets.pop(client_id, None)
+            self.close_connection = True
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stand-in for the ComfyUI API (benchmarks)")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--output", default=os.path.join(os.path.expanduser("~"), "ComfyUI", "output"))
+    parser.add_argument("--input", help="Upload folder (default: <output>/_input)")
+    parser.add_argument("--latency", type=float, default=DEFAULT_LATENCY, help="Seconds per frame")
+    parser.add_argument("--prompt_overhead", type=float, default=0.0, help="Fixed seconds per prompt")
+    parser.add_argument("--size", default=DEFAULT_SIZE)
+    parser.add_argument("--fail_over_frames", type=int, help="Fail prompts with more frames than this (OOM)")
+    parser.add_argument("--fail_rate", type=float, default=0.0)
+    parser.add_argument("--drop_rate", type=float, default=0.0, help="Share of outputs missing a few frames")
+    parser.add_argument("--die_after", type=int, help="Stop the server after N prompts")
+    args = parser.parse_args()
+
+    fake = FakeComfyUI(args.port, args.output, args.latency, args.prompt_overhead, args.size,
+                       args.fail_over_frames, args.fail_rate, args.die_after, input_dir=args.input,
+                       drop_rate=args.drop_rate).start()
+    print(f"Fake ComfyUI on {fake.url} -> {args.output} ({args.latency * 1000:.1f} ms/frame)")
+    try:
+        while fake.alive:
+            time.sleep(0.5)
+    except KeyboardInterrupt:
+        fake.stop()
+    sys.exit(0)
+
+if __name__ == "__main__":
+    main()
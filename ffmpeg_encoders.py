@@ -0,0 +1,70 @@
+import shutil
+import subprocess
+
+import media_probe
+
+# ================= 設定エリア =================
+ENCODER_CHAIN = ["h264_nvenc", "h264_qsv", "h264_vaapi", "libx264"]   # 上から順に使えるものを選ぶ
+VAAPI_DEVICE = "/dev/dri/renderD128"
+DEFAULT_QUALITY = 18     # CRF 相当の画質指定
+# ============================================
+
+_selected = {}
+
+def encoder_args(encoder, quality=DEFAULT_QUALITY):
+    """エンコーダーごとのオプション。(入力より前に置く引数, 映像フィルタの末尾, 出力側の引数) を返す"""
+    if encoder == "h264_nvenc":
+        return [], None, ["-c:v", encoder, "-preset", "p5", "-rc", "vbr", "-cq", str(quality), "-b:v", "0"]
+    if encoder == "h264_qsv":
+        return [], None, ["-c:v", encoder, "-preset", "slow", "-global_quality", str(quality)]
+    if encoder == "h264_vaapi":
+        return ["-vaapi_device", VAAPI_DEVICE], "format=nv12,hwupload", ["-c:v", encoder, "-qp", str(quality)]
+    return [], None, ["-c:v", "libx264", "-preset", "medium", "-crf", str(quality), "-pix_fmt", "yuv420p"]
+
+def _test_encoders(ffmpeg_path):
+    """-encoders に載っているだけでは使えるとは限らないので、1フレームだけ実際にエンコードしてみる"""
+    try:
+        listed = subprocess.run([ffmpeg_path, "-hide_banner", "-encoders"],
+                                stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True).stdout
+    except OSError:
+        return None
+    working = []
+    for encoder in ENCODER_CHAIN:
+        if f" {encoder} " not in listed:
+            continue
+        pre, vf, out = encoder_args(encoder)
+        cmd = [ffmpeg_path, "-hide_banner", "-v", "error", *pre,
+               "-f", "lavfi", "-i", "color=c=black:s=256x256:d=0.1"]
+        if vf: cmd += ["-vf", vf]
+        cmd += [*out, "-frames:v", "1", "-f", "null", "-"]
+        try:
+            if subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, timeout=30).returncode == 0:
+                working.append(encoder)
+        except (OSError, subprocess.TimeoutExpired):
+            pass
+    return {"working": working}
+
+def working_encoders():
+    """実際に使えた H.264 エンコーダーの一覧（ffmpeg 本体が変わらない限りキャッシュを使う）"""
+    ffmpeg_path = shutil.which("ffmpeg")
+    if ffmpeg_path is None:
+        return []
+    if ffmpeg_path not in _selected:
+        result = media_probe.cached_for_file(ffmpeg_path, "encoders", _test_encoders)
+        _selected[ffmpeg_path] = result["working"] if result else []
+    return _selected[ffmpeg_path]
+
+def pick_encoder():
+    """nvenc → qsv → vaapi → libx264 の順で、最初に使えるものを返す"""
+    working = working_encoders()
+    for encoder in ENCODER_CHAIN:
+        if encoder in working:
+            return encoder
+    return "libx264"
+
+def streams_match(infos, keys=("codec", "width", "height", "pix_fmt", "r_frame_rate", "time_base", "profile")):
+    """全チャンクの映像パラメータが同じなら True（そのまま連結できる）"""
+    if not infos or any(info is None for info in infos):
+        return False
+    first = infos[0]
+    return all(all(info.get(k) == first.get(k) for k in keys) for info in infos[1:])
@@ -0,0 +1,138 @@
+import ctypes
+import ctypes.util
+import fnmatch
+import os
+import select
+import struct
+import time
+
+# ================= 設定エリア =================
+STABLE_SECONDS = 10.0     # サイズと更新時刻がこの秒数変わらなければ「書き込み完了」とみなす
+POLL_INTERVAL = 5.0       # inotify が使えない環境（Windows・ネットワークドライブ等）での走査間隔
+IDLE_RESCAN = 300.0       # inotify 使用時も、取りこぼし対策にこの間隔で走査し直す
+# ============================================
+
+_IN_MODIFY = 0x002
+_IN_CLOSE_WRITE = 0x008
+_IN_MOVED_TO = 0x080
+_IN_CREATE = 0x100
+_EVENT_HEADER = struct.Struct("iIII")   # wd, mask, cookie, len
+
+def _open_inotify(directory):
+    """Linux の inotify を ctypes で開く（追加ライブラリ不要）。使えなければ None"""
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if fd < 0:
+            return None
+        mask = _IN_MODIFY | _IN_CLOSE_WRITE | _IN_MOVED_TO | _IN_CREATE
+        if libc.inotify_add_watch(fd, os.fsencode(directory), mask) < 0:
+            os.close(fd)
+            return None
+        return fd
+    except (OSError, AttributeError):
+        return None
+
+class FolderWatcher:
+    """フォルダに置かれた動画を見張り、書き込みが終わった（サイズが増えなくなった）ものだけを返す"""
+
+    def __init__(self, directory, patterns, stable_seconds=STABLE_SECONDS, use_inotify=True):
+        self.directory = directory
+        self.patterns = patterns
+        self.stable_seconds = stable_seconds
+        self.fd = _open_inotify(directory) if use_inotify else None
+        # inotify を待っている poll() を止める時に起こすためのパイプ（ポーリング時は max_wait で戻る）
+        self._wake = os.pipe() if self.fd is not None else None
+        self.growing = {}   # path -> ((size, mtime_ns), 最後に変化を見た時刻)
+        self.last_scan = 0.0
+
+    @property
+    def mode(self):
+        return "inotify" if self.fd is not None else "polling"
+
+    def wake(self):
+        """イベント待ちで寝ている poll() を起こして空のリストを返させる（止める時用）"""
+        if self._wake is not None:
+            os.write(self._wake[1], b"x")
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+        if self._wake is not None:
+            for fd in self._wake:
+                os.close(fd)
+            self._wake = None
+
+    def _wait_event(self, timeout):
+        """inotify のイベントを待つ（中身は読み捨てる。どのファイルかは走査で判断する）。wake() で起こされたら True"""
+        if self.fd is None:
+            time.sleep(timeout)
+            return False
+        readable, _, _ = select.select([self.fd, self._wake[0]], [], [], timeout)
+        if self.fd in readable:
+            try:
+                while os.read(self.fd, 64 * 1024):
+                    pass
+            except BlockingIOError:
+                pass
+        if self._wake[0] in readable:
+            os.read(self._wake[0], 64)
+            return True
+        return False
+
+    def _candidates(self):
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return []
+        return [os.path.join(self.directory, n) for n in sorted(names)
+                if any(fnmatch.fnmatch(n.lower(), p) for p in self.patterns)]
+
+    def scan(self):
+        """今フォルダにあるファイルのうち、STABLE_SECONDS の間 変化していないものを返す"""
+        now = time.time()
+        self.last_scan = now
+        ready = []
+        seen = set()
+        for path in self._candidates():
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            if not os.path.isfile(path) or st.st_size == 0:
+                continue
+            seen.add(path)
+            sig = (st.st_size, st.st_mtime_ns)
+            prev = self.growing.get(path)
+            if prev is None or prev[0] != sig:
+                self.growing[path] = (sig, now)
+            elif now - prev[1] >= self.stable_seconds:
+                ready.append(path)
+        for path in list(self.growing):
+            if path not in seen:
+                del self.growing[path]
+        return ready
+
+    def poll(self, is_known=lambda path: False, max_wait=None):
+        """新しく揃ったファイルが出るか max_wait 秒経つ（か wake() される）まで待って、そのリストを返す。
+        is_known(path) が True のもの（登録済み）は返さず、安定待ちの対象からも外す。
+        inotify 使用時はイベントが来るまで走査しないので、max_wait は None のままでよい"""
+        deadline = time.time() + max_wait if max_wait is not None else None
+        while True:
+            ready = [p for p in self.scan() if not is_known(p)]
+            if ready:
+                return ready
+            pending = [p for p in self.growing if not is_known(p)]
+            if self.fd is None:
+                wait = POLL_INTERVAL
+            else:
+                # 安定待ちのファイルがあれば、その判定のために起きる。無ければイベントまで寝る
+                wait = min(self.stable_seconds, POLL_INTERVAL) if pending else IDLE_RESCAN
+            if deadline is not None:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return []
+                wait = min(wait, remaining)
+            if self._wait_event(wait):
+                return []
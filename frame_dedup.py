@@ -0,0 +1,198 @@
+import json
+import os
+import subprocess
+
+import cv2
+import numpy as np
+
+import media_probe
+
+# ================= 設定エリア =================
+DEDUP_THRESHOLD = 0.3       # 縮小グレー画像の平均画素差（0-255）。圧縮ノイズは 0.1 未満、小さな動きでも 0.8 前後。これ以下なら直前に残したフレームの「使い回し」とみなす
+THUMB_WIDTH = 64            # 比較用に縮小する幅
+BLOCK_FRAMES = 64           # まとめて読み込んで比較するフレーム数
+MIN_SAVINGS = 0.1           # 減らせるフレームがこの割合未満なら重複除去しない（変換の手間の方が大きい）
+DEDUP_DIR_NAME = "dedup"
+UNIQUE_FILE_NAME = "unique.mp4"
+MAP_FILE_NAME = "frame_map.json"
+# ============================================
+
+def _frame_bytes(width, height):
+    # yuv420p: Y は全画素、U/V は縦横半分（奇数サイズは切り上げ）
+    return width * height + 2 * ((width + 1) // 2) * ((height + 1) // 2)
+
+def _thumbs(frames, width, height):
+    """(N, frame_bytes) の yuv420p から Y 面だけ取り出し、ブロック平均で縮小した (N, h, w) の float32 を返す"""
+    step = max(1, width // THUMB_WIDTH)
+    h, w = (height // step) * step, (width // step) * step
+    y = frames[:, :width * height].reshape(-1, height, width)[:, :h, :w]
+    return y.reshape(len(frames), h // step, step, w // step, step).mean(axis=(2, 4), dtype=np.float32)
+
+def _keep_flags(thumbs, anchor, threshold):
+    """直前に残したフレーム (anchor) との差が閾値を超えたフレームを残す。
+    ブロック内の全フレームとの差をまとめて計算し、超えた最初のフレームを新しい anchor にして続きを比べ直す"""
+    keep = np.zeros(len(thumbs), dtype=bool)
+    i = 0
+    if anchor is None:
+        keep[0] = True
+        anchor = thumbs[0]
+        i = 1
+    while i < len(thumbs):
+        diffs = np.abs(thumbs[i:] - anchor).mean(axis=(1, 2))
+        over = np.flatnonzero(diffs > threshold)
+        if not len(over):
+            break
+        i += int(over[0])
+        keep[i] = True
+        anchor = thumbs[i]
+        i += 1
+    return keep, anchor
+
+def video_size(path):
+    info = media_probe.probe(path)
+    if info and info["width"]:
+        return info["width"], info["height"]
+    cap = cv2.VideoCapture(path)
+    size = (int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+    cap.release()
+    return size
+
+def build_unique_stream(video_path, target_dir_path, fps, rate=None, threshold=DEDUP_THRESHOLD):
+    """1回のデコードで重複フレームを判定し、残すフレームだけを無劣化 (x264 qp0) で unique.mp4 に書き出す。
+    rate を指定すると、その fps に揃えてから判定する（ローダーの force_rate の代わり）。
+    戻り値: {"video", "total_frames", "unique_frames", "runs"}。runs[i] は i 番目のユニークフレームが
+    元のタイムライン上で何フレーム続くか。効果が小さければ None"""
+    work_dir = os.path.join(target_dir_path, DEDUP_DIR_NAME)
+    unique_path = os.path.join(work_dir, UNIQUE_FILE_NAME)
+    map_path = os.path.join(work_dir, MAP_FILE_NAME)
+    identity = {"source": media_probe.fingerprint(video_path), "threshold": threshold, "rate": rate}
+
+    try:
+        with open(map_path, "r", encoding="utf-8") as f:
+            saved = json.load(f)
+        if saved.get("identity") == identity and (not saved["worthwhile"] or os.path.exists(unique_path)):
+            return _result(saved, unique_path)
+    except (OSError, ValueError, KeyError):
+        pass
+
+    os.makedirs(work_dir, exist_ok=True)
+    width, height = video_size(video_path)
+    frame_bytes = _frame_bytes(width, height)
+    decoder = subprocess.Popen([
+        "ffmpeg", "-v", "error", "-i", video_path, *(["-vf", f"fps={rate}"] if rate else []),
+        "-f", "rawvideo", "-pix_fmt", "yuv420p", "-"
+    ], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    encoder = subprocess.Popen([
+        "ffmpeg", "-y", "-v", "error",
+        "-f", "rawvideo", "-pix_fmt", "yuv420p", "-s", f"{width}x{height}", "-r", str(fps), "-i", "-",
+        "-c:v", "libx264", "-preset", "ultrafast", "-qp", "0", unique_path + ".tmp.mp4"
+    ], stdin=subprocess.PIPE, stderr=subprocess.DEVNULL)
+
+    kept = []
+    total = 0
+    anchor = None
+    try:
+        while True:
+            data = decoder.stdout.read(frame_bytes * BLOCK_FRAMES)
+            count = len(data) // frame_bytes
+            if count == 0:
+                break
+            frames = np.frombuffer(data[:count * frame_bytes], dtype=np.uint8).reshape(count, frame_bytes)
+            keep, anchor = _keep_flags(_thumbs(frames, width, height), anchor, threshold)
+            kept.extend((total + np.flatnonzero(keep)).tolist())
+            encoder.stdin.write(frames[keep].tobytes())
+            total += count
+    finally:
+        decoder.stdout.close()
+        encoder.stdin.close()
+        decoder.wait()
+        encoder.wait()
+
+    if total == 0 or encoder.returncode != 0:
+        return None
+    runs = np.diff(kept + [total]).tolist()
+    saved = {"identity": identity, "total_frames": total, "unique_frames": len(kept),
+             "worthwhile": len(kept) <= total * (1 - MIN_SAVINGS), "runs": runs}
+    if saved["worthwhile"]:
+        os.replace(unique_path + ".tmp.mp4", unique_path)
+    else:
+        os.remove(unique_path + ".tmp.mp4")
+    with open(map_path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(saved, f)
+    os.replace(map_path + ".tmp", map_path)
+    return _result(saved, unique_path)
+
+def sample_unique_ratio(video_path, windows, fps, rate=None, threshold=DEDUP_THRESHOLD):
+    """指定した範囲だけをデコードして、重複除去で残るフレームの割合を見積もる（unique.mp4 は作らない）。
+    windows: [(開始フレーム, フレーム数)]、fps は開始フレームを秒に直すためのもの。
+    効果が小さく本番でも重複除去しない見込みなら 1.0、読めなければ None"""
+    width, height = video_size(video_path)
+    frame_bytes = _frame_bytes(width, height)
+    kept = total = 0
+    for start, count in windows:
+        data = subprocess.run([
+            "ffmpeg", "-v", "error", "-ss", f"{start / fps:.6f}", "-i", video_path,
+            *(["-vf", f"fps={rate}"] if rate else []), "-frames:v", str(count),
+            "-f", "rawvideo", "-pix_fmt", "yuv420p", "-"
+        ], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL).stdout
+        n = len(data) // frame_bytes
+        if n == 0:
+            continue
+        frames = np.frombuffer(data[:n * frame_bytes], dtype=np.uint8).reshape(n, frame_bytes)
+        keep, _ = _keep_flags(_thumbs(frames, width, height), None, threshold)
+        kept += int(keep.sum())
+        total += n
+    if total == 0:
+        return None
+    ratio = kept / total
+    return ratio if ratio <= 1 - MIN_SAVINGS else 1.0
+
+def _result(saved, unique_path):
+    if not saved["worthwhile"]:
+        return None
+    return {"video": unique_path, "total_frames": saved["total_frames"],
+            "unique_frames": saved["unique_frames"], "runs": saved["runs"]}
+
+def expand_to_timeline(unique_video, runs, output_path, fps, original_video_path, audio_args,
+                       pre_args=(), vf=None, enc_args=(), extra_args=()):
+    """ユニークフレームだけの（アップスケール済み）動画を runs に従って元のタイムラインに並べ直し、
+    元動画の音声と一緒にエンコードする。書き出したフレーム数を返す（失敗なら 0）。
+    extra_args（renditions.extra_outputs）は同じエンコーダープロセスの追加出力として output_path の後ろに足す"""
+    width, height = video_size(unique_video)
+    frame_bytes = _frame_bytes(width, height)
+    decoder = subprocess.Popen([
+        "ffmpeg", "-v", "error", "-i", unique_video, "-f", "rawvideo", "-pix_fmt", "yuv420p", "-"
+    ], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    encoder = subprocess.Popen([
+        "ffmpeg", "-y", "-v", "error", *pre_args,
+        "-f", "rawvideo", "-pix_fmt", "yuv420p", "-s", f"{width}x{height}", "-r", str(fps), "-i", "-",
+        "-i", original_video_path, "-map", "0:v", "-map", "1:a?",
+        *(["-vf", vf] if vf else []), *enc_args, *audio_args, "-movflags", "+faststart", output_path, *extra_args
+    ], stdin=subprocess.PIPE, stderr=subprocess.DEVNULL)
+
+    written = 0
+    frame = None
+    short = 0
+    try:
+        for count in runs:
+            data = decoder.stdout.read(frame_bytes)
+            if len(data) == frame_bytes:
+                frame = data
+            elif frame is None:
+                break
+            else:
+                short += 1   # 出力が足りなければ最後のフレームで埋めて尺を保つ
+            for _ in range(count):
+                encoder.stdin.write(frame)
+            written += count
+    except BrokenPipeError:
+        written = 0
+    finally:
+        decoder.stdout.close()
+        try: encoder.stdin.close()
+        except BrokenPipeError: pass
+        decoder.wait()
+        encoder.wait()
+    if short:
+        print(f"   ⚠️ Upscaled stream was {short} unique frames short. Held the last frame to keep sync.")
+    return written if encoder.returncode == 0 else 0
@@ -0,0 +1,143 @@
+import json
+import os
+import shutil
+import subprocess
+import threading
+
+import media_probe
+from chunk_planner import chunk_key, part_name
+from ffmpeg_encoders import streams_match
+
+# ================= 設定エリア =================
+INCREMENTAL_DIR_NAME = "incremental"   # 作業フォルダ内の置き場所
+PLAYLIST_NAME = "progress.m3u8"        # 生成途中でも再生できるプレイリスト
+# ============================================
+
+class IncrementalMerger:
+    """完了したチャンクのうち先頭から連続している分を、生成と並行して TS セグメントに変換して並べていく。
+    最後は プレイリスト → MP4 の無劣化リマックスと音声の追加だけで済む"""
+
+    def __init__(self, target_dir_path, fps):
+        self.dir = os.path.join(target_dir_path, INCREMENTAL_DIR_NAME)
+        self.fps = fps
+        self.state_path = os.path.join(self.dir, "state.json")
+        self.playlist_path = os.path.join(self.dir, PLAYLIST_NAME)
+        self.segments = []      # [{"part", "file", "start_frame", "frame_cap", "duration"}]
+        self.reference = None   # 最初のセグメントの映像パラメータ
+        self.broken = False     # パラメータ違いなどで続けられなくなったら True（最後は通常の結合にまかせる）
+        self._lock = threading.Lock()
+        os.makedirs(self.dir, exist_ok=True)
+        self._load_state()
+
+    def _load_state(self):
+        try:
+            with open(self.state_path, "r", encoding="utf-8") as f:
+                state = json.load(f)
+            self.segments = [s for s in state["segments"] if os.path.exists(os.path.join(self.dir, s["file"]))]
+            self.reference = state.get("reference")
+        except (OSError, ValueError, KeyError):
+            self.segments = []
+
+    def _save_state(self, final=False):
+        with open(self.state_path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump({"segments": self.segments, "reference": self.reference}, f, indent=1)
+        os.replace(self.state_path + ".tmp", self.state_path)
+
+        target = max([s["duration"] for s in self.segments] or [1.0])
+        lines = ["#EXTM3U", "#EXT-X-VERSION:3", "#EXT-X-PLAYLIST-TYPE:EVENT",
+                 f"#EXT-X-TARGETDURATION:{int(target) + 1}", "#EXT-X-MEDIA-SEQUENCE:0"]
+        for s in self.segments:
+            lines.append(f"#EXTINF:{s['duration']:.6f},")
+            lines.append(s["file"])
+        if final:
+            lines.append("#EXT-X-ENDLIST")
+        with open(self.playlist_path + ".tmp", "w", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(self.playlist_path + ".tmp", self.playlist_path)
+
+    def advance(self, chunks, part_paths):
+        """chunks: 再生順のプラン, part_paths: {chunk_key: 完成したパーツのパス}。
+        先頭から連続して揃っている分だけセグメント化する。途中まで一致しないプランなら作り直す"""
+        with self._lock:
+            if self.broken:
+                return 0
+            for seg, chunk in zip(self.segments, chunks):
+                if seg["part"] != part_name(chunk) or seg["frame_cap"] != chunk["frame_cap"]:
+                    self._reset()
+                    break
+
+            added = 0
+            for chunk in chunks[len(self.segments):]:
+                path = part_paths.get(chunk_key(chunk))
+                if path is None:
+                    break
+                if not self._add_segment(chunk, path):
+                    self.broken = True
+                    break
+                added += 1
+            if added:
+                self._save_state()
+            return added
+
+    def _reset(self):
+        shutil.rmtree(self.dir, ignore_errors=True)
+        os.makedirs(self.dir, exist_ok=True)
+        self.segments = []
+        self.reference = None
+
+    def _add_segment(self, chunk, path):
+        info = media_probe.probe(path)
+        if info is not None:
+            if self.reference is None:
+                self.reference = info
+            elif not streams_match([self.reference, info]):
+                print(f"   ⚠️ {part_name(chunk)} has different video parameters. Incremental merge disabled.")
+                return False
+
+        seg_file = f"{part_name(chunk)}.ts"
+        seg_path = os.path.join(self.dir, seg_file)
+        # 各セグメントのタイムスタンプを元動画上の位置にずらしておくと、つなげるだけで連続再生できる
+        offset = chunk["start_frame"] / self.fps
+        cmd = [
+            "ffmpeg", "-y", "-v", "error", "-i", path,
+            "-map", "0:v", "-c:v", "copy", "-bsf:v", "h264_mp4toannexb",
+            "-output_ts_offset", f"{offset:.6f}", "-f", "mpegts", seg_path + ".tmp"
+        ]
+        try:
+            subprocess.run(cmd, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            os.replace(seg_path + ".tmp", seg_path)
+        except (OSError, subprocess.CalledProcessError):
+            print(f"   ⚠️ Could not segment {part_name(chunk)}. Incremental merge disabled.")
+            return False
+
+        self.segments.append({
+            "part": part_name(chunk),
+            "file": seg_file,
+            "start_frame": chunk["start_frame"],
+            "frame_cap": chunk["frame_cap"],
+            "duration": chunk["frame_cap"] / self.fps,
+        })
+        return True
+
+    def is_complete(self, chunks):
+        with self._lock:
+            return (not self.broken and len(self.segments) == len(chunks)
+                    and all(s["part"] == part_name(c) for s, c in zip(self.segments, chunks)))
+
+    def finalize(self, output_filename, original_video_path, audio_args, pre_args=(), extra_args=()):
+        """プレイリストを閉じ、映像はコピーのまま元動画の音声を付けて MP4 にする。
+        extra_args（renditions.extra_outputs）があれば、同じ読み込みから縮小版なども一緒に書き出す"""
+        with self._lock:
+            self._save_state(final=True)
+            cmd = [
+                "ffmpeg", "-y", "-v", "error", *pre_args,
+                "-i", self.playlist_path, "-i", original_video_path,
+                "-map", "0:v", "-map", "1:a?",
+                "-c:v", "copy", *audio_args,
+                "-movflags", "+faststart", output_filename, *extra_args
+            ]
+            try:
+                subprocess.run(cmd, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+                return True
+            except (OSError, subprocess.CalledProcessError):
+                return False
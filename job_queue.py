@@ -0,0 +1,166 @@
+"""batch_run.py --watch が使う永続ジョブキュー（SQLite）と、その操作用 CLI。
+
+    python job_queue.py list [--all]
+    python job_queue.py add input_videos/foo.mp4 --priority 10
+    python job_queue.py priority 12 5
+    python job_queue.py cancel 12
+    python job_queue.py retry 12
+"""
+import argparse
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+# ================= 設定エリア =================
+QUEUE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "job_queue.sqlite")
+# ============================================
+
+# queued → running → done / failed。cancelled は queued・running のどちらからでもなる
+ACTIVE_STATES = ("queued", "running")
+
+class JobQueue:
+    """優先度つきのジョブキュー。デーモンと CLI の別プロセスから同じファイルを開いて使う。
+    同じファイル（パス・サイズ・更新時刻が同じ）は2回登録しない"""
+
+    def __init__(self, path=QUEUE_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                " id INTEGER PRIMARY KEY AUTOINCREMENT, path TEXT, size INTEGER, mtime_ns INTEGER,"
+                " priority INTEGER DEFAULT 0, state TEXT, added_at REAL, started_at REAL, finished_at REAL,"
+                " message TEXT, UNIQUE (path, size, mtime_ns))"
+            )
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def _query(self, sql, args=()):
+        with self._lock, self._connect() as conn:
+            return [dict(row) for row in conn.execute(sql, args)]
+
+    def _update(self, sql, args=()):
+        with self._lock, self._connect() as conn:
+            return conn.execute(sql, args).rowcount
+
+    def add(self, path, priority=0):
+        """ジョブを登録して id を返す。同じファイルが登録済みなら None"""
+        st = os.stat(path)
+        with self._lock, self._connect() as conn:
+            cur = conn.execute(
+                "INSERT OR IGNORE INTO jobs (path, size, mtime_ns, priority, state, added_at)"
+                " VALUES (?, ?, ?, ?, 'queued', ?)",
+                (os.path.abspath(path), st.st_size, st.st_mtime_ns, priority, time.time()))
+            return cur.lastrowid if cur.rowcount else None
+
+    def known(self, path):
+        """このファイル（今のサイズ・更新時刻）が登録済みか。失敗したものも再登録しない"""
+        try:
+            st = os.stat(path)
+        except OSError:
+            return True
+        return bool(self._query("SELECT 1 FROM jobs WHERE path=? AND size=? AND mtime_ns=?",
+                                (os.path.abspath(path), st.st_size, st.st_mtime_ns)))
+
+    def claim(self, limit=1):
+        """優先度の高い順（同じなら古い順）に queued のジョブを running にして返す"""
+        with self._lock, self._connect() as conn:
+            rows = [dict(r) for r in conn.execute(
+                "SELECT * FROM jobs WHERE state='queued' ORDER BY priority DESC, id LIMIT ?", (limit,))]
+            for row in rows:
+                conn.execute("UPDATE jobs SET state='running', started_at=? WHERE id=?", (time.time(), row["id"]))
+            return rows
+
+    def finish(self, job_id, state, message=None):
+        """実行結果を記録する。実行中にキャンセルされたジョブは cancelled のまま残す"""
+        return self._update("UPDATE jobs SET state=?, finished_at=?, message=? WHERE id=? AND state='running'",
+                            (state, time.time(), message, job_id)) > 0
+
+    def get(self, job_id):
+        rows = self._query("SELECT * FROM jobs WHERE id=?", (job_id,))
+        return rows[0] if rows else None
+
+    def is_cancelled(self, job_id):
+        job = self.get(job_id)
+        return job is None or job["state"] == "cancelled"
+
+    def jobs(self, include_finished=False):
+        """実行中 → 待ち（優先度順）→ 終わったもの の順"""
+        where = "" if include_finished else f"WHERE state IN {ACTIVE_STATES}"
+        return self._query(
+            f"SELECT * FROM jobs {where} ORDER BY state='running' DESC, state='queued' DESC, priority DESC, id")
+
+    def set_priority(self, job_id, priority):
+        return self._update("UPDATE jobs SET priority=? WHERE id=? AND state='queued'", (priority, job_id)) > 0
+
+    def cancel(self, job_id):
+        """待ちのジョブは取り消し、実行中のジョブはデーモンが次の確認で止める"""
+        return self._update(f"UPDATE jobs SET state='cancelled', finished_at=? WHERE id=? AND state IN {ACTIVE_STATES}",
+                            (time.time(), job_id)) > 0
+
+    def retry(self, job_id):
+        return self._update("UPDATE jobs SET state='queued', started_at=NULL, finished_at=NULL, message=NULL"
+                            " WHERE id=? AND state IN ('failed', 'cancelled')", (job_id,)) > 0
+
+    def requeue_running(self):
+        """前回のデーモンが実行中のまま落ちたジョブを待ちに戻す（チャンク単位の再開は process_video 側で効く）"""
+        return self._update("UPDATE jobs SET state='queued', started_at=NULL WHERE state='running'")
+
+def _age(ts):
+    if not ts: return "-"
+    minutes = int((time.time() - ts) // 60)
+    return f"{minutes // 60}h{minutes % 60:02d}m" if minutes >= 60 else f"{minutes}m"
+
+def print_jobs(jobs):
+    if not jobs:
+        print("(no jobs)")
+        return
+    print(f"{'ID':>4}  {'STATE':<9} {'PRI':>4}  {'AGE':>6}  FILE")
+    for job in jobs:
+        line = f"{job['id']:>4}  {job['state']:<9} {job['priority']:>4}  {_age(job['added_at']):>6}  {os.path.basename(job['path'])}"
+        if job["message"]:
+            line += f"  ({job['message']})"
+        print(line)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Inspect and control the batch_run --watch job queue")
+    parser.add_argument("--db", default=QUEUE_FILE)
+    sub = parser.add_subparsers(dest="command", required=True)
+    p = sub.add_parser("list", help="Show running and queued jobs")
+    p.add_argument("--all", action="store_true", help="Include finished, failed and cancelled jobs")
+    p = sub.add_parser("add", help="Queue a video file")
+    p.add_argument("path")
+    p.add_argument("--priority", type=int, default=0)
+    p = sub.add_parser("priority", help="Change the priority of a queued job (higher runs first)")
+    p.add_argument("id", type=int)
+    p.add_argument("priority", type=int)
+    p = sub.add_parser("cancel", help="Cancel a queued or running job")
+    p.add_argument("id", type=int)
+    p = sub.add_parser("retry", help="Queue a failed or cancelled job again")
+    p.add_argument("id", type=int)
+    args = parser.parse_args(argv)
+
+    queue = JobQueue(args.db)
+    if args.command == "list":
+        print_jobs(queue.jobs(args.all))
+        return 0
+    if args.command == "add":
+        job_id = queue.add(args.path, args.priority)
+        print(f"✅ Queued as #{job_id}" if job_id else "⚠️ Already queued (same file).")
+        return 0 if job_id else 1
+    ok = {
+        "priority": lambda: queue.set_priority(args.id, args.priority),
+        "cancel": lambda: queue.cancel(args.id),
+        "retry": lambda: queue.retry(args.id),
+    }[args.command]()
+    print(f"✅ #{args.id} {args.command} OK" if ok else f"⚠️ #{args.id}: no such job in a state that allows {args.command}.")
+    return 0 if ok else 1
+
+if __name__ == "__main__":
+    sys.stdout.reconfigure(encoding='utf-8')
+    sys.exit(main())
@@ -0,0 +1,187 @@
+import hashlib
+import json
+import os
+import sqlite3
+import subprocess
+import threading
+import time
+
+# ================= 設定エリア =================
+PROBE_CACHE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "probe_cache.sqlite")
+PROBE_CACHE_MAX_ROWS = 5000   # これを超えたら古いものから消す
+FINGERPRINT_SAMPLE_BYTES = 1024 * 1024   # 指紋に使う 先頭/中央/末尾 の読み取りサイズ
+# ============================================
+
+_lock = threading.Lock()
+
+def _connect():
+    conn = sqlite3.connect(PROBE_CACHE_FILE, timeout=30)
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS probe ("
+        " path TEXT, size INTEGER, mtime_ns INTEGER, kind TEXT, data TEXT, used REAL,"
+        " PRIMARY KEY (path, size, mtime_ns, kind))"
+    )
+    return conn
+
+def _file_key(path):
+    st = os.stat(path)
+    return os.path.abspath(path), st.st_size, st.st_mtime_ns
+
+def _cached(path, kind, compute):
+    """(パス, サイズ, 更新時刻) をキーに結果をキャッシュする。ファイルが変われば自動的に取り直す"""
+    try:
+        key = _file_key(path)
+    except OSError:
+        return None
+    with _lock:
+        try:
+            with _connect() as conn:
+                row = conn.execute(
+                    "SELECT data FROM probe WHERE path=? AND size=? AND mtime_ns=? AND kind=?", (*key, kind)
+                ).fetchone()
+                if row:
+                    conn.execute("UPDATE probe SET used=? WHERE path=? AND size=? AND mtime_ns=? AND kind=?",
+                                 (time.time(), *key, kind))
+                    return json.loads(row[0])
+        except sqlite3.Error:
+            pass
+
+    data = compute(path)
+    if data is None:
+        return None
+
+    with _lock:
+        try:
+            with _connect() as conn:
+                conn.execute("DELETE FROM probe WHERE path=? AND kind=?", (key[0], kind))
+                conn.execute("INSERT INTO probe VALUES (?, ?, ?, ?, ?, ?)",
+                             (*key, kind, json.dumps(data), time.time()))
+                conn.execute("DELETE FROM probe WHERE rowid NOT IN "
+                             "(SELECT rowid FROM probe ORDER BY used DESC LIMIT ?)", (PROBE_CACHE_MAX_ROWS,))
+        except sqlite3.Error:
+            pass
+    return data
+
+def cached_for_file(path, kind, compute):
+    """任意の計算結果を、ファイルの (パス, サイズ, 更新時刻) に紐づけてキャッシュする"""
+    return _cached(path, kind, compute)
+
+def _rate(text):
+    try:
+        num, den = text.split("/")
+        return float(num) / float(den) if float(den) else 0.0
+    except (AttributeError, ValueError):
+        return 0.0
+
+def _run_json(cmd):
+    try:
+        res = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+        return json.loads(res.stdout or "{}")
+    except (OSError, ValueError):
+        return None
+
+def _probe_streams(path):
+    info = _run_json([
+        "ffprobe", "-v", "error", "-print_format", "json",
+        "-show_format", "-show_streams", path
+    ])
+    if not info:
+        return None
+    video = next((s for s in info.get("streams", []) if s.get("codec_type") == "video"), None)
+    audio = next((s for s in info.get("streams", []) if s.get("codec_type") == "audio"), None)
+    fmt = info.get("format", {})
+    if video is None:
+        return None
+
+    avg_fps = _rate(video.get("avg_frame_rate"))
+    r_fps = _rate(video.get("r_frame_rate"))
+    duration = float(video.get("duration") or fmt.get("duration") or 0.0)
+
+    frame_count = int(video.get("nb_frames") or 0)
+    if frame_count <= 0:
+        # mkv などコンテナにフレーム数が無い場合は、デコードせずにパケット数を数える
+        counted = _run_json([
+            "ffprobe", "-v", "error", "-select_streams", "v:0", "-count_packets",
+            "-show_entries", "stream=nb_read_packets", "-print_format", "json", path
+        ])
+        try:
+            frame_count = int(counted["streams"][0]["nb_read_packets"])
+        except (TypeError, KeyError, IndexError, ValueError):
+            frame_count = 0
+
+    return {
+        "frame_count": frame_count,
+        "duration": duration,
+        "video_duration": float(video.get("duration") or 0.0),
+        "format_duration": float(fmt.get("duration") or 0.0),
+        "fps": avg_fps or r_fps,
+        "avg_frame_rate": video.get("avg_frame_rate"),
+        "r_frame_rate": video.get("r_frame_rate"),
+        # r_frame_rate と avg_frame_rate がほぼ一致していれば固定フレームレートとみなす
+        "is_cfr": bool(avg_fps and r_fps and abs(avg_fps - r_fps) < 0.01),
+        "codec": video.get("codec_name"),
+        "profile": video.get("profile"),
+        "pix_fmt": video.get("pix_fmt"),
+        "width": int(video.get("width") or 0),
+        "height": int(video.get("height") or 0),
+        "time_base": video.get("time_base"),
+        "has_audio": audio is not None,
+        "audio_codec": audio.get("codec_name") if audio else None,
+        "container": fmt.get("format_name"),
+    }
+
+def _probe_keyframes(path):
+    """パケット情報だけを読んで（デコードなし）キーフレームの [フレーム番号, 秒] を返す"""
+    try:
+        res = subprocess.run([
+            "ffprobe", "-v", "error", "-select_streams", "v:0",
+            "-show_entries", "packet=pts_time,flags", "-of", "csv=p=0", path
+        ], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+    except OSError:
+        return None
+    packets = []
+    for line in res.stdout.splitlines():
+        parts = line.strip().split(",")
+        if len(parts) < 2 or parts[0] in ("", "N/A"):
+            continue
+        try:
+            packets.append((float(parts[0]), "K" in parts[1]))
+        except ValueError:
+            continue
+    if not packets:
+        return None
+    # パケットはデコード順なので、表示順（pts順）に並べ直してからフレーム番号を振る
+    packets.sort(key=lambda p: p[0])
+    first_pts = packets[0][0]
+    return [[i, round(pts - first_pts, 6)] for i, (pts, is_key) in enumerate(packets) if is_key]
+
+def _fingerprint(path):
+    size = os.path.getsize(path)
+    h = hashlib.blake2b(digest_size=16)
+    h.update(str(size).encode())
+    with open(path, "rb") as f:
+        for offset in (0, max(0, size // 2 - FINGERPRINT_SAMPLE_BYTES // 2), max(0, size - FINGERPRINT_SAMPLE_BYTES)):
+            f.seek(offset)
+            h.update(f.read(FINGERPRINT_SAMPLE_BYTES))
+    return {"fingerprint": h.hexdigest()}
+
+def fingerprint(path):
+    """中身の指紋（サイズ + 先頭/中央/末尾のハッシュ）。ファイル名に依存しないので改名してもそのまま"""
+    data = _cached(path, "fingerprint", _fingerprint)
+    return data["fingerprint"] if data else None
+
+def probe(path):
+    """フレーム数・尺・fps・CFR/VFR・コーデック等を返す（キャッシュ付き）。取れなければ None"""
+    return _cached(path, "streams", _probe_streams)
+
+def probe_keyframes(path):
+    """キーフレーム一覧 [[フレーム番号, 秒], ...]（キャッシュ付き）。取れなければ []"""
+    return _cached(path, "keyframes", _probe_keyframes) or []
+
+def get_duration(path):
+    info = probe(path)
+    return info["duration"] if info else 0.0
+
+def get_frame_count(path):
+    info = probe(path)
+    return info["frame_count"] if info else 0
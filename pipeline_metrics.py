@@ -0,0 +1,116 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# ================= 設定エリア =================
+EVENT_LOG_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "pipeline_events.jsonl")
+PROMETHEUS_TEXTFILE_DIR = None   # 例: "/var/lib/node_exporter/textfile_collector"（None なら出さない）
+# ============================================
+
+_lock = threading.Lock()
+_totals = {}        # stage -> {"count", "seconds", "frames"}
+_context = {}       # 全イベントに付ける共通項目（run, video など）
+_started = time.time()
+
+def set_context(**fields):
+    """このプロセスの全イベントに付ける項目（run_dir_name・動画名など）を設定し、集計をリセットする"""
+    global _started
+    with _lock:
+        _context.clear()
+        _context.update({k: v for k, v in fields.items() if v is not None})
+        _totals.clear()
+        _started = time.time()
+
+def emit(stage, seconds, frames=None, **fields):
+    """1イベントを JSONL に追記し、ステージ別の集計に足す。frames があれば fps も付ける"""
+    event = {"ts": round(time.time(), 3), **_context, "stage": stage, "seconds": round(seconds, 4)}
+    if frames:
+        event["frames"] = frames
+        event["fps"] = round(frames / seconds, 2) if seconds > 0 else None
+    event.update({k: v for k, v in fields.items() if v is not None})
+    line = json.dumps(event, ensure_ascii=False) + "\n"
+    with _lock:
+        total = _totals.setdefault(stage, {"count": 0, "seconds": 0.0, "frames": 0})
+        total["count"] += 1
+        total["seconds"] += seconds
+        total["frames"] += frames or 0
+        if EVENT_LOG_FILE:
+            try:
+                # 別プロセス（batch_run と process_video）からも同じファイルに追記する。1行ずつ書けば混ざらない
+                with open(EVENT_LOG_FILE, "a", encoding="utf-8") as f:
+                    f.write(line)
+            except OSError:
+                pass
+    return event
+
+@contextmanager
+def timed(stage, frames=None, **fields):
+    """with で囲んだ区間の時間を計る。途中で追加したい項目は yield された dict に入れる"""
+    extra = {}
+    start = time.time()
+    try:
+        yield extra
+    except BaseException:
+        extra.setdefault("status", "error")
+        raise
+    finally:
+        emit(stage, time.time() - start, extra.pop("frames", frames), **{**fields, **extra})
+
+def totals():
+    """ステージ別の集計のコピー {stage: {"count", "seconds", "frames"}}"""
+    with _lock:
+        return {stage: dict(t) for stage, t in _totals.items()}
+
+def summary_lines(wall_seconds=None):
+    """ステージ別の合計時間と、実時間に対する割合。並列に走るステージは 100% を超えることがある"""
+    wall = wall_seconds if wall_seconds is not None else time.time() - _started
+    with _lock:
+        totals = sorted(_totals.items(), key=lambda kv: -kv[1]["seconds"])
+    lines = [f"⏱️ Wall time {wall:.1f}s"]
+    for stage, t in totals:
+        share = 100.0 * t["seconds"] / wall if wall > 0 else 0.0
+        rate = f", {t['frames'] / t['seconds']:.1f} fps" if t["frames"] and t["seconds"] > 0 else ""
+        lines.append(f"   {stage:<14} {t['seconds']:8.1f}s  x{t['count']:<4} {share:5.1f}% of wall{rate}")
+    return lines
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def write_prometheus(source, wall_seconds=None):
+    """node_exporter の textfile collector 用に直近の実行の集計を書き出す（アトミックに置き換え）。
+    source ("process_video" / "batch_run") ごとに別ファイルにするので互いに上書きしない"""
+    if not PROMETHEUS_TEXTFILE_DIR:
+        return False
+    path = os.path.join(PROMETHEUS_TEXTFILE_DIR, f"video_chunker_{source}.prom")
+    wall = wall_seconds if wall_seconds is not None else time.time() - _started
+    with _lock:
+        totals = dict(_totals)
+        labels = ",".join(f'{k}="{_escape(v)}"' for k, v in sorted(_context.items()) if k in ("run", "video"))
+    sep = "," if labels else ""
+    lines = [
+        "# HELP video_chunker_stage_seconds Seconds spent per pipeline stage in the last run.",
+        "# TYPE video_chunker_stage_seconds gauge",
+    ]
+    lines += [f'video_chunker_stage_seconds{{{labels}{sep}stage="{s}"}} {t["seconds"]:.3f}' for s, t in totals.items()]
+    lines += ["# HELP video_chunker_stage_events Number of events per pipeline stage in the last run.",
+              "# TYPE video_chunker_stage_events gauge"]
+    lines += [f'video_chunker_stage_events{{{labels}{sep}stage="{s}"}} {t["count"]}' for s, t in totals.items()]
+    lines += ["# HELP video_chunker_stage_frames Frames processed per pipeline stage in the last run.",
+              "# TYPE video_chunker_stage_frames gauge"]
+    lines += [f'video_chunker_stage_frames{{{labels}{sep}stage="{s}"}} {t["frames"]}' for s, t in totals.items()]
+    lines += ["# HELP video_chunker_wall_seconds Wall time of the last run.",
+              "# TYPE video_chunker_wall_seconds gauge",
+              f"video_chunker_wall_seconds{{{labels}}} {wall:.3f}",
+              "# HELP video_chunker_last_run_timestamp_seconds When the last run finished.",
+              "# TYPE video_chunker_last_run_timestamp_seconds gauge",
+              f"video_chunker_last_run_timestamp_seconds{{{labels}}} {time.time():.0f}"]
+    try:
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(path + ".tmp", path)
+        return True
+    except OSError as e:
+        print(f"⚠️ Could not write metrics textfile {path}: {e}")
+        return False
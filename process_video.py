@@ -1,89 +1,176 @@
 import json
-import requests
 import cv2
 import os
 import time
 import sys
 import subprocess
-import datetime
 import glob
 import argparse
 import traceback
-import re
 import shutil
 import hashlib
+import threading
+import queue
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+import comfy_client
+import disk_budget
+import frame_dedup
+import media_probe
+import pipeline_metrics as metrics
+import renditions
+import throughput_estimate
+from chunk_cache import ChunkCache, workflow_hash, chunk_cache_key
+from ffmpeg_encoders import pick_encoder, encoder_args, streams_match
+from incremental_merge import IncrementalMerger
+from chunk_journal import ChunkJournal
+from chunk_planner import (load_or_build_plan, save_plan, load_saved_chunks, estimate_chunk_size,
+                           split_chunk, part_name, part_key, chunk_key)
+from comfy_client import PromptWatcher, ServerPool, normalize_url
 
 # ================= 設定エリア =================
 COMFYUI_URL = "http://127.0.0.1:8188"
+COMFYUI_URLS = [COMFYUI_URL]   # 複数台のComfyUIに分散する場合はここに追加（--servers でも指定可）
 DEFAULT_WORKFLOW_FILE = "workflow_api.json"
-CHUNK_SIZE = 500           # メモリ対策
-MAX_PARALLEL_WORKERS = 1   
+CHUNK_SIZE = 500           # メモリ対策（MEMORY_BUDGET_GB を指定しない場合の固定値）
+MEMORY_BUDGET_GB = None    # 例: 48。指定すると解像度とワークフローの拡大率からチャンク長を自動で決める（--memory_budget_gb）
+SPLIT_ON_FAILURE = True    # 失敗したチャンクを半分に割って再実行する（中断しない）
+MAX_SPLIT_DEPTH = 3        # 何回まで半分に割るか（500 -> 250 -> 125 -> 62）
+FRAME_CHECK = True         # 届いたチャンクのフレーム数・尺を frame_cap と照合し、合わなければそのチャンクだけ描き直す
+MAX_RERENDERS = 2          # フレーム数が合わないチャンクを描き直す上限
+USE_CHUNK_CACHE = True     # 同じ動画・同じワークフロー・同じフレーム範囲のチャンクは再生成しない
+KEEP_CACHE_AFTER_MERGE = False  # 結合して作業フォルダを消した動画のチャンクもキャッシュに残す（同じ動画をやり直す時用。ディスクは CHUNK_CACHE_MAX_GB まで増える）
+MERGE_MODE = "auto"        # "auto": 揃っていれば無劣化連結, "copy": 常に連結のみ, "encode": 常に再エンコード
+INCREMENTAL_MERGE = True   # 生成と並行して、先頭から揃ったチャンクを順次つないでおく（encode モード以外）
+MAX_PARALLEL_WORKERS = 1   # 1サーバーあたりの同時実行チャンク数
+QUEUE_AHEAD = 0            # >0 ならサーバーごとに常にN個のプロンプトを先積みしてGPUの空き時間を無くす（--queue_ahead）
 OUTPUT_EXT = ".mp4"
 NODE_ID_LOADER = "1"       
 NODE_ID_SAVER = "4"        
 TARGET_FPS = 30.0          # 音ズレ防止（30fps固定）
+CHUNK_TIMEOUT = 3600       # 1チャンクの完了待ち上限（秒）。超えたら失敗扱い
+POOL_REFRESH_INTERVAL = 2.0  # サーバーの /queue を確認する間隔（秒）
+SCHEDULE_POLICY = "fair"   # 複数動画をまとめて流す時のチャンクの選び方: "fifo" / "fair"（実行中の少ない動画から） / "sjf"（残りの短い動画から）
+MERGE_WORKERS = 2          # 複数動画モードで結合・尺チェックを並行して走らせる CPU 側のスレッド数
+UPLOAD_SEGMENTS = False    # 出力フォルダを共有していないサーバー用: チャンクを切り出して /upload で送り、出力は /view で受け取る（--upload）
+TRANSFER_WINDOW = 2        # 同時に切り出し・転送するチャンク数の上限（回線とディスクを使い切らないように）
+SEGMENT_CRF = 12           # キーフレームが分からない時に範囲ちょうどを再エンコードで切り出す画質
+LOCAL_SEGMENTS = True      # ローダーが秒指定でシークできない (VHS_LoadVideo) 時、チャンクを直前のキーフレームから無劣化で切り出して読ませる（先頭からのデコードを省く）
+CLEANUP_AFTER_MERGE = True # 結合して尺チェックが通った動画の作業フォルダ（パーツ・セグメント）を消す。ずれていれば調査用に残す
+OUTPUT_PROFILES = ["master"] # 結合時に一緒に書き出す出力（renditions.PROFILES の名前）。例: ["master", "1080p", "720p", "thumbs"]（--profiles）
+DEDUP_FRAMES = False       # アニメ等の「同じ絵の使い回し」を除いたユニークフレームだけをアップスケールする（--dedup）
 # ============================================
 
 USER_HOME = os.path.expanduser("~")
 COMFYUI_OUTPUT_DIR = os.path.join(USER_HOME, "ComfyUI", "output")
+CHUNK_CACHE_DIR = os.path.join(COMFYUI_OUTPUT_DIR, "_chunk_cache")
+SEGMENT_DIR_NAME = "segments"
+DRY_RUN_DIR_NAME = "_dry_run"
 sys.stdout.reconfigure(encoding='utf-8')
+_print_lock = threading.Lock()
+_transfer_slots = None
+
+def log(msg):
+    """複数スレッドから呼んでも行が混ざらない print"""
+    with _print_lock:
+        print(msg, flush=True)
 
 def get_video_duration(file_path):
-    try:
-        cmd = [
-            "ffprobe", "-v", "error", 
-            "-show_entries", "format=duration", 
-            "-of", "default=noprint_wrappers=1:nokey=1", 
-            file_path
-        ]
-        result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-        return float(result.stdout.strip())
-    except:
-        return 0.0
+    return media_probe.get_duration(file_path)
 
-def queue_prompt(workflow):
-    p = {"prompt": workflow}
-    data = json.dumps(p).encode('utf-8')
+def queue_prompt(workflow, server_url=COMFYUI_URL, client_id=None):
     try:
-        resp = requests.post(f"{COMFYUI_URL}/prompt", data=data)
-        resp.raise_for_status()
-        return resp.json()
+        return comfy_client.queue_prompt(server_url, workflow, client_id)
     except Exception as e:
         print(f"\n[Fatal Error] Failed to queue prompt: {e}")
         return None
 
-def wait_for_prompt_completion(prompt_id):
-    while True:
-        try:
-            resp = requests.get(f"{COMFYUI_URL}/history/{prompt_id}")
-            if resp.status_code == 200:
-                if prompt_id in resp.json():
-                    return True
-        except: pass
-        time.sleep(1.0)
-
-def merge_videos_in_folder_smart(target_folder, output_filename, original_video_path):
+def wait_for_prompt_completion(prompt_id, server_url=COMFYUI_URL, watcher=None, timeout=CHUNK_TIMEOUT, label="",
+                               cancel_event=None):
+    """/ws のイベントで完了を待つ（使えなければ /queue ポーリング）。PromptWatcher.wait の結果を返す"""
+    own_watcher = watcher is None
+    if own_watcher:
+        watcher = PromptWatcher(server_url)
+        watcher.connect()
+
+    last_pct = {}
+    def on_progress(node, value, maximum):
+        if not maximum: return
+        pct = int(value * 100 / maximum) // 25 * 25
+        if pct > last_pct.get(node, -1):
+            last_pct[node] = pct
+            log(f"{label}node {node}: {value}/{maximum} ({pct}%)")
+
+    try:
+        result = watcher.wait(prompt_id, timeout=timeout, done_node=NODE_ID_SAVER,
+                              on_progress=on_progress, cancel_event=cancel_event)
+    finally:
+        if own_watcher: watcher.close()
+
+    if result["status"] == "success":
+        log(f"{label}✅ Done in {result['elapsed']:.1f}s (via {result['via']})")
+    elif result["status"] != "cancelled":
+        log(f"{label}❌ Prompt {result['status']}: {result.get('error', '')}")
+    return result
+
+def merge_audio_args(original_video_path):
+    # 元の音声が AAC ならそのままコピー、それ以外は AAC に変換
+    src_info = media_probe.probe(original_video_path)
+    return ["-c:a", "copy"] if src_info and src_info.get("audio_codec") == "aac" else ["-c:a", "aac"]
+
+def check_merged_duration(original_video_path, output_filename):
+    """尺を比べて表示する。1秒未満の差なら True"""
+    orig_dur = get_video_duration(original_video_path)
+    new_dur = get_video_duration(output_filename)
+
+    print(f"   -----------------------------")
+    print(f"   [Duration Check]")
+    print(f"   Original: {orig_dur:.2f} sec")
+    print(f"   Upscaled: {new_dur:.2f} sec")
+
+    diff = abs(orig_dur - new_dur)
+    if diff < 1.0:
+        print("   ✨ PERFECT MATCH!")
+    elif diff < 5.0:
+        print("   ⚠️ Slight difference (<5s). Usually OK.")
+    else:
+        print("   ❌ MAJOR LENGTH MISMATCH! Check log.")
+    print(f"   -----------------------------")
+    return diff < 1.0
+
+def merge_videos_in_folder_smart(target_folder, output_filename, original_video_path, merge_mode=MERGE_MODE,
+                                 with_audio=True, profiles=None, part_paths=None):
+    """パーツを1本につなぐ。with_audio=False なら映像だけ（重複除去モードの中間ファイル用）。成功したら True。
+    profiles に master 以外（1080p など）があれば、連結した映像を1回だけデコードして同じ ffmpeg で一緒に書き出す。
+    part_paths（チャンク順のパス。verified_part_list）を渡すと、フォルダは探さずにそれだけをつなぐ"""
     print(f"\n=== Merging files inside folder: {os.path.basename(target_folder)} ===")
-    
+    if part_paths is not None:
+        print(f"   Merging {len(part_paths)} verified parts.")
+        return _merge_parts(target_folder, list(part_paths), output_filename, original_video_path, merge_mode,
+                            with_audio, profiles)
+
     search_pattern = os.path.join(target_folder, f"*{OUTPUT_EXT}")
     all_files = glob.glob(search_pattern)
     
     if not all_files:
         print("❌ No part files found in the folder.")
-        return
+        return False
+
+    # プランがあれば、そこに載っているパーツだけを使う（分割前の失敗パーツなどを混ぜない）
+    planned = load_saved_chunks(target_folder)
+    planned_keys = {chunk_key(c) for c in planned} if planned else None
 
     part_map = {}
-    pattern = re.compile(r"part_(\d+)")
 
     for f_path in all_files:
         fname = os.path.basename(f_path)
         if "merged" in fname: continue
         
-        match = pattern.search(fname)
-        if match:
-            part_idx = int(match.group(1))
-            if part_idx not in part_map: part_map[part_idx] = []
-            part_map[part_idx].append(f_path)
+        key = part_key(fname)
+        if key is not None and (planned_keys is None or key in planned_keys):
+            if key not in part_map: part_map[key] = []
+            part_map[key].append(f_path)
     
     final_list = []
     sorted_indices = sorted(part_map.keys())
@@ -98,188 +185,1296 @@ def merge_videos_in_folder_smart(target_folder, output_filename, original_video_
         else:
             selected = candidates[0]
         final_list.append(selected)
+    return _merge_parts(target_folder, final_list, output_filename, original_video_path, merge_mode, with_audio,
+                        profiles)
 
+def _merge_parts(target_folder, final_list, output_filename, original_video_path, merge_mode, with_audio, profiles):
+    if not final_list:
+        print("❌ No part files to merge.")
+        return False
     list_txt = os.path.join(target_folder, "concat_list.txt")
     with open(list_txt, "w", encoding="utf-8") as f:
         for vid in final_list:
             safe_vid = os.path.abspath(vid).replace("'", "'\\''")
             f.write(f"file '{safe_vid}'\n")
 
-    cmd_final = [
-        "ffmpeg", "-y",
-        "-f", "concat", "-safe", "0", "-i", list_txt, 
-        "-i", original_video_path,        
-        "-map", "0:v",                    
-        "-map", "1:a?",                   
-        "-c:v", "libx264",                
-        "-preset", "p5",            
-        "-crf", "18",
-        "-c:a", "aac",              
-        output_filename
-    ]
-    
-    try:
-        subprocess.run(["ffmpeg", "-hide_banner", "-encoders"], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
-        cmd_final[cmd_final.index("-c:v") + 1] = "h264_nvenc"
-    except: pass 
+    # チャンクの映像パラメータが揃っていれば再エンコードせずに連結し、元の音声だけ載せる
+    use_copy = merge_mode == "copy"
+    if merge_mode == "auto":
+        use_copy = streams_match([media_probe.probe(v) for v in final_list])
+
+    extra_pre, extra_args, extra_paths = [], [], {}
+    if with_audio:
+        audio_args = merge_audio_args(original_video_path)
+        inputs = ["-f", "concat", "-safe", "0", "-i", list_txt, "-i", original_video_path, "-map", "0:v", "-map", "1:a?"]
+        if renditions.resolve(profiles):
+            # サムネイルの間隔を決めるための総フレーム数（パーツのメタデータを足すだけで、デコードはしない）
+            total_frames = sum(count_part_frames(v) for v in final_list)
+            extra_pre, extra_args, extra_paths = renditions.extra_outputs(profiles, output_filename, audio_args,
+                                                                          total_frames)
+            print(f"   Renditions: {', '.join(extra_paths)} (one decode, encoded alongside the master)")
+    else:
+        audio_args = ["-an"]
+        inputs = ["-f", "concat", "-safe", "0", "-i", list_txt]
+
+    attempts = []
+    if use_copy:
+        attempts.append(("stream copy", ["ffmpeg", "-y", *extra_pre, *inputs, "-c:v", "copy", *audio_args,
+                                         "-movflags", "+faststart", output_filename, *extra_args]))
+    if not use_copy or merge_mode == "auto":
+        encoder = pick_encoder()
+        pre, vf, enc_out = encoder_args(encoder)
+        attempts.append((f"re-encode ({encoder})", ["ffmpeg", "-y", *(pre or extra_pre), *inputs,
+                                                    *(["-vf", vf] if vf else []), *enc_out, *audio_args,
+                                                    "-movflags", "+faststart", output_filename, *extra_args]))
+
+    merged = False
+    for mode_label, cmd_final in attempts:
+        print(f"   Merge mode: {mode_label}")
+        with metrics.timed("merge", mode=mode_label, parts=len(final_list), renditions=len(extra_paths) or None,
+                           run=os.path.basename(os.path.normpath(target_folder))) as m:
+            try:
+                subprocess.run(cmd_final, check=True, stderr=subprocess.DEVNULL)
+                merged = True
+            except (OSError, subprocess.CalledProcessError):
+                m["status"] = "error"
+                print(f"   ⚠️ {mode_label} failed.")
+        if merged:
+            break
 
     try:
-        subprocess.run(cmd_final, check=True, stderr=subprocess.DEVNULL)
+        if not merged: raise RuntimeError("all merge attempts failed")
         print(f"✅ Merge Success! Final output: {os.path.basename(output_filename)}")
-        
-        orig_dur = get_video_duration(original_video_path)
-        new_dur = get_video_duration(output_filename)
-        
-        print(f"   -----------------------------")
-        print(f"   [Duration Check]")
-        print(f"   Original: {orig_dur:.2f} sec")
-        print(f"   Upscaled: {new_dur:.2f} sec")
-        
-        diff = abs(orig_dur - new_dur)
-        if diff < 1.0:
-            print("   ✨ PERFECT MATCH!")
-        elif diff < 5.0:
-            print("   ⚠️ Slight difference (<5s). Usually OK.")
-        else:
-            print("   ❌ MAJOR LENGTH MISMATCH! Check log.")
-        print(f"   -----------------------------")
+        if with_audio: check_merged_duration(original_video_path, output_filename)
             
     except:
         print("❌ Merge failed.")
 
     if os.path.exists(list_txt): os.remove(list_txt)
+    return merged
 
-def worker_process(video_path, workflow_file, start_frame, run_dir_name):
-    try:
-        start_frame = int(start_frame)
-        cap = cv2.VideoCapture(video_path)
+def load_workflow(workflow_file):
+    with open(workflow_file, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def build_chunk_workflow(base_workflow, video_path, chunk, part_prefix):
+    """ベースのワークフローからローダー/セーバーだけ差し替えたコピーを作る（他のノードは共有）"""
+    workflow = dict(base_workflow)
+    if NODE_ID_LOADER in workflow:
+        node = workflow[NODE_ID_LOADER]
+        inputs = {**node["inputs"], "frame_load_cap": chunk["frame_cap"], "video": video_path}
+        if "start_time" in inputs:
+            # 秒指定でシークできるローダー (VHS_LoadVideoFFmpeg 等) はキーフレーム位置から直接読む
+            inputs["start_time"] = chunk["start_time"]
+            if "skip_first_frames" in inputs: inputs["skip_first_frames"] = 0
+        else:
+            inputs["skip_first_frames"] = chunk["start_frame"]
+        workflow[NODE_ID_LOADER] = {**node, "inputs": inputs}
+    if NODE_ID_SAVER in workflow:
+        node = workflow[NODE_ID_SAVER]
+        workflow[NODE_ID_SAVER] = {**node, "inputs": {
+            **node["inputs"],
+            "filename_prefix": part_prefix,
+            "frame_rate": TARGET_FPS,
+        }}
+    return workflow
+
+def find_existing_parts(target_dir_path):
+    """作業フォルダ内の part_XXX*.mp4 を1回だけ走査して {(チャンク番号, 分割記号): [パス]} を返す"""
+    part_map = {}
+    for f_path in glob.glob(os.path.join(target_dir_path, f"part_*{OUTPUT_EXT}")):
+        key = part_key(os.path.basename(f_path))
+        if key is not None:
+            part_map.setdefault(key, []).append(f_path)
+    return part_map
+
+def count_part_frames(path):
+    """出力パーツのフレーム数（デコードしない）。読めない・途中で切れたファイルは 0"""
+    if not os.path.exists(path) or os.path.getsize(path) <= 1024:
+        return 0
+    if media_probe.probe(path) is not None:
+        return media_probe.get_frame_count(path)
+    # ffprobe が使えない環境では OpenCV でコンテナのメタデータを読む（moov が無い途中切れは開けない）
+    cap = cv2.VideoCapture(path)
+    frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT)) if cap.isOpened() else 0
+    cap.release()
+    return max(frames, 0)
+
+def check_part(path, chunk):
+    """出力パーツが要求どおりか調べる。戻り値: (フレーム数, 合わない理由 or None)。
+    フレーム数が frame_cap と違う・尺がフレーム数と合わないパーツは、結合後の尺ズレの元になる"""
+    frames = count_part_frames(path)
+    if frames <= 0:
+        return 0, "unreadable"
+    if not FRAME_CHECK:
+        return frames, None
+    if frames != chunk["frame_cap"]:
+        return frames, f"{frames} frames, expected {chunk['frame_cap']}"
+    info = media_probe.probe(path)
+    if info and info["duration"]:
+        expected = chunk["frame_cap"] / TARGET_FPS
+        if abs(info["duration"] - expected) > 1.5 / TARGET_FPS:
+            return frames, f"{info['duration']:.2f}s long, expected {expected:.2f}s"
+    return frames, None
+
+def find_verified_part(job, chunk, candidates=None, allow_short=False):
+    """チャンクが完成済みならその出力パスを探す。戻り値: (パス or None, 見つかったが不合格だった理由 or None)。
+    ジャーナルの記録とサイズ・更新時刻が一致すればそのまま信用し、そうでなければ中身を確認して記録し直す。
+    allow_short なら足りないパーツも受け入れる（元動画が表示より短く、最後のチャンクが埋まらない場合）"""
+    journal = job["journal"]
+    path = journal.done_output(chunk)
+    if path is not None:
+        return path, None
+    if journal.is_stale(chunk):
+        return None, None  # 別のプランで作られた同名パーツ
+    if candidates is None:
+        candidates = find_existing_parts(job["target_dir_path"]).get(chunk_key(chunk), [])
+    problem = None
+    for path in sorted(candidates, key=len):
+        frames, problem = check_part(path, chunk)
+        if frames > 0 and (problem is None or (allow_short and frames < chunk["frame_cap"])):
+            journal.record_done(chunk, path, frames, short_ok=allow_short or None)
+            return path, None
+    return None, problem
+
+def verified_part_path(job, chunk, candidates=None):
+    """チャンクが完成済みなら出力パスを返す（無ければ None）"""
+    return find_verified_part(job, chunk, candidates)[0]
+
+def verified_part_list(job):
+    """プランの順に並べた、ジャーナルで確認済みのパーツのパス（結合用）。欠けているチャンクがあれば None。
+    途中で切れた古いパーツや、前のプランの同名パーツは混ざらない"""
+    paths = completed_part_paths(job)
+    missing = [part_name(c) for c in job["chunks"] if chunk_key(c) not in paths]
+    if missing:
+        print(f"❌ {len(missing)} chunks have no verified part: {', '.join(missing[:5])}")
+        return None
+    return [paths[chunk_key(c)] for c in job["chunks"]]
+
+def remove_parts(job, chunk):
+    for f_path in find_existing_parts(job["target_dir_path"]).get(chunk_key(chunk), []):
+        try: os.remove(f_path)
+        except OSError: pass
+
+def prepare_job(original_video_path, workflow_file, run_dir_name=None, force_rate=None, dedup=DEDUP_FRAMES,
+                upload=UPLOAD_SEGMENTS, profiles=None):
+    """動画1本ぶんの準備（フレーム数取得・ワークフロー読込・作業フォルダ決定）をまとめて1回だけ行う。
+    force_rate を指定すると、事前のCFR変換の代わりにローダーの force_rate でそのfpsに揃えて読む。
+    dedup なら重複フレームを除いた unique.mp4 を作り、ローダーにはそちらを読ませる。
+    upload ならチャンクごとに切り出した動画をサーバーへ送って読ませる。
+    profiles は結合時に書き出す出力（省略時は OUTPUT_PROFILES）"""
+    started = time.time()
+    info = media_probe.probe(original_video_path)
+    if info and info["frame_count"] > 0:
+        total_frames, fps = info["frame_count"], info["fps"] or TARGET_FPS
+        width, height, duration = info["width"], info["height"], info["duration"]
+    else:
+        # ffprobe が使えない環境では OpenCV で代用
+        cap = cv2.VideoCapture(original_video_path)
+        if not cap.isOpened(): return None
         total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        fps = cap.get(cv2.CAP_PROP_FPS) or TARGET_FPS
+        width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+        height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        duration = total_frames / fps
         cap.release()
 
-        chunk_index = start_frame // CHUNK_SIZE
-        part_prefix = f"{run_dir_name}/part_{chunk_index:03d}"
-        
-        full_output_dir = os.path.join(COMFYUI_OUTPUT_DIR, run_dir_name)
-        search_pattern = os.path.join(full_output_dir, f"part_{chunk_index:03d}*{OUTPUT_EXT}")
-        existing = glob.glob(search_pattern)
-
-        if existing:
-            if any(os.path.getsize(f) > 1024 for f in existing):
-                print(f"[Worker] Chunk {chunk_index}: ✅ Exists in hash folder. Skipping.")
-                sys.exit(0)
-            else:
-                 print(f"[Worker] Chunk {chunk_index}: ⚠️ Found empty file, regenerating.")
+    workflow = load_workflow(workflow_file)
+    if force_rate:
+        # ローダーが出すフレーム数は 尺 x force_rate になる。設定はハッシュに含まれるので別の作業フォルダになる
+        total_frames, fps = int(duration * force_rate), float(force_rate)
+        if NODE_ID_LOADER in workflow:
+            node = workflow[NODE_ID_LOADER]
+            workflow[NODE_ID_LOADER] = {**node, "inputs": {**node["inputs"], "force_rate": fps}}
+    wf_hash = workflow_hash(workflow, NODE_ID_LOADER, NODE_ID_SAVER)
+    source_fp = media_probe.fingerprint(original_video_path)
 
-        current_cap = min(CHUNK_SIZE, total_frames - start_frame)
-        print(f"[Worker] Chunk {chunk_index}: Generating {current_cap} frames...")
+    base_name = os.path.splitext(os.path.basename(original_video_path))[0]
+    if run_dir_name is None:
+        safe_base_name = "".join([c if c.isalnum() or c in (' ', '.', '_', '-') else '_' for c in base_name])[:20]
+        # ファイル名ではなく中身とワークフローで作業フォルダを分ける（同名別ファイル・ワークフロー変更で混ざらない）
+        identity = f"{source_fp}|{wf_hash}" if source_fp else base_name
+        if dedup:
+            # チャンクの中身（フレーム番号の意味）が変わるので作業フォルダも分ける
+            identity += f"|dedup{frame_dedup.DEDUP_THRESHOLD}"
+        run_hash = hashlib.md5(identity.encode('utf-8')).hexdigest()[:8]
+        run_dir_name = f"{safe_base_name}_{run_hash}"
+    target_dir_path = os.path.join(COMFYUI_OUTPUT_DIR, run_dir_name)
 
-        with open(workflow_file, "r", encoding="utf-8") as f:
-            workflow = json.load(f)
+    video_path = os.path.abspath(original_video_path)
+    dedup_info = None
+    if dedup:
+        # ユニークフレームは force_rate と同じ fps で書くので、ローダーの force_rate はそのまま素通しになる
+        dedup_info = frame_dedup.build_unique_stream(video_path, target_dir_path, fps if force_rate else TARGET_FPS,
+                                                     rate=force_rate)
+        if dedup_info:
+            video_path = dedup_info["video"]
+            total_frames = dedup_info["unique_frames"]
+            source_fp = f"{source_fp}|dedup{frame_dedup.DEDUP_THRESHOLD}"
 
-        if NODE_ID_LOADER in workflow:
-            workflow[NODE_ID_LOADER]["inputs"]["frame_load_cap"] = current_cap
-            workflow[NODE_ID_LOADER]["inputs"]["skip_first_frames"] = start_frame
-            workflow[NODE_ID_LOADER]["inputs"]["video"] = os.path.abspath(video_path)
-
-        if NODE_ID_SAVER in workflow:
-            workflow[NODE_ID_SAVER]["inputs"]["filename_prefix"] = part_prefix
-            workflow[NODE_ID_SAVER]["inputs"]["frame_rate"] = TARGET_FPS 
-
-        res = queue_prompt(workflow)
-        if res and 'prompt_id' in res:
-            wait_for_prompt_completion(res['prompt_id'])
-            sys.exit(0)
+    return {
+        "video_path": video_path,
+        "base_name": base_name,
+        "run_dir_name": run_dir_name,
+        "target_dir_path": target_dir_path,
+        "total_frames": total_frames,
+        "fps": fps,
+        "width": width,
+        "height": height,
+        "workflow": workflow,
+        "workflow_hash": wf_hash,
+        "source_fingerprint": source_fp,
+        "chunk_size": CHUNK_SIZE,
+        "force_rate": force_rate,
+        "dedup": dedup_info,
+        "upload": upload,
+        "profiles": list(profiles or OUTPUT_PROFILES),
+        "journal": ChunkJournal(target_dir_path),
+        "chunks": None,
+        "timings": {"probe": round(time.time() - started, 3)},   # 段階ごとの秒数（job_result で返す）
+    }
+
+def plan_job(job, memory_budget_gb=MEMORY_BUDGET_GB):
+    """キーフレーム/シーンチェンジに合わせたチャンク割りを作る（保存済みなら再利用）。
+    メモリ予算があれば、チャンク長は解像度とワークフローの拡大率から決める"""
+    if memory_budget_gb:
+        job["chunk_size"] = estimate_chunk_size(job["workflow"], NODE_ID_LOADER, NODE_ID_SAVER,
+                                                job["width"], job["height"], memory_budget_gb) or CHUNK_SIZE
+    # force_rate で読み直す場合、元動画のキーフレーム番号はフレーム番号として使えない（unique.mp4 なら使える）
+    job["chunks"] = load_or_build_plan(job["target_dir_path"], job["video_path"],
+                                       job["total_frames"], job["fps"], job["chunk_size"],
+                                       use_keyframes=bool(job["dedup"]) or not job["force_rate"])
+    return job["chunks"]
+
+def ensure_plan(job, memory_budget_gb=MEMORY_BUDGET_GB):
+    """まだ作っていなければチャンク割りを作る（VideoJob.plan で先に作った場合はそれを使う）"""
+    if job["chunks"] is None:
+        started = time.time()
+        with metrics.timed("plan", total_frames=job["total_frames"], **event_ids(job)):
+            plan_job(job, memory_budget_gb)
+        job["timings"]["plan"] = round(time.time() - started, 3)
+    return job["chunks"]
+
+def completed_part_paths(job):
+    """{chunk_key: 完成パーツのパス}。同じチャンクに複数あれば名前の短い（最初に保存された）方"""
+    paths = {}
+    existing = find_existing_parts(job["target_dir_path"])
+    for chunk in job["chunks"]:
+        path = verified_part_path(job, chunk, existing.get(chunk_key(chunk), []))
+        if path is not None:
+            paths[chunk_key(chunk)] = path
+    return paths
+
+def event_ids(job, chunk=None):
+    """イベントに付ける動画・実行（・チャンク）の ID。1プロセスで複数の動画を流すので set_context には頼らない"""
+    ids = {"video": job["base_name"], "run": job["run_dir_name"]}
+    if chunk is not None:
+        ids["chunk"] = part_name(chunk)
+    return ids
+
+def chunk_cache_lookup_key(job, chunk):
+    if not job.get("source_fingerprint"):
+        return None
+    return chunk_cache_key(job["source_fingerprint"], job["workflow_hash"], chunk, TARGET_FPS)
+
+def restore_chunk_from_cache(job, cache, chunk):
+    """キャッシュにあれば作業フォルダへ（ハードリンクで）置く。置けたら True"""
+    key = chunk_cache_lookup_key(job, chunk)
+    if cache is None or key is None:
+        return False
+    dest = os.path.join(job["target_dir_path"], f"{part_name(chunk)}_00001{OUTPUT_EXT}")
+    with metrics.timed("cache_restore", **event_ids(job, chunk)) as m:
+        m["status"] = "hit" if cache.restore(key, dest) else "miss"
+    if m["status"] == "miss":
+        return False
+    frames, problem = check_part(dest, chunk)
+    if problem is not None:
+        os.remove(dest)
+        return False
+    job["journal"].record_done(chunk, dest, frames, source="cache")
+    return True
+
+def store_chunk_in_cache(job, cache, chunk):
+    key = chunk_cache_lookup_key(job, chunk)
+    if cache is None or key is None:
+        return
+    path = verified_part_path(job, chunk)
+    if path:
+        try:
+            cache.store(key, path)
+        except OSError as e:
+            print(f"⚠️ Could not cache {part_name(chunk)}: {e}")
+
+def replace_with_halves(job, chunk):
+    """失敗したチャンクを半分に割ってプランを書き換える。割れなければ None"""
+    if len(chunk.get("split") or "") >= MAX_SPLIT_DEPTH:
+        return None
+    halves = split_chunk(chunk)
+    if halves is None:
+        return None
+    pos = next(i for i, c in enumerate(job["chunks"]) if chunk_key(c) == chunk_key(chunk))
+    job["chunks"][pos:pos + 1] = list(halves)
+    job["journal"].record(chunk, "split")
+    save_plan(job["target_dir_path"], job["total_frames"], job["fps"], job["chunk_size"], job["chunks"])
+    # 失敗した分割前の出力が残っていれば消しておく
+    remove_parts(job, chunk)
+    return halves
+
+def transfer_slots():
+    """切り出し・アップロード・ダウンロードを同時に TRANSFER_WINDOW 本までに抑えるセマフォ"""
+    global _transfer_slots
+    if _transfer_slots is None:
+        _transfer_slots = threading.BoundedSemaphore(TRANSFER_WINDOW)
+    return _transfer_slots
+
+def cut_segment(job, chunk):
+    """チャンクの範囲だけを小さな動画に切り出す。戻り値: (パス, 先頭で読み飛ばすフレーム数)。
+    直前のキーフレームから再エンコードなしで切るので、範囲の手前のフレームが少し付くことがある。
+    キーフレームが分からない・force_rate で読み直す場合は、範囲ちょうどを再エンコードして切る"""
+    seg_dir = os.path.join(job["target_dir_path"], SEGMENT_DIR_NAME)
+    os.makedirs(seg_dir, exist_ok=True)
+    path = os.path.join(seg_dir, f"{part_name(chunk)}{OUTPUT_EXT}")
+    keyframes = [] if job["force_rate"] else media_probe.probe_keyframes(job["video_path"])
+    key = max((k for k in keyframes if k[0] <= chunk["start_frame"]), default=None, key=lambda k: k[0])
+    if key is not None:
+        lead = chunk["start_frame"] - key[0]
+        # 丸め誤差で1つ前のキーフレームへ戻らないよう、1フレーム未満だけ後ろを指定する
+        cmd = ["ffmpeg", "-y", "-v", "error", "-ss", f"{key[1] + 0.001:.6f}", "-i", job["video_path"],
+               "-map", "0:v:0", "-c", "copy", "-frames:v", str(lead + chunk["frame_cap"]),
+               "-avoid_negative_ts", "make_zero", path]
+    else:
+        lead = 0
+        cmd = ["ffmpeg", "-y", "-v", "error", "-ss", f"{chunk['start_time']:.6f}", "-i", job["video_path"],
+               "-map", "0:v:0", *(["-vf", f"fps={job['fps']}"] if job["force_rate"] else []),
+               "-frames:v", str(chunk["frame_cap"]), "-c:v", "libx264", "-preset", "veryfast",
+               "-crf", str(SEGMENT_CRF), "-pix_fmt", "yuv420p", path]
+    subprocess.run(cmd, check=True, stderr=subprocess.DEVNULL)
+    return path, lead
+
+def rebase_chunk(job, chunk, lead):
+    """切り出したセグメントを読む時のチャンク（先頭の lead フレームだけ読み飛ばす）"""
+    lead_time = lead / job["fps"] if job["fps"] else 0.0
+    return {**chunk, "start_frame": lead, "start_time": round(lead_time, 6)}
+
+def loader_seeks(job):
+    """ローダーが start_time で直接シークできるか (VHS_LoadVideoFFmpeg 等)"""
+    return "start_time" in job["workflow"].get(NODE_ID_LOADER, {}).get("inputs", {})
+
+def local_segment(job, chunk):
+    """シークできないローダー用に、チャンクを直前のキーフレームから作業フォルダへ無劣化で切り出す。
+    戻り値: (パス, 読み位置を切り出し基準に直したチャンク)。キーフレームが使えない時は None（元動画を読み飛ばす）"""
+    if job["force_rate"] or chunk["start_frame"] == 0:
+        return None
+    # 再エンコードで切ると画質が落ちるので、無劣化で切れる時だけ使う
+    if not any(0 < k[0] <= chunk["start_frame"] for k in media_probe.probe_keyframes(job["video_path"])):
+        return None
+    with transfer_slots(), metrics.timed("cut", chunk["frame_cap"], **event_ids(job, chunk)):
+        path, lead = cut_segment(job, chunk)
+    return path, rebase_chunk(job, chunk, lead)
+
+def upload_segment(job, chunk, server_url):
+    """チャンクを切り出してサーバーの input へ送る。戻り値: (ローダーに渡す名前, 読み位置を切り出し基準に直したチャンク)"""
+    with transfer_slots():
+        with metrics.timed("cut", chunk["frame_cap"], **event_ids(job, chunk)):
+            path, lead = cut_segment(job, chunk)
+        try:
+            with metrics.timed("upload", server=server_url, **event_ids(job, chunk)) as m:
+                m["bytes"] = os.path.getsize(path)
+                name = comfy_client.upload_input(server_url, path, job["run_dir_name"])
+        finally:
+            # 別サーバーへ回し直す時はもう一度切り出す（コピーなので安い）。ディスクには残さない
+            os.remove(path)
+    return name, rebase_chunk(job, chunk, lead)
+
+def fetch_output(job, chunk, server_url, prompt_id):
+    """サーバー側の出力を /view で作業フォルダへ取ってくる。取れたらそのパス"""
+    files = comfy_client.output_files(comfy_client.get_history(server_url, prompt_id), NODE_ID_SAVER)
+    files.sort(key=lambda f: not f["filename"].endswith(OUTPUT_EXT))
+    if not files:
+        return None
+    dest = os.path.join(job["target_dir_path"], f"{part_name(chunk)}_00001{OUTPUT_EXT}")
+    with transfer_slots(), metrics.timed("download", server=server_url, **event_ids(job, chunk)) as m:
+        comfy_client.download_output(server_url, files[0], dest)
+        m["bytes"] = os.path.getsize(dest)
+    return dest
+
+def emit_chunk_timings(job, chunk, result, watcher, status):
+    """投入 → 実行開始 → セーバー開始 → 完了 の時刻から、キュー待ち・実行・書き出しの時間を記録する。
+    start_frame とシーク方式も付けるので、skip_first_frames が大きいチャンクほど遅いかを後から比べられる"""
+    submitted = result["submitted_at"] or result["finished_at"]
+    started = result["started_at"] or submitted
+    saver_started = watcher.node_started.get(str(NODE_ID_SAVER))
+    fields = {
+        **event_ids(job, chunk),
+        "server": result["server"],
+        "start_frame": chunk["start_frame"],
+        "seek": result["seek"],
+        "status": status,
+    }
+    if result["started_at"]:
+        metrics.emit("queue_wait", started - submitted, **fields)
+    metrics.emit("execute", (saver_started or result["finished_at"]) - started, chunk["frame_cap"], **fields)
+    if saver_started:
+        metrics.emit("save", result["finished_at"] - saver_started, chunk["frame_cap"], **fields)
+
+def run_chunk(job, chunk, server_url, cancel_event=None, timeout=CHUNK_TIMEOUT, adopt=None):
+    """1チャンクを投入して完了まで待ち、結果を dict で返す。
+    status: "done" | "failed" | "cancelled"（cancel_event で中断された）。
+    adopt にジャーナルのエントリを渡すと、投入はせず前回の実行が投げたプロンプトの完了を待つ"""
+    chunk_index = chunk["index"]
+    label = f"[{part_name(chunk)}] "
+    result = {
+        "chunk_index": chunk_index,
+        "part": part_name(chunk),
+        "start_frame": chunk["start_frame"],
+        "server": server_url,
+        "prompt_id": None,
+        "status": "failed",
+        "error": None,
+        "elapsed": 0.0,
+        "mismatch": None,
+        "submitted_at": None,
+        "started_at": None,
+        "finished_at": None,
+        "seek": "start_time" if loader_seeks(job) else "skip_first_frames",
+    }
+    started = time.time()
+    journal = job["journal"]
+    # 前回と同じ client_id で /ws に入り直すと、引き継いだプロンプトのイベントもそのまま届く
+    watcher = PromptWatcher(server_url, adopt.get("client_id") if adopt else None)
+    segment_path = None
+    try:
+        if adopt:
+            log(f"{label}Adopting in-flight prompt {adopt['prompt_id']} on {server_url}...")
+            watcher.connect()
+            result["prompt_id"] = adopt["prompt_id"]
+            result["submitted_at"] = adopt.get("updated_at")
         else:
-            sys.exit(1)
+            part_prefix = f"{job['run_dir_name']}/{part_name(chunk)}"
+            video_input, load_chunk = job["video_path"], chunk
+            if job["upload"]:
+                video_input, load_chunk = upload_segment(job, chunk, server_url)
+                result["seek"] = "upload"
+            elif LOCAL_SEGMENTS and not loader_seeks(job):
+                segment = local_segment(job, chunk)
+                if segment is not None:
+                    segment_path, load_chunk = segment
+                    video_input = segment_path
+                    result["seek"] = "segment"
+            workflow = build_chunk_workflow(job["workflow"], video_input, load_chunk, part_prefix)
+            log(f"{label}Generating {chunk['frame_cap']} frames on {server_url}...")
+
+            # 取りこぼし防止のため、投入前に /ws を購読しておく
+            watcher.connect()
+            res = queue_prompt(workflow, server_url, watcher.client_id)
+            if not res or 'prompt_id' not in res:
+                result["error"] = "failed to queue prompt"
+                return result
+            result["prompt_id"] = res['prompt_id']
+            result["submitted_at"] = time.time()
+            journal.record(chunk, "submitted", prompt_id=res['prompt_id'], server=server_url,
+                           client_id=watcher.client_id, expected_frames=chunk["frame_cap"])
 
-    except Exception:
+        outcome = wait_for_prompt_completion(result["prompt_id"], server_url, watcher, timeout, label=label,
+                                             cancel_event=cancel_event)
+        result["started_at"] = watcher.started_at
+        result["finished_at"] = time.time()
+        emit_chunk_timings(job, chunk, result, watcher, outcome["status"])
+        if outcome["status"] == "success":
+            if job["upload"]:
+                fetch_output(job, chunk, server_url, result["prompt_id"])
+            # 保存途中で落ちた・切れたファイルを完成扱いにしないよう、中身を確認してから記録する
+            with metrics.timed("verify", **event_ids(job, chunk)) as m:
+                path, problem = find_verified_part(job, chunk)
+                m["status"] = "ok" if path else "mismatch" if problem else "missing"
+            if path is not None:
+                result["status"] = "done"
+            elif problem is not None and problem != "unreadable":
+                result["mismatch"] = problem
+                result["error"] = f"frame check failed: {problem}"
+            else:
+                result["error"] = "output missing or unreadable"
+        elif outcome["status"] == "cancelled":
+            result["status"] = "cancelled"
+        else:
+            result["error"] = outcome.get("error") or outcome["status"]
+    except Exception as e:
         traceback.print_exc()
+        result["error"] = str(e)
+    finally:
+        watcher.close()
+        # 読み終わったセグメントは残さない（描き直す時はもう一度切り出す。コピーなので安い）
+        if segment_path is not None and os.path.exists(segment_path):
+            os.remove(segment_path)
+        result["elapsed"] = time.time() - started
+        if result["status"] != "done" and result["prompt_id"]:
+            journal.record(chunk, result["status"], error=result["error"])
+    return result
+
+def reconcile_in_flight(job, pool, chunks):
+    """前回の実行が投げたまま落ちたプロンプトを ComfyUI の /queue と /history で確認する。
+    まだキューにあるものは引き継ぎ（二重に描画しない）、終わっていたものは出力を確認して完了にする。
+    戻り値: (引き継ぐ [(chunk, entry)], 完了扱いにした chunk_key の集合)"""
+    adopted = []
+    finished = set()
+    queues = {}
+    for chunk in chunks:
+        entry = job["journal"].in_flight(chunk)
+        if entry is None:
+            continue
+        url = entry["server"]
+        if url not in pool.servers or not pool.servers[url]["alive"]:
+            continue
+        if url not in queues:
+            try:
+                queues[url] = comfy_client.queued_prompt_ids(url)
+            except Exception:
+                queues[url] = None
+        if queues[url] is None:
+            continue
+        if entry["prompt_id"] in queues[url]:
+            adopted.append((chunk, entry))
+            continue
+        try:
+            history = comfy_client.get_history(url, entry["prompt_id"])
+        except Exception:
+            history = None
+        status = (history or {}).get("status") or {}
+        if history is not None and status.get("status_str") != "error" and job["upload"]:
+            try:
+                fetch_output(job, chunk, url, entry["prompt_id"])
+            except Exception:
+                pass
+        if history is not None and status.get("status_str") != "error" and verified_part_path(job, chunk):
+            finished.add(chunk_key(chunk))
+        else:
+            job["journal"].record(chunk, "failed", error="lost while the manager was down")
+    return adopted, finished
+
+def worker_process(video_path, workflow_file, start_frame, run_dir_name, server_url=COMFYUI_URL, force_rate=None,
+                   dedup=DEDUP_FRAMES, upload=UPLOAD_SEGMENTS):
+    """単一チャンクだけを実行する（デバッグ・手動リトライ用）"""
+    job = prepare_job(video_path, workflow_file, run_dir_name, force_rate, dedup, upload)
+    if job is None: sys.exit(1)
+    start_frame = int(start_frame)
+    chunk = next((c for c in plan_job(job) if c["start_frame"] == start_frame), None)
+    if chunk is None:
+        print(f"[Worker] No planned chunk starts at frame {start_frame}.")
         sys.exit(1)
+    chunk_index = chunk["index"]
+    if verified_part_path(job, chunk) is not None:
+        print(f"[Worker] Chunk {chunk_index}: ✅ Exists in hash folder. Skipping.")
+        sys.exit(0)
+    result = run_chunk(job, chunk, server_url)
+    sys.exit(0 if result["status"] == "done" else 1)
 
-def manager_process(original_video_path, workflow_file):
-    print(f"=== Manager Started (Hash Isolation Mode) ===")
-    cap = cv2.VideoCapture(original_video_path)
-    if not cap.isOpened(): return
-    total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-    cap.release()
-    
-    base_name = os.path.splitext(os.path.basename(original_video_path))[0]
-    safe_base_name = "".join([c if c.isalnum() or c in (' ', '.', '_', '-') else '_' for c in base_name])[:20]
-    filename_hash = hashlib.md5(base_name.encode('utf-8')).hexdigest()[:8]
-    
-    run_dir_name = f"{safe_base_name}_{filename_hash}"
-    target_dir_path = os.path.join(COMFYUI_OUTPUT_DIR, run_dir_name)
-    
+def summarize_gpu_idle(results):
+    """サーバーごとに「前のチャンク完了 → 次のチャンク実行開始」の空き時間を集計する。
+    実行開始が取れなかったチャンクは投入時刻で代用する"""
+    summary = {}
+    by_server = {}
+    for r in results:
+        if r["status"] == "done" and r["finished_at"]:
+            by_server.setdefault(r["server"], []).append(r)
+    for url, rs in by_server.items():
+        rs.sort(key=lambda r: r["finished_at"])
+        gaps = []
+        for prev, cur in zip(rs, rs[1:]):
+            cur_start = cur["started_at"] or cur["submitted_at"]
+            gaps.append(max(0.0, cur_start - prev["finished_at"]))
+        span = rs[-1]["finished_at"] - (rs[0]["started_at"] or rs[0]["submitted_at"])
+        summary[url] = {
+            "chunks": len(rs),
+            "mean_gap": sum(gaps) / len(gaps) if gaps else 0.0,
+            "max_gap": max(gaps) if gaps else 0.0,
+            "idle_pct": 100.0 * sum(gaps) / span if span > 0 else 0.0,
+        }
+    return summary
+
+def advance_merger(job, merger, chunks, part_paths):
+    """増分結合を進め、増えたセグメントの処理時間を記録する"""
+    start = time.time()
+    added = merger.advance(chunks, part_paths)
+    if added:
+        metrics.emit("segment", time.time() - start, segments=added, **event_ids(job))
+    return added
+
+def expand_dedup_merge(job, final_output_name, original_video_path, merge_mode=MERGE_MODE):
+    """重複除去モードの結合: ユニークフレームのパーツを映像だけでつなぎ、元のタイムラインに並べ直して音声と一緒に書き出す"""
+    dedup = job["dedup"]
+    unique_output = os.path.join(job["target_dir_path"], f"unique_merged{OUTPUT_EXT}")
+    part_paths = verified_part_list(job)
+    if part_paths is None or not merge_videos_in_folder_smart(job["target_dir_path"], unique_output,
+                                                              original_video_path, merge_mode, with_audio=False,
+                                                              part_paths=part_paths):
+        return False
+    print(f"\n=== Expanding {dedup['unique_frames']} unique frames to {dedup['total_frames']} ===")
+    encoder = pick_encoder()
+    pre, vf, enc_out = encoder_args(encoder)
+    audio_args = merge_audio_args(original_video_path)
+    # 他の解像度の出力も、並べ直した映像から同じエンコードの中で一緒に書き出す
+    _, extra_args, _ = renditions.extra_outputs(job["profiles"], final_output_name, audio_args,
+                                                dedup["total_frames"], encoder=encoder)
+    with metrics.timed("expand", dedup["total_frames"], **event_ids(job)) as m:
+        written = frame_dedup.expand_to_timeline(unique_output, dedup["runs"], final_output_name, TARGET_FPS,
+                                                 original_video_path, audio_args, pre, vf, enc_out, extra_args)
+        m["status"] = "ok" if written else "error"
+    if not written:
+        print("❌ Merge failed.")
+        return False
+    os.remove(unique_output)
+    print(f"✅ Merge Success! Final output: {os.path.basename(final_output_name)}")
+    check_merged_duration(original_video_path, final_output_name)
+    return True
+
+def make_server_pool(server_urls=None, queue_ahead=QUEUE_AHEAD):
+    """サーバープールを作る。先積みモードでは1サーバーあたり queue_ahead 個のプロンプトを常にキューに置いておく"""
+    per_server = max(MAX_PARALLEL_WORKERS, queue_ahead or 0)
+    pool = ServerPool(server_urls or COMFYUI_URLS, per_server)
+    pool.refresh()
+    print(f"🖥️ Server pool: {pool.status_line()}")
+    if queue_ahead:
+        print(f"📥 Queue-ahead mode: keeping {per_server} prompts queued per server")
+    return pool, per_server
+
+def open_job(job, original_video_path, pool, cache, memory_budget_gb=MEMORY_BUDGET_GB, merge_mode=MERGE_MODE):
+    """プラン・既存パーツ・キャッシュ・前回のプロンプトを確認して、スケジューラが回す動画1本ぶんの状態を作る"""
+    run_dir_name = job["run_dir_name"]
+    target_dir_path = job["target_dir_path"]
     if os.path.exists(target_dir_path):
         print(f"🔄 Resuming hash folder: {run_dir_name}")
     else:
         os.makedirs(target_dir_path, exist_ok=True)
         print(f"🆕 Created unique work folder: {run_dir_name}")
 
-    tasks = []
-    for i in range(0, total_frames, CHUNK_SIZE):
-        tasks.append(i)
+    existing_parts = find_existing_parts(target_dir_path)
+    pending = deque()
+    skipped = 0
+    restored = 0
+    ensure_plan(job, memory_budget_gb)
+    for chunk in job["chunks"]:
+        if verified_part_path(job, chunk, existing_parts.get(chunk_key(chunk), [])):
+            skipped += 1
+        elif restore_chunk_from_cache(job, cache, chunk):
+            restored += 1
+        else:
+            pending.append(chunk)
+    if skipped:
+        print(f"✅ {skipped} chunks already exist. Skipping them.")
+    if restored:
+        print(f"♻️ {restored} chunks restored from the chunk cache.")
+
+    # 前回の実行が投げたまま終わったプロンプトは、投げ直さずに引き継ぐ
+    adopted, recovered = reconcile_in_flight(job, pool, list(pending))
+    if recovered:
+        print(f"🩹 {len(recovered)} chunks finished while the manager was down.")
+    if adopted:
+        print(f"🔗 Adopting {len(adopted)} prompts still queued on ComfyUI.")
+    taken = recovered | {chunk_key(c) for c, _ in adopted}
+    pending = deque(c for c in pending if chunk_key(c) not in taken)
+
+    # 先頭から連続して揃ったチャンクは、生成の裏で順次セグメント化しておく
+    merger = None
+    if INCREMENTAL_MERGE and merge_mode != "encode" and not job["dedup"]:
+        merger = IncrementalMerger(target_dir_path, TARGET_FPS)
+    return {
+        "job": job,
+        "original": original_video_path,
+        "merge_mode": merge_mode,
+        "pending": pending,
+        "adopted": adopted,
+        "running": 0,
+        "running_frames": 0,
+        "results": [],
+        "skipped": skipped + len(recovered),
+        "restored": restored,
+        "merger": merger,
+        "merge_lock": threading.Lock(),
+        "cache": cache,
+        "rerenders": {},   # chunk_key -> フレーム数が合わず描き直した回数
+        "written_bytes": 0,   # 完成したパーツの合計サイズとフレーム数（空き容量の見積もり用）
+        "written_frames": 0,
+        "error": False,
+        "cancelled": False,
+        "finished": False,
+        "output": None,
+        "renditions": {},   # {プロファイル名: 出力パス}（master を含む）
+        "timings": job["timings"],
+    }
+
+def advance_job_merge(state, chunks, part_paths):
+    # 同じ動画の増分結合は1本ずつ（別の動画とは並行してよい）
+    with state["merge_lock"]:
+        return advance_merger(state["job"], state["merger"], chunks, part_paths)
+
+def estimated_part_bytes(state, frames):
+    """これから書き出すパーツの大きさの見積もり（同じ動画の完成したパーツの1フレームあたりのサイズから）"""
+    if not state["written_frames"]:
+        return 0
+    return int(state["written_bytes"] * frames / state["written_frames"])
+
+def remaining_frames(state):
+    return sum(c["frame_cap"] for c in state["pending"]) + state["running_frames"]
+
+def pick_next_state(states, policy=SCHEDULE_POLICY):
+    """次にチャンクを出す動画を選ぶ。
+    fifo: 先に受け付けた動画から / fair: 実行中のチャンクが少ない動画から / sjf: 残りフレームが少ない動画から"""
+    candidates = [s for s in states if s["pending"] and not s["error"]]
+    if not candidates:
+        return None
+    if policy == "sjf":
+        return min(candidates, key=remaining_frames)
+    if policy == "fair":
+        return min(candidates, key=lambda s: s["running"])
+    return candidates[0]
+
+def finish_job(state, on_finished=None):
+    """全チャンクが揃った動画を結合して尺を確認する（CPU 側のスレッドで実行）。出力パスを返す（失敗なら None）"""
+    job = state["job"]
+    original_video_path = state["original"]
+    merge_mode = state["merge_mode"]
+    merge_started = time.time()
+    finished = [r for r in state["results"] if r["status"] == "done"]
+    if finished:
+        avg = sum(r["elapsed"] for r in finished) / len(finished)
+        print(f"📊 {job['base_name']}: {len(finished)} chunks rendered, {state['skipped']} skipped, "
+              f"{state['restored']} from cache, avg {avg:.1f}s/chunk")
+        for url, stats in summarize_gpu_idle(state["results"]).items():
+            print(f"   [GPU idle] {url}: {stats['chunks']} chunks, gap avg {stats['mean_gap']:.2f}s / "
+                  f"max {stats['max_gap']:.2f}s, idle {stats['idle_pct']:.1f}%")
+
+    print(f"\n>>> All chunks completed! ({job['base_name']})")
+    final_output_name = os.path.join(COMFYUI_OUTPUT_DIR, f"{job['base_name']}_upscaled{OUTPUT_EXT}")
+    merger = state["merger"]
+    finalized = False
+    if merger is not None:
+        with state["merge_lock"]:
+            advance_merger(job, merger, job["chunks"], completed_part_paths(job))
+            if merger.is_complete(job["chunks"]):
+                print(f"\n=== Finalizing incremental merge: {job['run_dir_name']} ===")
+                audio_args = merge_audio_args(original_video_path)
+                extra_pre, extra_args, _ = renditions.extra_outputs(job["profiles"], final_output_name, audio_args,
+                                                                    job["total_frames"])
+                with metrics.timed("finalize", job["total_frames"], **event_ids(job)) as m:
+                    finalized = merger.finalize(final_output_name, original_video_path, audio_args,
+                                                extra_pre, extra_args)
+                    m["status"] = "ok" if finalized else "error"
+        if finalized:
+            print(f"✅ Merge Success! Final output: {os.path.basename(final_output_name)}")
+            check_merged_duration(original_video_path, final_output_name)
+        elif merger.is_complete(job["chunks"]):
+            print("   ⚠️ Incremental finalize failed. Falling back to a full merge.")
+    if job["dedup"]:
+        finalized = expand_dedup_merge(job, final_output_name, original_video_path, merge_mode)
+    elif not finalized:
+        part_paths = verified_part_list(job)
+        finalized = part_paths is not None and merge_videos_in_folder_smart(
+            job["target_dir_path"], final_output_name, original_video_path, merge_mode, profiles=job["profiles"],
+            part_paths=part_paths)
+    state["output"] = final_output_name if finalized else None
+    if finalized:
+        state["renditions"] = renditions.existing(renditions.output_paths(job["profiles"], final_output_name))
+    shutil.rmtree(os.path.join(job["target_dir_path"], SEGMENT_DIR_NAME), ignore_errors=True)
+    if finalized and CLEANUP_AFTER_MERGE:
+        release_work_dir(job, original_video_path, final_output_name, state["cache"])
+    state["timings"]["merge"] = round(time.time() - merge_started, 3)
+    if on_finished is not None:
+        on_finished(state)
+    return state["output"]
+
+def release_work_dir(job, original_video_path, final_output_name, cache=None):
+    """出力の尺が元動画と合っていれば、パーツ・増分セグメントごと作業フォルダを消してディスクを空ける。
+    パーツはキャッシュとハードリンクでつながっているので、KEEP_CACHE_AFTER_MERGE でなければキャッシュからも消す"""
+    orig_dur = get_video_duration(original_video_path)
+    new_dur = get_video_duration(final_output_name)
+    if not orig_dur or not new_dur or abs(orig_dur - new_dur) >= 1.0:
+        reason = "duration mismatch" if orig_dur and new_dur else "duration unknown"
+        print(f"   📁 Keeping {job['run_dir_name']} ({reason}) for inspection.")
+        return False
+    freed = 0
+    for root, _, files in os.walk(job["target_dir_path"]):
+        for name in files:
+            try:
+                st = os.stat(os.path.join(root, name))
+                if st.st_nlink == 1: freed += st.st_size   # キャッシュとリンクしているものは下で数える
+            except OSError: pass
+    shutil.rmtree(job["target_dir_path"], ignore_errors=True)
+    if cache is not None and not KEEP_CACHE_AFTER_MERGE:
+        keys = [chunk_cache_lookup_key(job, chunk) for chunk in job["chunks"] or []]
+        freed += cache.discard([key for key in keys if key is not None])
+    print(f"   🧹 Removed work folder {job['run_dir_name']} ({disk_budget.format_gb(freed)}).")
+    return True
+
+def handle_mismatch(state, chunk, result):
+    """フレーム数の合わないチャンクの扱い。描き直すなら True、受け入れるなら result の status を done にして True。
+    False ならこれまでどおり分割へ"""
+    job = state["job"]
+    key = chunk_key(chunk)
+    tries = state["rerenders"].get(key, 0)
+    if tries < MAX_RERENDERS:
+        state["rerenders"][key] = tries + 1
+        remove_parts(job, chunk)
+        job["journal"].record(chunk, "failed", error=result["error"])
+        state["pending"].appendleft(chunk)
+        print(f"🔁 {result['part']}: {result['mismatch']}. Re-rendering only this chunk ({tries + 1}/{MAX_RERENDERS}).")
+        return True
+    # 何度描いても最後のチャンクだけ足りない = 元動画のフレーム数表示が実際より多い。そのまま使う
+    if chunk_key(chunk) == chunk_key(job["chunks"][-1]):
+        path, _ = find_verified_part(job, chunk, allow_short=True)
+        if path is not None:
+            print(f"⚠️ {result['part']}: {result['mismatch']} on every try. The source ends early; keeping it.")
+            result["status"] = "done"
+            return True
+    return False
+
+def run_scheduler(states, pool, cache, per_server, policy=SCHEDULE_POLICY, merge_workers=1,
+                  incoming=None, open_source=None, on_finished=None, merge=True, is_cancelled=None):
+    """複数の動画のチャンクを1つのキューから GPU サーバーに配る。
+    チャンクが揃った動画の結合・尺チェックは CPU 側のスレッド (merge_workers) で行い、その間も GPU には次の動画のチャンクを流す。
+    merge=False なら結合はせず、チャンクが揃ったところで返す（VideoJob.merge で結合する）。
+    incoming (queue.Queue) に入れたものは open_source(item) で状態にして途中から受け付ける。None を入れると締め切り。
+    is_cancelled(state) が True を返した動画は、待機中のプロンプトを取り消して中断する。
+    戻り値: 受け付けた全動画の状態のリスト"""
+    executor = ThreadPoolExecutor(max_workers=per_server * len(pool.servers))
+    cpu_pool = ThreadPoolExecutor(max_workers=max(1, merge_workers))
+    running = {}     # future -> (state, chunk, server_url, cancel_event)
+    opening = set()  # open_source の future
+    finishing = set()
+    admitted = []
+    closed = incoming is None
+    eta = throughput_estimate.EtaTracker()
+    disk_paused = None   # 空き不足で新しいチャンクを止めた時刻
+    disk_forced = False  # 空き不足だが待っても空かないので、警告して出し続けている
+
+    def disk_room(state):
+        """次のチャンクと実行中のチャンクの出力が入りきるか。足りなければキャッシュの古いものを消してみる"""
+        nonlocal disk_paused, disk_forced
+        upcoming = estimated_part_bytes(state, state["pending"][0]["frame_cap"])
+        upcoming += sum(estimated_part_bytes(s, s["running_frames"]) for s in admitted)
+        missing = disk_budget.shortfall(COMFYUI_OUTPUT_DIR, upcoming)
+        if missing and cache is not None and cache.make_room(missing):
+            missing = disk_budget.shortfall(COMFYUI_OUTPUT_DIR, upcoming)
+        # 実行中のチャンクも結合待ちの動画も無ければ、待っても空きは増えない。警告して出す（止めると永久に待つ）
+        releasable = running or finishing or any(not s["finished"] and not s["pending"] and not s["running"]
+                                                 and not s["error"] for s in admitted)
+        if missing and not releasable:
+            if not disk_forced:
+                disk_forced = True
+                print(f"⚠️ Low disk space ({disk_budget.format_gb(disk_budget.free_bytes(COMFYUI_OUTPUT_DIR))} free, "
+                      f"keeping {disk_budget.MIN_FREE_GB:g} GB), but nothing in flight can free it. Continuing anyway.")
+            missing = 0
+        elif not missing:
+            disk_forced = False
+        if missing and disk_paused is None:
+            disk_paused = time.time()
+            print(f"⏸️ Low disk space ({disk_budget.format_gb(disk_budget.free_bytes(COMFYUI_OUTPUT_DIR))} free, "
+                  f"keeping {disk_budget.MIN_FREE_GB:g} GB). Holding new chunks until merges free some space.")
+        elif not missing and disk_paused is not None:
+            metrics.emit("disk_wait", time.time() - disk_paused, **event_ids(state["job"]))
+            print(f"▶️ Disk space available again after {time.time() - disk_paused:.0f}s. Resuming.")
+            disk_paused = None
+        return not missing
 
-    running_procs = [] 
-    task_iter = iter(tasks)
-    error_occurred = False
+    def submit(state, chunk, server_url, adopt=None):
+        cancel_event = threading.Event()
+        state["running"] += 1
+        state["running_frames"] += chunk["frame_cap"]
+        # 先積みされたチャンクはキュー待ちの分だけ完了が遅れるので、待ち上限もその分伸ばす
+        future = executor.submit(run_chunk, state["job"], chunk, server_url, cancel_event,
+                                 CHUNK_TIMEOUT * per_server, adopt)
+        running[future] = (state, chunk, server_url, cancel_event)
+
+    def admit(state):
+        admitted.append(state)
+        state["admitted_at"] = time.time()
+        for chunk, entry in state.pop("adopted"):
+            if pool.adopt(entry["server"]):
+                submit(state, chunk, entry["server"], entry)
+            else:
+                state["pending"].appendleft(chunk)
+        if state["merger"] is not None:
+            job = state["job"]
+            cpu_pool.submit(advance_job_merge, state, list(job["chunks"]), completed_part_paths(job))
+
+    for state in states:
+        admit(state)
 
     while True:
-        for p, frame in running_procs[:]:
-            if p.poll() is not None:
-                if p.returncode != 0:
-                    error_occurred = True
+        # 途中から来た動画を受け付ける（プランの作成などは CPU 側で）
+        while not closed:
+            try:
+                item = incoming.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                closed = True
+            else:
+                opening.add(cpu_pool.submit(open_source, item))
+        for future in [f for f in opening if f.done()]:
+            opening.discard(future)
+            try:
+                state = future.result()
+            except Exception:
+                traceback.print_exc()
+                continue
+            if state is not None:
+                admit(state)
+
+        # サーバーの生死と /queue の深さを更新。落ちたサーバーのチャンクは中断して別サーバーへ回す
+        for down_url in pool.refresh():
+            for _, _, url, cancel_event in running.values():
+                if url == down_url:
+                    cancel_event.set()
+
+        # キャンセルされた動画は新しいチャンクを出さず、実行中のチャンクの待ちも打ち切る
+        for state in admitted:
+            if is_cancelled is not None and not state["finished"] and not state["cancelled"] and is_cancelled(state):
+                print(f"🛑 Cancelled: {state['job']['base_name']}")
+                state["cancelled"] = state["error"] = True
+                state["pending"].clear()
+                for other, _, _, cancel_event in running.values():
+                    if other is state:
+                        cancel_event.set()
+
+        while True:
+            state = pick_next_state(admitted, policy)
+            if state is None or not disk_room(state):
+                break
+            server_url = pool.acquire()
+            if server_url is None:
+                break
+            submit(state, state["pending"].popleft(), server_url)
+
+        # チャンクが出揃った動画は結合に回す
+        for state in admitted:
+            if not state["finished"] and not state["pending"] and state["running"] == 0:
+                state["finished"] = True
+                state["timings"]["render"] = round(time.time() - state["admitted_at"], 3)
+                if state["error"] or not merge:
+                    if on_finished is not None: on_finished(state)
+                else:
+                    finishing.add(cpu_pool.submit(finish_job, state, on_finished))
+        finishing = {f for f in finishing if not f.done()}
+
+        if not running:
+            if not any(s["pending"] and not s["error"] for s in admitted):
+                if closed and not opening:
                     break
-                running_procs.remove((p, frame))
-        
-        if error_occurred: break
+                if opening or finishing:
+                    wait(opening | finishing, timeout=POOL_REFRESH_INTERVAL, return_when=FIRST_COMPLETED)
+                else:
+                    time.sleep(POOL_REFRESH_INTERVAL)
+                continue
+            if not pool.has_alive():
+                print("❌ All ComfyUI servers are down. Aborting (re-run to resume).")
+                for state in admitted:
+                    if not state["finished"]:
+                        state["error"] = True
+                        state["pending"].clear()
+                continue
+            time.sleep(POOL_REFRESH_INTERVAL)
+            continue
 
-        while len(running_procs) < MAX_PARALLEL_WORKERS:
-            try:
-                next_start_frame = next(task_iter)
-                chunk_index = next_start_frame // CHUNK_SIZE
-                
-                search_pattern = os.path.join(target_dir_path, f"part_{chunk_index:03d}*{OUTPUT_EXT}")
-                if glob.glob(search_pattern):
+        done, _ = wait(running, timeout=POOL_REFRESH_INTERVAL, return_when=FIRST_COMPLETED)
+        for future in done:
+            state, chunk, url, _ = running.pop(future)
+            job = state["job"]
+            state["running"] -= 1
+            state["running_frames"] -= chunk["frame_cap"]
+            pool.release(url)
+            result = future.result()
+            state["results"].append(result)
+            if result["status"] == "cancelled" and state["cancelled"] and result["prompt_id"]:
+                # まだ待機中なら ComfyUI のキューから取り除く（実行中のものはそのまま終わり、次回はパーツとして拾われる）
+                comfy_client.cancel_prompt(url, result["prompt_id"])
+            # フレーム数・尺が合わないチャンクは、そのチャンクだけ描き直す（全体のリタイミングはしない）
+            if result["mismatch"] and not state["error"] and handle_mismatch(state, chunk, result):
+                if result["status"] != "done":
                     continue
+            if result["status"] == "done":
+                entry = job["journal"].get(chunk)
+                if entry and entry.get("size"):
+                    state["written_bytes"] += entry["size"]
+                    state["written_frames"] += entry["actual_frames"]
+                store_chunk_in_cache(job, cache, chunk)
+                # 実際のチャンクの処理速度で、受け付け済みの動画の残り時間を見積もり直す
+                eta.add(chunk["frame_cap"])
+                active = [s for s in admitted if not s["error"] and not s["finished"]]
+                line = eta.report(sum(remaining_frames(s) for s in active),
+                                  f"{len(active)} videos: " if len(active) > 1 else "")
+                if line:
+                    log(line)
+                if state["merger"] is not None:
+                    cpu_pool.submit(advance_job_merge, state, list(job["chunks"]), completed_part_paths(job))
+                continue
+            if state["error"]:
+                continue
+            # サーバー側の障害なら別サーバーでやり直し、そうでなければその動画は中断
+            if result["status"] == "cancelled" or not pool.check(url):
+                state["pending"].appendleft(chunk)
+                print(f"↪️ {result['part']}: {url} is down. Re-dispatching.")
+                continue
+            # メモリ不足などでの失敗は、チャンクを半分に割ってやり直す
+            halves = replace_with_halves(job, chunk) if SPLIT_ON_FAILURE else None
+            if halves:
+                print(f"✂️ {result['part']} failed ({result['error']}). Retrying as "
+                      f"{part_name(halves[0])} + {part_name(halves[1])} ({halves[0]['frame_cap']}+{halves[1]['frame_cap']} frames).")
+                state["pending"].extendleft(reversed(halves))
+                continue
+            print(f"❌ {result['part']} failed: {result['error']}")
+            state["error"] = True
+            state["pending"].clear()
+            for other, _, _, cancel_event in running.values():
+                if other is state:
+                    cancel_event.set()
 
-                # ★修正箇所：コマンド定義を明確に記述
-                cmd = [
-                    sys.executable, 
-                    __file__, 
-                    original_video_path, 
-                    workflow_file, 
-                    "--worker_mode", 
-                    "--start_frame", str(next_start_frame), 
-                    "--run_id", run_dir_name
-                ]
-                proc = subprocess.Popen(cmd)
-                
-                running_procs.append((proc, next_start_frame))
-                time.sleep(2) 
-            except StopIteration:
-                break 
-        
-        if not running_procs:
-            try:
-                next(iter(tasks))
-                break 
-            except:
-                break 
-        time.sleep(1)
+    executor.shutdown(wait=True)
+    cpu_pool.shutdown(wait=True)
+    return admitted
+
+def job_result(state):
+    """動画1本ぶんの結果。出力の正確なパス・段階ごとの秒数・チャンクの内訳を dict で返す。
+    status は "done" / "failed" / "cancelled"。"""
+    job = state.get("job")
+    results = state.get("results", [])
+    rendered = [r for r in results if r["status"] == "done"]
+    if state.get("cancelled"):
+        status = "cancelled"
+    else:
+        status = "done" if state.get("output") else "failed"
+    return {
+        "status": status,
+        "output": state.get("output"),
+        "renditions": dict(state.get("renditions") or {}),
+        "video": job["base_name"] if job else None,
+        "original": state.get("original"),
+        "frames": job["total_frames"] if job else 0,
+        "timings": dict(job["timings"]) if job else {},
+        "chunks": {
+            "total": len(job["chunks"] or []) if job else 0,
+            "rendered": len(rendered),
+            "skipped": state.get("skipped", 0),
+            "restored": state.get("restored", 0),
+            "failed": sum(1 for r in results if r["status"] == "failed"),
+            "rerenders": sum(state.get("rerenders", {}).values()),
+            "gpu_seconds": round(sum(r["elapsed"] for r in rendered), 3),
+        },
+    }
+
+class VideoJob:
+    """動画1本を probe → plan → run_chunks → merge の段階に分けて、同じプロセスの中で処理する。
+    各段階はまだなら前の段階から実行するので、run() だけ呼んでもよい。結果は job_result() の dict。
+
+        result = VideoJob("input.mp4", "workflow_api.json").run()
+        result["output"], result["timings"], result["chunks"]
+    """
+
+    def __init__(self, video_path, workflow_file=DEFAULT_WORKFLOW_FILE, server_urls=None, queue_ahead=QUEUE_AHEAD,
+                 memory_budget_gb=MEMORY_BUDGET_GB, merge_mode=MERGE_MODE, force_rate=None, dedup=DEDUP_FRAMES,
+                 upload=UPLOAD_SEGMENTS, profiles=None):
+        self.video_path = video_path
+        self.workflow_file = workflow_file
+        self.server_urls = server_urls
+        self.queue_ahead = queue_ahead
+        self.memory_budget_gb = memory_budget_gb
+        self.merge_mode = merge_mode
+        self.force_rate = force_rate
+        self.dedup = dedup
+        self.upload = upload
+        self.profiles = profiles
+        self.job = None
+        self.state = None
+
+    def probe(self):
+        """フレーム数・ワークフロー・作業フォルダを決める。読めない動画なら None"""
+        if self.job is None:
+            started = time.time()
+            self.job = prepare_job(self.video_path, self.workflow_file, force_rate=self.force_rate,
+                                   dedup=self.dedup, upload=self.upload, profiles=self.profiles)
+            if self.job is None:
+                print(f"❌ Could not read {os.path.basename(self.video_path)}.")
+                return None
+            report_prepared(self.job, time.time() - started)
+        return self.job
+
+    def plan(self):
+        """チャンク割り（保存済みなら再利用）"""
+        if self.probe() is None:
+            return None
+        return ensure_plan(self.job, self.memory_budget_gb)
+
+    def run_chunks(self, is_cancelled=None):
+        """足りないチャンクを生成する（既存パーツ・キャッシュ・前回のプロンプトは引き継ぐ）。
+        is_cancelled() が True を返したら中断する。全チャンクが揃えば True"""
+        if self.state is None:
+            if self.plan() is None:
+                return False
+            pool, per_server = make_server_pool(self.server_urls, self.queue_ahead)
+            cache = ChunkCache(CHUNK_CACHE_DIR, ext=OUTPUT_EXT) if USE_CHUNK_CACHE else None
+            self.state = open_job(self.job, self.video_path, pool, cache, self.memory_budget_gb, self.merge_mode)
+            run_scheduler([self.state], pool, cache, per_server, merge=False,
+                          is_cancelled=(lambda state: is_cancelled()) if is_cancelled else None)
+        return not self.state["error"]
+
+    def merge(self):
+        """揃ったチャンクを結合して尺を確認する。出力パスを返す（失敗なら None）"""
+        if not self.run_chunks():
+            return None
+        if self.state["output"] is None:
+            finish_job(self.state)
+        return self.state["output"]
+
+    def result(self):
+        return job_result(self.state or {"job": self.job, "original": self.video_path})
+
+    def run(self, is_cancelled=None):
+        """全段階を実行して job_result() の dict を返す"""
+        started = time.time()
+        if self.run_chunks(is_cancelled):
+            self.merge()
+        result = self.result()
+        result["timings"]["total"] = round(time.time() - started, 3)
+        return result
+
+def manager_process(original_video_path, workflow_file, server_urls=None, queue_ahead=QUEUE_AHEAD,
+                    memory_budget_gb=MEMORY_BUDGET_GB, merge_mode=MERGE_MODE, force_rate=None, dedup=DEDUP_FRAMES,
+                    upload=UPLOAD_SEGMENTS, profiles=None):
+    print(f"=== Manager Started (Hash Isolation Mode) ===")
+    run_started = time.time()
+    video = VideoJob(original_video_path, workflow_file, server_urls, queue_ahead, memory_budget_gb, merge_mode,
+                     force_rate, dedup, upload, profiles)
+    job = video.probe()
+    if job is None: return
+    metrics.set_context(run=job["run_dir_name"], video=job["base_name"])
+    result = video.run()
+
+    wall = time.time() - run_started
+    for line in metrics.summary_lines(wall):
+        print(line)
+    metrics.write_prometheus("process_video", wall)
+    return result["output"]
+
+def dry_run(original_video_path, workflow_file, server_urls=None, memory_budget_gb=MEMORY_BUDGET_GB,
+            force_rate=None, dedup=DEDUP_FRAMES, upload=UPLOAD_SEGMENTS):
+    """本番の前に、動画から等間隔に取った短い範囲だけを実際のワークフローで描いてみて、
+    処理速度とピークメモリから所要時間と推奨チャンク長を見積もる。見積もりの dict を返す（描けなければ None）。
+    試し描きの出力は消すので、作業フォルダやジャーナルには何も残さない。
+    dedup でも unique.mp4 は作らず、試し描きする範囲だけからユニークフレームの割合を見積もる"""
+    job = prepare_job(original_video_path, workflow_file, force_rate=force_rate, dedup=False, upload=upload)
+    if job is None:
+        return None
+    if memory_budget_gb:
+        job["chunk_size"] = estimate_chunk_size(job["workflow"], NODE_ID_LOADER, NODE_ID_SAVER,
+                                                job["width"], job["height"], memory_budget_gb) or CHUNK_SIZE
+    pool = ServerPool(server_urls or COMFYUI_URLS)
+    pool.refresh()
+    alive = [url for url, s in pool.servers.items() if s["alive"]]
+    if not alive:
+        print("❌ No ComfyUI server is reachable.")
+        return None
+
+    # 試し描きは本番と同じ run_chunk で行う（アップロード・フレーム数の確認も本番どおり）。置き場所だけ別にする
+    sample_dir = os.path.join(COMFYUI_OUTPUT_DIR, DRY_RUN_DIR_NAME, job["run_dir_name"])
+    os.makedirs(sample_dir, exist_ok=True)
+    sample_job = {**job, "target_dir_path": sample_dir, "journal": ChunkJournal(sample_dir),
+                  "run_dir_name": f"{DRY_RUN_DIR_NAME}/{job['run_dir_name']}"}
+    windows = throughput_estimate.sample_windows(job["total_frames"])
+    print(f"\n🧪 Dry run: {job['base_name']} ({len(windows)} samples on {alive[0]})")
+    planned_frames = job["total_frames"]
+    if dedup:
+        ratio = frame_dedup.sample_unique_ratio(job["video_path"], windows, job["fps"], rate=force_rate)
+        if ratio is not None and ratio < 1.0:
+            planned_frames = max(1, round(planned_frames * ratio))
+            print(f"🎞️ Dedup (sampled): ~{ratio * 100:.0f}% unique frames, ~{planned_frames}/{job['total_frames']} to upscale")
+    samples = []
+    try:
+        for i, (start, frames) in enumerate(windows):
+            chunk = {"index": i, "start_frame": start, "frame_cap": frames,
+                     "start_time": round(start / job["fps"], 6), "end_time": round((start + frames) / job["fps"], 6)}
+            with throughput_estimate.MemorySampler(alive[0]) as memory:
+                result = run_chunk(sample_job, chunk, alive[0])
+            if result["status"] != "done":
+                print(f"❌ Sample at frame {start} ({frames} frames) failed: {result['error']}")
+                return None
+            seconds = result["finished_at"] - (result["started_at"] or result["submitted_at"])
+            samples.append({"frames": frames, "seconds": seconds, **memory.fields()})
+    finally:
+        shutil.rmtree(sample_dir, ignore_errors=True)
+        try: os.rmdir(os.path.dirname(sample_dir))
+        except OSError: pass
+
+    size = job["chunk_size"]
+    caps = [min(size, planned_frames - start) for start in range(0, planned_frames, size)]
+    estimate = throughput_estimate.summarize(samples, caps, len(alive), size)
+    estimate["video"] = job["base_name"]
+    throughput_estimate.print_estimate(estimate)
+    return estimate
+
+def report_prepared(job, seconds):
+    dedup = job["dedup"]
+    metrics.emit("probe", seconds, total_frames=job["total_frames"], **event_ids(job),
+                 timeline_frames=dedup["total_frames"] if dedup else None)
+    if dedup:
+        saved = 100.0 * (1 - dedup["unique_frames"] / dedup["total_frames"])
+        print(f"🎞️ Dedup: {dedup['unique_frames']}/{dedup['total_frames']} unique frames ({saved:.0f}% fewer to upscale)")
+
+def batch_process(sources, workflow_file, server_urls=None, queue_ahead=QUEUE_AHEAD,
+                  memory_budget_gb=MEMORY_BUDGET_GB, merge_mode=MERGE_MODE, policy=SCHEDULE_POLICY,
+                  merge_workers=MERGE_WORKERS, on_finished=None):
+    """複数の動画を1つのチャンクキューで処理する（batch_run.py から使う）。
+    sources は {"video", "original", "force_rate", "dedup", "upload", "profiles"} のリスト、または途中から足していく queue.Queue（None で締め切り）。
+    video はローダーに読ませる入力（CFR 変換済みなど）、original は結合時に載せる音声と尺チェックの元（省略時は video）。
+    出力ファイル名は video から付くので、元の名前に戻すのは呼び出し側（batch_run.save_result）。
+    on_finished(state) は動画ごとに結合が終わった（または失敗した）時点で CPU 側のスレッドから呼ばれ、
+    state["source"] に渡した dict が入る。出力パスや時間は job_result(state) で取る"""
+    pool, per_server = make_server_pool(server_urls, queue_ahead)
+    cache = ChunkCache(CHUNK_CACHE_DIR, ext=OUTPUT_EXT) if USE_CHUNK_CACHE else None
+    if not isinstance(sources, queue.Queue):
+        items = list(sources)
+        sources = queue.Queue()
+        for item in items + [None]:
+            sources.put(item)
+
+    def open_source(source):
+        started = time.time()
+        job = prepare_job(source["video"], workflow_file, force_rate=source.get("force_rate"),
+                          dedup=source.get("dedup", DEDUP_FRAMES), upload=source.get("upload", UPLOAD_SEGMENTS),
+                          profiles=source.get("profiles"))
+        if job is None:
+            print(f"❌ Could not read {os.path.basename(source['video'])}. Skipping.")
+            if on_finished is not None:
+                on_finished({"source": source, "job": None, "output": None, "error": True})
+            return None
+        report_prepared(job, time.time() - started)
+        state = open_job(job, source.get("original", source["video"]), pool, cache, memory_budget_gb, merge_mode)
+        state["source"] = source
+        return state
 
-    if not error_occurred:
-        print("\n>>> All chunks completed!")
-        final_output_name = os.path.join(COMFYUI_OUTPUT_DIR, f"{base_name}_upscaled{OUTPUT_EXT}")
-        merge_videos_in_folder_smart(target_dir_path, final_output_name, original_video_path)
+    print(f"🗂️ Global chunk scheduler: policy={policy}, {merge_workers} merge workers")
+    return run_scheduler([], pool, cache, per_server, policy, merge_workers, sources, open_source, on_finished)
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("video_path", nargs="?", help="Path to video file")
     parser.add_argument("workflow_file", nargs="?", default=DEFAULT_WORKFLOW_FILE, help="Path to workflow json")
-    parser.add_argument("--worker_mode", action="store_true")
+    parser.add_argument("--worker_mode", action="store_true", help="Run a single chunk (debug / manual retry)")
     parser.add_argument("--start_frame")
     parser.add_argument("--run_id") 
+    parser.add_argument("--server", help="ComfyUI URL for this worker")
+    parser.add_argument("--servers", help="Comma-separated ComfyUI URLs to spread chunks over")
+    parser.add_argument("--queue_ahead", type=int, default=QUEUE_AHEAD, help="Prompts to keep queued per server (0 = off)")
+    parser.add_argument("--memory_budget_gb", type=float, default=MEMORY_BUDGET_GB,
+                        help="Derive chunk length from this RAM budget instead of CHUNK_SIZE")
+    parser.add_argument("--merge_mode", choices=["auto", "copy", "encode"], default=MERGE_MODE)
+    parser.add_argument("--force_rate", type=float, help="Resample a VFR source in the loader instead of pre-converting")
+    parser.add_argument("--dedup", action="store_true", default=DEDUP_FRAMES,
+                        help="Upscale only unique frames and re-expand held frames at merge time")
+    parser.add_argument("--upload", action="store_true", default=UPLOAD_SEGMENTS,
+                        help="Send each chunk as a cut segment via /upload and fetch outputs via /view (no shared storage)")
+    parser.add_argument("--profiles", default=",".join(OUTPUT_PROFILES),
+                        help=f"Comma-separated outputs to write at merge time ({','.join(renditions.PROFILES)})")
+    parser.add_argument("--dry_run", action="store_true",
+                        help="Render a few short samples to estimate the run time and a chunk size, then exit")
     args = parser.parse_args()
 
     if not args.video_path:
@@ -290,7 +1485,16 @@ if __name__ == "__main__":
             args.video_path = input_path
         except: sys.exit(0)
 
+    if args.dry_run:
+        server_urls = [u for u in (args.servers or "").split(",") if u.strip()]
+        estimate = dry_run(args.video_path, args.workflow_file, server_urls or None, args.memory_budget_gb,
+                           args.force_rate, args.dedup, args.upload)
+        sys.exit(0 if estimate else 1)
     if args.worker_mode:
-        worker_process(args.video_path, args.workflow_file, args.start_frame, args.run_id)
+        worker_process(args.video_path, args.workflow_file, args.start_frame, args.run_id,
+                       normalize_url(args.server or COMFYUI_URL), args.force_rate, args.dedup, args.upload)
     else:
-        manager_process(args.video_path, args.workflow_file)
\ No newline at end of file
+        server_urls = [u for u in (args.servers or "").split(",") if u.strip()]
+        manager_process(args.video_path, args.workflow_file, server_urls or None, args.queue_ahead,
+                        args.memory_budget_gb, args.merge_mode, args.force_rate, args.dedup, args.upload,
+                        [p.strip() for p in args.profiles.split(",") if p.strip()])
\ No newline at end of file
@@ -0,0 +1,75 @@
+import os
+
+from ffmpeg_encoders import DEFAULT_QUALITY, pick_encoder, encoder_args
+
+# ================= 設定エリア =================
+# 結合時に一緒に書き出す出力。"master" は結合したそのままの解像度の本体（常に書き出す）
+PROFILES = {
+    "master": {"kind": "video"},
+    "1080p":  {"kind": "video", "height": 1080, "quality": 20},   # 高さがこれより大きければ縮小する（拡大はしない）
+    "720p":   {"kind": "video", "height": 720, "quality": 22},
+    "thumbs": {"kind": "strip", "count": 10, "width": 320},       # 等間隔に取ったフレームを横に並べた JPEG 1枚
+}
+STRIP_FALLBACK_STEP = 300   # 総フレーム数が分からない時のサムネイルの間隔（フレーム）
+# ============================================
+
+def resolve(profiles):
+    """プロファイル名のリストから、master 以外の使えるものだけを順番どおりに返す"""
+    names = []
+    for name in profiles or ():
+        if name not in PROFILES:
+            print(f"   ⚠️ Unknown output profile '{name}'. Skipping it.")
+        elif name != "master" and name not in names:
+            names.append(name)
+    return names
+
+def output_path(master_output, name):
+    """master の出力パスから、そのプロファイルの出力パス ({名前}_1080p.mp4 / {名前}_thumbs.jpg) を作る"""
+    if name == "master":
+        return master_output
+    stem, ext = os.path.splitext(master_output)
+    return f"{stem}_{name}{'.jpg' if PROFILES[name]['kind'] == 'strip' else ext}"
+
+def output_paths(profiles, master_output):
+    """{プロファイル名: 出力パス}（master を含む）"""
+    return {"master": master_output, **{name: output_path(master_output, name) for name in resolve(profiles)}}
+
+def _branch_filter(profile, vf, total_frames):
+    if profile["kind"] == "strip":
+        count = profile["count"]
+        step = max(1, total_frames // count) if total_frames else STRIP_FALLBACK_STEP
+        return f"select=not(mod(n\\,{step})),scale={profile['width']}:-2,tile={count}x1"
+    chain = f"scale=-2:min(ih\\,{profile['height']})" if profile.get("height") else "null"
+    return chain + (f",{vf}" if vf else "")
+
+def extra_outputs(profiles, master_output, audio_args, total_frames=0, video_in="0:v", audio_in="1:a?",
+                  encoder=None):
+    """master 以外のプロファイルを、master を書き出す ffmpeg コマンドの追加出力にする引数。
+    映像は1回だけデコードして split で分け、各プロファイルのエンコーダーに同時に渡す（出力ごとに読み直さない）。
+    動画の出力には audio_in の音声を載せる。total_frames はサムネイルの間隔を決めるのに使う。
+    戻り値: (入力より前に置く引数, master の出力ファイル名の後ろに足す引数, {プロファイル名: パス})"""
+    names = resolve(profiles)
+    if not names:
+        return [], [], {}
+    encoder = encoder or pick_encoder()
+    labels = [f"r{i}" for i in range(len(names))]
+    graph = [f"[{video_in}]split={len(names)}" + "".join(f"[{label}s]" for label in labels)]
+    args = []
+    paths = {}
+    pre = []
+    for name, label in zip(names, labels):
+        profile = PROFILES[name]
+        path = output_path(master_output, name)
+        paths[name] = path
+        if profile["kind"] == "strip":
+            graph.append(f"[{label}s]{_branch_filter(profile, None, total_frames)}[{label}]")
+            args += ["-map", f"[{label}]", "-frames:v", "1", "-q:v", "3", "-update", "1", path]
+            continue
+        pre, vf, enc_out = encoder_args(encoder, profile.get("quality", DEFAULT_QUALITY))
+        graph.append(f"[{label}s]{_branch_filter(profile, vf, total_frames)}[{label}]")
+        args += ["-map", f"[{label}]", "-map", audio_in, *enc_out, *audio_args, "-movflags", "+faststart", path]
+    return pre, ["-filter_complex", ";".join(graph), *args], paths
+
+def existing(paths):
+    """書き出せたプロファイルだけ {名前: パス}"""
+    return {name: path for name, path in paths.items() if os.path.exists(path)}
@@ -18,10 +18,12 @@ else
     echo "Warning: No venv found. Running with system python..."
 fi
 
-# 実行
-python batch_run.py
+# 実行（./run.sh --watch で常駐モード、./run.sh --dry_run で所要時間の見積もりだけ）
+python batch_run.py "$@"
 
-# 終了確認
-echo ""
-echo "処理が完了しました。エンターキーを押すと閉じます。"
-read
\ No newline at end of file
+# 終了確認（常駐モードでは待たない）
+if [[ " $* " != *" --watch "* ]]; then
+    echo ""
+    echo "処理が完了しました。エンターキーを押すと閉じます。"
+    read
+fi
\ No newline at end of file
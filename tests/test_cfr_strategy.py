@@ -0,0 +1,40 @@
+"""batch_run.choose_cfr_strategy: 付け替え(リマックス)で音ズレしないものだけを remux にすること"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import batch_run
+
+
+def probe_info(frame_count, duration, fps, is_cfr, codec="h264"):
+    return {"frame_count": frame_count, "duration": duration, "fps": fps, "is_cfr": is_cfr, "codec": codec}
+
+
+def test_ntsc_cfr_is_not_remuxed():
+    # 30000/1001 fps の CFR を 30fps で打ち直すと 0.1% 短くなり、1時間で約3.6秒ずれる
+    fps = 30000 / 1001
+    info = probe_info(round(3600 * fps), 3600.0, fps, is_cfr=True)
+    assert batch_run.choose_cfr_strategy(info) == "reencode"
+
+
+def test_ntsc_vfr_is_not_remuxed():
+    fps = 30000 / 1001
+    info = probe_info(round(3600 * fps), 3600.0, fps, is_cfr=False)
+    assert batch_run.choose_cfr_strategy(info) == "reencode"
+
+
+def test_exact_target_cfr_is_passed_through():
+    info = probe_info(108000, 3600.0, 30.0, is_cfr=True)
+    assert batch_run.choose_cfr_strategy(info) == "passthrough"
+
+
+def test_jittery_vfr_with_exact_frame_count_is_remuxed():
+    # タイムスタンプが揺れているだけで、フレーム数は 尺 x 30 ちょうど
+    info = probe_info(108000, 3600.0, 29.98, is_cfr=False)
+    assert batch_run.choose_cfr_strategy(info) == "remux"
+
+
+def test_vfr_with_missing_frames_is_not_remuxed():
+    info = probe_info(107000, 3600.0, 29.7, is_cfr=False)
+    assert batch_run.choose_cfr_strategy(info) == "reencode"
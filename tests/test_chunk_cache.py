@@ -0,0 +1,72 @@
+"""chunk_cache.ChunkCache: LRU の記録で作業フォルダのパーツを触らないこと、上限で消すのはリンクの切れたものだけなこと"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from chunk_cache import ChunkCache
+
+
+def write_part(path, size=4096):
+    with open(path, "wb") as f:
+        f.write(os.urandom(size))
+    return path
+
+
+def test_lookup_does_not_touch_linked_part_mtime(tmp_path):
+    cache = ChunkCache(str(tmp_path / "cache"))
+    part = write_part(str(tmp_path / "part_000_00001.mp4"))
+    os.utime(part, ns=(1_000_000_000, 1_000_000_000))
+    cache.store("aa11", part)
+    assert cache.lookup("aa11") is not None
+    assert os.stat(part).st_mtime_ns == 1_000_000_000
+
+
+def test_running_total_survives_reopen(tmp_path):
+    cache = ChunkCache(str(tmp_path / "cache"))
+    for key in ("aa11", "bb22"):
+        cache.store(key, write_part(str(tmp_path / f"{key}.mp4")))
+    assert cache.total == 2 * 4096
+    assert ChunkCache(str(tmp_path / "cache")).total == 2 * 4096
+
+
+def test_evict_skips_entries_linked_to_work_parts(tmp_path):
+    cache = ChunkCache(str(tmp_path / "cache"), max_gb=6000 / 1024 ** 3)
+    linked = write_part(str(tmp_path / "linked.mp4"))
+    cache.store("aa11", linked)          # 作業フォルダのパーツが残っている（最も古い）
+    time.sleep(0.01)
+    old = write_part(str(tmp_path / "old.mp4"))
+    cache.store("bb22", old)
+    os.remove(old)                        # 作業フォルダは片付け済み
+    assert cache.lookup("aa11") is not None and cache.lookup("bb22") is not None
+    time.sleep(0.01)
+    cache.lookup("aa11")
+    new = write_part(str(tmp_path / "new.mp4"))
+    cache.store("cc33", new)
+    os.remove(new)
+    # 上限を超えたので、リンクの切れた中で一番古い bb22 だけが消える
+    assert cache.lookup("aa11") is not None
+    assert cache.lookup("bb22") is None
+    assert cache.lookup("cc33") is not None
+    assert cache.total == 2 * 4096
+
+
+def test_make_room_frees_only_unlinked_bytes(tmp_path):
+    cache = ChunkCache(str(tmp_path / "cache"))
+    cache.store("aa11", write_part(str(tmp_path / "linked.mp4")))
+    unlinked = write_part(str(tmp_path / "gone.mp4"))
+    cache.store("bb22", unlinked)
+    os.remove(unlinked)
+    assert cache.make_room(10 ** 9) == 4096
+    assert cache.lookup("aa11") is not None
+
+
+def test_discard_counts_bytes_freed_once_unlinked(tmp_path):
+    cache = ChunkCache(str(tmp_path / "cache"))
+    part = write_part(str(tmp_path / "part.mp4"))
+    cache.store("aa11", part)
+    os.remove(part)                       # 作業フォルダを消した後
+    assert cache.discard(["aa11", "zz99"]) == 4096
+    assert cache.lookup("aa11") is None
+    assert cache.total == 0
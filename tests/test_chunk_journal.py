@@ -0,0 +1,104 @@
+"""chunk_journal.ChunkJournal: 再開時の読み直し、出力が変わった記録の無効化、書き込み途中で落ちた最終行"""
+import json
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import media_probe
+from chunk_journal import ChunkJournal, JOURNAL_FILE_NAME
+
+
+@pytest.fixture(autouse=True)
+def probe_cache(tmp_path, monkeypatch):
+    # 指紋のキャッシュはリポジトリの probe_cache.sqlite ではなく一時フォルダに置く
+    monkeypatch.setattr(media_probe, "PROBE_CACHE_FILE", str(tmp_path / "probe_cache.sqlite"))
+
+
+def chunk(index, start_frame=None, frame_cap=100):
+    return {"index": index, "start_frame": index * 100 if start_frame is None else start_frame,
+            "frame_cap": frame_cap, "split": ""}
+
+
+def write_part(work, c, size=4096):
+    path = os.path.join(work, f"part_{c['index']:03d}_00001.mp4")
+    with open(path, "wb") as f:
+        f.write(b"\0" * size)
+    return path
+
+
+def test_record_and_replay(tmp_path):
+    work = str(tmp_path)
+    journal = ChunkJournal(work)
+    done = write_part(work, chunk(0))
+    journal.record(chunk(0), "submitted", prompt_id="p0", server="http://a")
+    journal.record_done(chunk(0), done, 100)
+    journal.record(chunk(1), "submitted", prompt_id="p1", server="http://a", client_id="c1")
+
+    replayed = ChunkJournal(work)
+    assert replayed.done_output(chunk(0)) == done
+    assert replayed.get(chunk(0))["prompt_id"] == "p0"   # 前の行の項目も引き継ぐ
+    assert replayed.in_flight(chunk(1))["client_id"] == "c1"
+    assert replayed.in_flight(chunk(0)) is None
+    assert replayed.done_output(chunk(1)) is None
+
+
+def test_done_entry_goes_stale_when_output_changes(tmp_path):
+    work = str(tmp_path)
+    journal = ChunkJournal(work)
+    path = write_part(work, chunk(0))
+    journal.record_done(chunk(0), path, 100)
+    assert ChunkJournal(work).done_output(chunk(0)) == path
+
+    st = os.stat(path)
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 1_000_000))
+    assert ChunkJournal(work).done_output(chunk(0)) is None
+
+    journal.record_done(chunk(0), path, 100)
+    write_part(work, chunk(0), size=2048)          # 同じ名前で書き直された
+    assert ChunkJournal(work).done_output(chunk(0)) is None
+
+    os.remove(path)
+    assert ChunkJournal(work).done_output(chunk(0)) is None
+
+
+def test_short_output_is_not_trusted(tmp_path):
+    work = str(tmp_path)
+    journal = ChunkJournal(work)
+    journal.record_done(chunk(0), write_part(work, chunk(0)), 97)
+    assert ChunkJournal(work).done_output(chunk(0)) is None
+
+
+def test_entry_for_other_range_is_stale(tmp_path):
+    work = str(tmp_path)
+    journal = ChunkJournal(work)
+    journal.record_done(chunk(0), write_part(work, chunk(0)), 100)
+    replanned = chunk(0, frame_cap=90)
+    assert journal.get(replanned) is None
+    assert journal.is_stale(replanned)
+    assert journal.done_output(replanned) is None
+    assert not journal.is_stale(chunk(0))
+
+
+def test_truncated_last_line_is_ignored(tmp_path):
+    work = str(tmp_path)
+    journal = ChunkJournal(work)
+    path = write_part(work, chunk(0))
+    journal.record_done(chunk(0), path, 100)
+    journal.record(chunk(1), "submitted", prompt_id="p1", server="http://a")
+    # 最後の行を書いている途中で落ちた
+    torn = json.dumps({"part": "part_000", "start_frame": 0, "frame_cap": 100, "state": "failed"})
+    with open(os.path.join(work, JOURNAL_FILE_NAME), "a", encoding="utf-8") as f:
+        f.write(torn[:len(torn) // 2])
+
+    replayed = ChunkJournal(work)
+    assert replayed.done_output(chunk(0)) == path
+    assert replayed.in_flight(chunk(1))["prompt_id"] == "p1"
+
+    # 続きを追記しても、壊れた行に繋がらずに読み直せる
+    replayed.record(chunk(1), "failed", error="boom")
+    again = ChunkJournal(work)
+    assert again.get(chunk(1))["state"] == "failed"
+    assert again.done_output(chunk(0)) == path
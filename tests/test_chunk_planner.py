@@ -0,0 +1,96 @@
+"""chunk_planner: 境界の寄せ方、失敗チャンクの分割、パーツ名からの並び順"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from chunk_planner import plan_chunks, split_chunk, part_name, part_key, chunk_key
+
+
+def covers(chunks, total):
+    """隙間も重なりもなく 0..total を覆っているか"""
+    pos = 0
+    for c in chunks:
+        if c["start_frame"] != pos or c["frame_cap"] <= 0:
+            return False
+        pos += c["frame_cap"]
+    return pos == total
+
+
+def test_plan_without_keyframes_uses_fixed_size():
+    chunks = plan_chunks(250, 30.0, 100)
+    assert [c["frame_cap"] for c in chunks] == [100, 100, 50]
+    assert covers(chunks, 250)
+    assert chunks[1]["start_time"] == round(100 / 30, 6)
+    assert all(c["boundary"] is None for c in chunks)
+
+
+def test_plan_snaps_back_to_nearest_keyframe_within_tolerance():
+    keyframes = [[0, 0.0], [85, 2.836], [95, 3.17], [190, 6.34]]
+    chunks = plan_chunks(300, 30.0, 100, keyframes, tolerance=0.2)
+    # 100 の手前 20 フレーム以内で一番近い 95、次は 195 の手前の 190
+    assert [c["start_frame"] for c in chunks] == [0, 95, 190, 290]
+    assert [c["boundary"] for c in chunks] == ["keyframe", "keyframe", None, None]
+    # キーフレームの時刻は fps から計算せず実際の pts を使う
+    assert chunks[1]["start_time"] == 3.17
+    assert covers(chunks, 300)
+
+
+def test_plan_never_exceeds_chunk_size_or_snaps_past_tolerance():
+    keyframes = [[0, 0.0], [50, 1.667], [105, 3.5]]
+    chunks = plan_chunks(300, 30.0, 100, keyframes, tolerance=0.2)
+    assert chunks[0]["frame_cap"] == 100          # 50 は 20% より遠いので寄せない
+    assert chunks[0]["boundary"] is None
+    assert max(c["frame_cap"] for c in chunks) <= 100
+
+
+def test_plan_prefers_scene_cut_over_keyframe():
+    chunks = plan_chunks(200, 30.0, 100, keyframes=[[98, 3.267]], scene_cuts=[90], tolerance=0.2)
+    assert chunks[1]["start_frame"] == 90
+    assert chunks[0]["boundary"] == "scene"
+
+
+def test_split_chunk_ranges_are_contiguous():
+    chunk = plan_chunks(300, 30.0, 100)[1]
+    first, second = split_chunk(chunk)
+    assert (first["start_frame"], first["frame_cap"], first["split"]) == (100, 50, "a")
+    assert (second["start_frame"], second["frame_cap"], second["split"]) == (150, 50, "b")
+    assert first["end_time"] == second["start_time"]
+    assert first["start_time"] == chunk["start_time"] and second["end_time"] == chunk["end_time"]
+
+
+def test_split_chunk_odd_frames_and_nested_suffixes():
+    chunk = {**plan_chunks(300, 30.0, 101)[0], "split": "a"}
+    first, second = split_chunk(chunk)
+    assert first["frame_cap"] + second["frame_cap"] == 101
+    assert second["start_frame"] == first["start_frame"] + first["frame_cap"]
+    assert (first["split"], second["split"]) == ("aa", "ab")
+
+
+def test_split_chunk_refuses_below_minimum():
+    assert split_chunk({**plan_chunks(20, 30.0, 20)[0]}) is None
+
+
+def test_part_key_parses_saver_filenames():
+    assert part_key("part_005_00001.mp4") == (5, "")
+    assert part_key("part_005_a_00001.mp4") == (5, "a")
+    assert part_key("part_012_ab_00003.mp4") == (12, "ab")
+    assert part_key("/out/run/part_000.mp4") == (0, "")
+    assert part_key("merged.mp4") is None
+
+
+def test_part_key_matches_chunk_key_of_split_chunks():
+    chunk = plan_chunks(300, 30.0, 100)[2]
+    for half in split_chunk(chunk):
+        for quarter in split_chunk(half):
+            assert part_key(f"{part_name(quarter)}_00001.mp4") == chunk_key(quarter)
+
+
+def test_part_key_order_is_playback_order():
+    chunks = plan_chunks(400, 30.0, 100)
+    first, second = split_chunk(chunks[1])
+    aa, ab = split_chunk(first)
+    playback = [chunks[0], aa, ab, second, chunks[2], chunks[3]]
+    names = [f"{part_name(c)}_00001.mp4" for c in playback]
+    assert sorted(names[::-1], key=part_key) == names
+    assert [c["start_frame"] for c in playback] == sorted(c["start_frame"] for c in playback)
@@ -0,0 +1,219 @@
+import threading
+import time
+from collections import deque
+
+import comfy_client
+from chunk_planner import MIN_CHUNK_SIZE, MAX_CHUNK_SIZE
+
+# ================= 設定エリア =================
+SAMPLE_WINDOWS = 3            # 1本あたりの試し描きの数（動画全体から等間隔に取る。1回目はモデル読み込み込みとして見積もりから外す）
+SAMPLE_FRAMES = 24            # 試し描き1回のフレーム数。1倍/2倍を交互にして、1プロンプトごとの固定時間と1フレームあたりの時間を分ける
+MEMORY_POLL_INTERVAL = 0.25   # 試し描き中に /system_stats を確認する間隔（秒）
+MEMORY_HEADROOM = 0.85        # 推奨チャンク長は、見積もったピークがメモリ全体のこの割合に収まる長さ
+ETA_PRINT_INTERVAL = 30.0     # 本番の実行中に残り時間を表示する間隔（秒。0 ならチャンクが終わるたび）
+ETA_WINDOW = 20               # 残り時間は直近この数のチャンクの処理速度から出す
+# ============================================
+
+MEMORY_KINDS = ("ram", "vram")
+
+def sample_windows(total_frames, windows=SAMPLE_WINDOWS, frames=SAMPLE_FRAMES):
+    """試し描きする範囲 [(開始フレーム, フレーム数)]。動画全体から等間隔に取る"""
+    result = []
+    for i in range(windows):
+        count = min(frames * (1 + i % 2), total_frames)
+        center = int(total_frames * (i + 0.5) / windows)
+        start = max(0, min(total_frames - count, center - count // 2))
+        if count > 0:
+            result.append((start, count))
+    return result
+
+class MemorySampler:
+    """試し描きの間 /system_stats を見張り、RAM / VRAM の開始時の使用量とピークを記録する"""
+
+    def __init__(self, server_url, interval=MEMORY_POLL_INTERVAL):
+        self.server_url = server_url
+        self.interval = interval
+        self.base = None
+        self.peak = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __enter__(self):
+        self.base = comfy_client.get_system_stats(self.server_url)
+        self.peak = dict(self.base) if self.base else None
+        if self.base:
+            self._thread = threading.Thread(target=self._poll, daemon=True)
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self._sample()   # キャッシュに残ったまま解放されない分も拾う
+
+    def _poll(self):
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def _sample(self):
+        stats = comfy_client.get_system_stats(self.server_url)
+        if stats and self.peak:
+            for kind in MEMORY_KINDS:
+                self.peak[f"{kind}_used"] = max(self.peak[f"{kind}_used"], stats[f"{kind}_used"])
+
+    def fields(self):
+        """サンプルの dict に足す値: {"ram_base", "ram_peak", "ram_total", "vram_base", ...}。測れなければ空"""
+        if not self.base:
+            return {}
+        out = {}
+        for kind in MEMORY_KINDS:
+            if self.base[f"{kind}_total"]:
+                out[f"{kind}_base"] = self.base[f"{kind}_used"]
+                out[f"{kind}_peak"] = self.peak[f"{kind}_used"]
+                out[f"{kind}_total"] = self.base[f"{kind}_total"]
+        return out
+
+def fit_line(points):
+    """[(x, y)] に y = a + b*x を最小二乗で当てはめて (a, b)。x が1種類しかなければ原点を通る直線"""
+    xs = [x for x, _ in points]
+    ys = [y for _, y in points]
+    if not points or sum(xs) <= 0:
+        return 0.0, 0.0
+    mean_x, mean_y = sum(xs) / len(xs), sum(ys) / len(ys)
+    var = sum((x - mean_x) ** 2 for x in xs)
+    if var == 0:
+        return 0.0, sum(ys) / sum(xs)
+    slope = sum((x - mean_x) * (y - mean_y) for x, y in points) / var
+    return mean_y - slope * mean_x, slope
+
+def summarize(samples, chunk_caps, servers=1, chunk_size=None):
+    """試し描きの結果から見積もりを作る。
+    samples: [{"frames", "seconds", ("ram_base", "ram_peak", "ram_total", ...)}]、chunk_caps: 本番のチャンクごとのフレーム数"""
+    # 1回目はモデル読み込みを含むので、残りが2回以上あれば外す
+    warm = samples[1:] if len(samples) > 2 else samples
+    per_prompt, sec_per_frame = fit_line([(s["frames"], s["seconds"]) for s in warm])
+    if sec_per_frame <= 0 or per_prompt < 0:
+        per_prompt, sec_per_frame = 0.0, sum(s["seconds"] for s in warm) / sum(s["frames"] for s in warm)
+    servers = max(1, servers)
+    frames = sum(chunk_caps)
+    largest = max(chunk_caps, default=0)
+
+    memory = {}
+    limits = []
+    for kind in MEMORY_KINDS:
+        measured = [s for s in warm if f"{kind}_total" in s]
+        if not measured:
+            continue
+        fixed, per_frame = fit_line([(s["frames"], s[f"{kind}_peak"] - s[f"{kind}_base"]) for s in measured])
+        base = measured[-1][f"{kind}_base"]
+        total = measured[-1][f"{kind}_total"]
+        info = {"base": base, "total": total, "per_frame": per_frame,
+                "peak_at_chunk": base + max(0.0, fixed) + max(0.0, per_frame) * largest}
+        if per_frame > 0:
+            info["max_frames"] = int((total * MEMORY_HEADROOM - base - max(0.0, fixed)) / per_frame)
+            limits.append(info["max_frames"])
+        memory[kind] = info
+
+    recommended = None
+    if limits:
+        recommended = max(MIN_CHUNK_SIZE, min(MAX_CHUNK_SIZE, min(limits)))
+    estimate = {
+        "frames": frames,
+        "chunks": len(chunk_caps),
+        "chunk_size": chunk_size,
+        "largest_chunk": largest,
+        "servers": servers,
+        "first_prompt": samples[0]["seconds"] if samples else None,
+        "per_prompt": per_prompt,
+        "sec_per_frame": sec_per_frame,
+        "eta": sum(per_prompt + sec_per_frame * cap for cap in chunk_caps) / servers,
+        "memory": memory,
+        "fits": all(m["peak_at_chunk"] <= m["total"] * MEMORY_HEADROOM for m in memory.values()),
+        "recommended_chunk": recommended,
+        "eta_recommended": None,
+    }
+    if recommended:
+        count = -(-frames // recommended)
+        estimate["eta_recommended"] = (per_prompt * count + sec_per_frame * frames) / servers
+    return estimate
+
+def format_duration(seconds):
+    seconds = int(round(seconds))
+    if seconds >= 3600:
+        return f"{seconds // 3600}h{seconds % 3600 // 60:02d}m"
+    if seconds >= 60:
+        return f"{seconds // 60}m{seconds % 60:02d}s"
+    return f"{seconds}s"
+
+def _gb(nbytes):
+    return f"{nbytes / 1024 ** 3:.1f} GB"
+
+def print_estimate(estimate):
+    e = estimate
+    print(f"   -----------------------------")
+    print(f"   [Dry Run] {e.get('video', '')}")
+    print(f"   Speed:    {e['sec_per_frame'] * 1000:.0f} ms/frame + {e['per_prompt']:.1f}s per chunk "
+          f"(first prompt {e['first_prompt']:.1f}s incl. model load)")
+    print(f"   Plan:     {e['frames']} frames in {e['chunks']} chunks of {e['chunk_size']} on {e['servers']} server(s)")
+    print(f"   ETA:      {format_duration(e['eta'])} (GPU time, without CFR conversion and merge)")
+    for kind, m in e["memory"].items():
+        print(f"   {kind.upper() + ':':<9} {_gb(m['base'])} idle, ~{m['per_frame'] / 1024 ** 2:.1f} MB/frame, "
+              f"peak ~{_gb(m['peak_at_chunk'])} of {_gb(m['total'])} at {e['largest_chunk']} frames")
+    if not e["memory"]:
+        print("   Memory:   not measured (/system_stats unavailable)")
+    elif not e["fits"]:
+        print(f"   ⚠️ CHUNK_SIZE {e['chunk_size']} may run out of memory.")
+    if e["recommended_chunk"]:
+        print(f"   Suggested CHUNK_SIZE: {e['recommended_chunk']} (ETA {format_duration(e['eta_recommended'])})")
+    print(f"   -----------------------------")
+
+def print_batch(estimates):
+    """batch_run のドライラン: 動画ごとの見積もりを合計する"""
+    if not estimates:
+        return
+    total = sum(e["eta"] for e in estimates)
+    recommended = [e["recommended_chunk"] for e in estimates if e["recommended_chunk"]]
+    print(f"\n📋 === Dry run: {len(estimates)} videos ===")
+    for e in estimates:
+        print(f"   - {e['video']}: {e['frames']} frames, ETA {format_duration(e['eta'])}"
+              + ("" if e["fits"] else "  ⚠️ may run out of memory"))
+    finish = time.strftime("%Y-%m-%d %H:%M", time.localtime(time.time() + total))
+    print(f"   Total ETA: {format_duration(total)} of GPU time (done around {finish} if started now)")
+    if recommended:
+        print(f"   Suggested CHUNK_SIZE for the whole batch: {min(recommended)}")
+
+class EtaTracker:
+    """本番の実行中に、終わったチャンクの実績（直近 ETA_WINDOW 個の処理速度）から残り時間を見積もり直す"""
+
+    def __init__(self, interval=ETA_PRINT_INTERVAL, window=ETA_WINDOW):
+        self.interval = interval
+        self.started = time.time()
+        self.recent = deque(maxlen=window)   # [(完了時刻, フレーム数)]
+        self.frames = 0
+        self.last_print = 0.0
+
+    def add(self, frames):
+        self.recent.append((time.time(), frames))
+        self.frames += frames
+
+    def fps(self):
+        """直近のチャンクの完了間隔から出した処理速度。まだ少なければ開始からの平均"""
+        if len(self.recent) >= 3 and self.recent[-1][0] > self.recent[0][0]:
+            return sum(f for _, f in list(self.recent)[1:]) / (self.recent[-1][0] - self.recent[0][0])
+        elapsed = time.time() - self.started
+        return self.frames / elapsed if self.frames and elapsed > 0 else None
+
+    def eta(self, remaining_frames):
+        fps = self.fps()
+        return remaining_frames / fps if fps else None
+
+    def report(self, remaining_frames, label=""):
+        """前回の表示から interval 秒以上経っていれば、残り時間の表示用の1行を返す（まだなら None）"""
+        now = time.time()
+        eta = self.eta(remaining_frames)
+        if eta is None or now - self.last_print < self.interval:
+            return None
+        self.last_print = now
+        finish = time.strftime("%H:%M", time.localtime(now + eta))
+        return f"⏳ {label}{self.fps():.1f} fps, {remaining_frames} frames left, ETA {format_duration(eta)} (~{finish})"